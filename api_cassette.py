@@ -0,0 +1,285 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+from types import SimpleNamespace
+
+from concurrency_limiter import is_rate_limit_error
+
+# 启用录制/回放的环境变量：录制文件路径，以及模式（replay、record或auto）
+CASSETTE_ENV_VAR = "ZHIPU_CASSETTE"
+CASSETTE_MODE_ENV_VAR = "ZHIPU_CASSETTE_MODE"
+
+# replay只回放，缺少录制时报错且不联网；record总是调用接口并覆盖录制；auto有录制时回放，否则调用接口并录制
+CASSETTE_MODES = ("replay", "record", "auto")
+
+CASSETTE_VERSION = 1
+
+# 累积这么多条新录制后写入一次录制文件，其余在flush、close或程序退出时写入
+SAVE_INTERVAL = 20
+
+# 由请求本身决定、重发也会得到相同结果的错误（请求格式错误、模型不存在、输入过长等），只录制这些错误；
+# 认证错误取决于密钥（不在录制的键中），限流、超时、连接错误和5xx错误都是暂时的
+RECORDED_ERROR_STATUS_CODES = (400, 404, 413, 422)
+
+
+# from_env创建的录制：{(录制文件绝对路径, 模式): Cassette}
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+class CassetteMissError(Exception):
+    """回放模式下没有找到与请求对应的录制"""
+
+
+class ReplayedAPIError(Exception):
+    """回放录制时接口返回的错误"""
+
+    def __init__(self, message, error_type=None, status_code=None):
+        super().__init__(message)
+        self.error_type = error_type
+        self.status_code = status_code
+
+
+def normalize_request(params):
+    """
+    规范化请求参数：统一换行并去掉消息首尾空白，按键排序，不包含API密钥
+
+    Args:
+        params: 传给chat.completions.create的参数
+
+    Returns:
+        str: 规范化后的JSON文本
+    """
+    normalized = dict(params)
+    normalized["messages"] = [
+        {"role": message["role"], "content": message["content"].replace("\r\n", "\n").strip()}
+        for message in params.get("messages", [])
+    ]
+    return json.dumps(normalized, ensure_ascii=False, sort_keys=True)
+
+
+def request_key(params):
+    """
+    Args:
+        params: 传给chat.completions.create的参数
+
+    Returns:
+        str: 请求的哈希，作为录制的键
+    """
+    return hashlib.sha1(normalize_request(params).encode("utf-8")).hexdigest()
+
+
+def _serialize_response(response):
+    usage = getattr(response, "usage", None)
+    return {
+        "content": response.choices[0].message.content,
+        "model": getattr(response, "model", None),
+        "usage": {
+            "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+            "completion_tokens": getattr(usage, "completion_tokens", 0) or 0
+        }
+    }
+
+
+def _status_code(error):
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code
+
+
+def _serialize_error(error):
+    return {"type": type(error).__name__, "message": str(error), "status_code": _status_code(error)}
+
+
+def is_deterministic_status(status_code):
+    """
+    Args:
+        status_code: 接口返回的HTTP状态码，可以为None
+
+    Returns:
+        bool: 是否为由请求本身决定、重发也会得到的错误（RECORDED_ERROR_STATUS_CODES）
+    """
+    return status_code in RECORDED_ERROR_STATUS_CODES
+
+
+def is_deterministic_error(error):
+    """
+    判断接口错误是否由请求本身决定，重发同一请求也会失败
+
+    Args:
+        error: 调用接口时抛出的异常
+
+    Returns:
+        bool: 是否为RECORDED_ERROR_STATUS_CODES中的4xx错误；没有状态码的异常（连接错误、超时等）不是
+    """
+    return is_deterministic_status(_status_code(error)) and not is_rate_limit_error(error)
+
+
+def _replay(entry):
+    """把录制还原为与接口响应结构相同的对象，或抛出录制的错误"""
+    if "error" in entry:
+        error = entry["error"]
+        raise ReplayedAPIError(error["message"], error.get("type"), error.get("status_code"))
+    response = entry["response"]
+    usage = response.get("usage", {})
+    return SimpleNamespace(
+        model=response.get("model"),
+        choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=response["content"]))],
+        usage=SimpleNamespace(
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+            total_tokens=usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0)
+        )
+    )
+
+
+class Cassette:
+    """
+    对话补全请求的录制和回放
+
+    请求按规范化后的参数（模型、消息和采样参数）哈希为键，响应和由请求本身决定的接口错误（见
+    is_deterministic_error）会被录制，暂时性的错误不录制，下次运行时重新发送；
+    回放时返回结构与接口响应相同的对象，结果确定且不需要联网。同一个录制文件可以被多个线程共享。
+    新录制每SAVE_INTERVAL条写入一次录制文件，其余在flush、close或程序退出时写入。
+    """
+
+    def __init__(self, path, mode="auto"):
+        """
+        打开录制文件
+
+        Args:
+            path: 录制文件路径（JSON），不存在时在第一次录制时创建
+            mode: "replay"、"record"或"auto"
+        """
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"不支持的录制模式: {mode}，可选: {', '.join(CASSETTE_MODES)}")
+        self.path = path
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._interactions = {}
+        self._unsaved = 0
+        self.hits = 0
+        self.recorded = 0
+        if mode != "record" and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == CASSETTE_VERSION:
+                self._interactions = data.get("interactions", {})
+        if mode != "replay":
+            atexit.register(self.flush)
+
+    @classmethod
+    def from_env(cls):
+        """
+        从环境变量创建录制；同一录制文件和模式的客户端共用一个录制，写入时不会互相覆盖
+
+        Returns:
+            Cassette: 设置了ZHIPU_CASSETTE时返回录制，否则返回None
+        """
+        path = os.getenv(CASSETTE_ENV_VAR)
+        if not path:
+            return None
+        key = (os.path.abspath(path), os.getenv(CASSETTE_MODE_ENV_VAR) or "auto")
+        with _shared_lock:
+            if key not in _shared:
+                _shared[key] = cls(path, key[1])
+            return _shared[key]
+
+    def __len__(self):
+        return len(self._interactions)
+
+    def _lookup(self, params):
+        key = request_key(params)
+        with self._lock:
+            entry = self._interactions.get(key) if self.mode != "record" else None
+            if entry is not None:
+                self.hits += 1
+        if entry is None and self.mode == "replay":
+            raise CassetteMissError(f"录制文件中没有该请求（{key[:12]}），请先用record或auto模式联网录制: {self.path}")
+        return key, entry
+
+    def _store(self, key, params, entry):
+        entry["request"] = json.loads(normalize_request(params))
+        with self._lock:
+            self._interactions[key] = entry
+            self.recorded += 1
+            self._unsaved += 1
+            if self._unsaved >= SAVE_INTERVAL:
+                self._save_locked()
+
+    def flush(self):
+        """把尚未写入的录制写入录制文件"""
+        with self._lock:
+            if self._unsaved:
+                self._save_locked()
+
+    def close(self):
+        """写入剩余的录制"""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _save_locked(self):
+        # 先写临时文件再替换，避免留下写了一半的录制
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": CASSETTE_VERSION, "interactions": self._interactions}, f,
+                      ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+        self._unsaved = 0
+
+    def fetch(self, params, send):
+        """
+        回放录制的响应，没有录制时调用send发送请求并录制结果
+
+        Args:
+            params: 请求参数
+            send: 无参数函数，实际调用接口并返回响应
+
+        Returns:
+            接口响应（回放时为结构相同的对象）
+        """
+        key, entry = self._lookup(params)
+        if entry is not None:
+            return _replay(entry)
+        try:
+            response = send()
+        except Exception as e:
+            if is_deterministic_error(e):
+                self._store(key, params, {"error": _serialize_error(e)})
+            raise
+        self._store(key, params, {"response": _serialize_response(response)})
+        return response
+
+    async def fetch_async(self, params, send):
+        """
+        fetch的异步版本
+
+        Args:
+            params: 请求参数
+            send: 无参数函数，返回实际调用接口的协程
+
+        Returns:
+            接口响应（回放时为结构相同的对象）
+        """
+        key, entry = self._lookup(params)
+        if entry is not None:
+            return _replay(entry)
+        try:
+            response = await send()
+        except Exception as e:
+            if is_deterministic_error(e):
+                self._store(key, params, {"error": _serialize_error(e)})
+            raise
+        self._store(key, params, {"response": _serialize_response(response)})
+        return response
@@ -0,0 +1,208 @@
+import io
+import os
+import posixpath
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+
+from cancellation import write_file_atomic
+
+# 支持直接读取和写入的归档格式
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+# 复制归档成员时每次读取的字节数
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def is_archive(path):
+    """
+    Args:
+        path: 文件路径
+
+    Returns:
+        bool: 是否是支持的ZIP/TAR归档
+    """
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def safe_member_path(name):
+    """
+    规范化归档成员路径，去掉开头的斜杠和".."，防止输出写到目标目录之外
+
+    Args:
+        name: 归档中的成员路径
+
+    Returns:
+        str: 使用"/"分隔的相对路径
+    """
+    parts = [part for part in posixpath.normpath(name.replace("\\", "/")).split("/") if part not in ("", ".", "..")]
+    return "/".join(parts)
+
+
+def output_name_for(member_name):
+    """
+    Args:
+        member_name: 归档中PDF成员的路径
+
+    Returns:
+        str: 对应Markdown输出的相对路径（与PDF同名，扩展名为.md）
+    """
+    return posixpath.splitext(safe_member_path(member_name))[0] + ".md"
+
+
+def _tar_mode(path, writing):
+    lower = path.lower()
+    if lower.endswith((".tar.gz", ".tgz")):
+        compression = "gz"
+    elif lower.endswith((".tar.bz2", ".tbz2")):
+        compression = "bz2"
+    elif lower.endswith((".tar.xz", ".txz")):
+        compression = "xz"
+    else:
+        compression = ""
+    if writing:
+        return f"w:{compression}" if compression else "w"
+    # 流式读取，按顺序解压一遍，不需要随机访问
+    return f"r|{compression or '*'}"
+
+
+def iter_archive_pdfs(archive_path):
+    """
+    按归档中的顺序依次读取PDF成员，不把整个归档解压到磁盘
+
+    TAR以流式方式读取，每个成员的文件对象只在下一次迭代之前有效。
+
+    Args:
+        archive_path: ZIP或TAR归档路径
+
+    Yields:
+        tuple: (成员路径, 可读取成员内容的文件对象, 成员大小)
+    """
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(".pdf"):
+                    continue
+                with archive.open(info) as member:
+                    yield info.filename, member, info.file_size
+        return
+
+    try:
+        archive = tarfile.open(archive_path, _tar_mode(archive_path, writing=False))
+    except tarfile.TarError as e:
+        raise ValueError(f"无法读取归档文件: {archive_path} - {str(e)}")
+    with archive:
+        for info in archive:
+            if not info.isfile() or not info.name.lower().endswith(".pdf"):
+                continue
+            member = archive.extractfile(info)
+            if member is not None:
+                yield info.name, member, info.size
+
+
+class StagedMember:
+    """
+    把一个归档成员写入临时目录，供需要文件路径的PDF解析使用，用完即删
+
+    临时目录中只有这一个文件，且文件名与成员的文件名相同，输出中的标题因此保持不变；
+    同一时刻磁盘上只保留正在处理的成员，临时占用与归档大小无关。
+    """
+
+    def __init__(self, member_name, member, directory=None):
+        """
+        复制成员内容到临时文件
+
+        Args:
+            member_name: 归档中的成员路径
+            member: 可读取成员内容的文件对象
+            directory: 临时目录的上级目录，为None时使用系统临时目录
+        """
+        self.member_name = member_name
+        self._directory = tempfile.mkdtemp(prefix="pdf_member_", dir=directory)
+        self.path = os.path.join(self._directory, posixpath.basename(safe_member_path(member_name)) or "document.pdf")
+        try:
+            with open(self.path, "wb") as f:
+                shutil.copyfileobj(member, f, COPY_BUFFER_SIZE)
+        except Exception:
+            self.cleanup()
+            raise
+
+    def cleanup(self):
+        """删除临时文件"""
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cleanup()
+
+
+class OutputSink:
+    """
+    归档处理结果的写入目标：目录或输出归档（.zip/.tar/.tar.gz等）
+
+    写入目录时按成员的相对路径创建子目录；写入归档时多个线程可以同时调用write。
+    """
+
+    def __init__(self, target):
+        """
+        打开写入目标
+
+        Args:
+            target: 输出目录路径，或以归档扩展名结尾的输出归档路径
+        """
+        self.target = target
+        self._lock = threading.Lock()
+        self._archive = None
+        if is_archive(target):
+            if target.lower().endswith(".zip"):
+                self._archive = zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED)
+            else:
+                self._archive = tarfile.open(target, _tar_mode(target, writing=True))
+        else:
+            os.makedirs(target, exist_ok=True)
+
+    def write(self, name, content):
+        """
+        写入一个输出文件
+
+        Args:
+            name: 相对路径，例如 "reports/a.md"
+            content: 文本内容
+
+        Returns:
+            str: 输出位置，写入归档时为 "归档路径!相对路径"
+        """
+        name = safe_member_path(name)
+        data = content.encode("utf-8")
+        if self._archive is None:
+            path = os.path.join(self.target, *name.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_file_atomic(path, data)
+            return path
+
+        with self._lock:
+            if isinstance(self._archive, zipfile.ZipFile):
+                self._archive.writestr(name, data)
+            else:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = int(time.time())
+                self._archive.addfile(info, io.BytesIO(data))
+        return f"{self.target}!{name}"
+
+    def close(self):
+        """关闭输出归档"""
+        if self._archive is not None:
+            with self._lock:
+                self._archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,346 @@
+import argparse
+import glob
+import json
+import os
+import re
+import time
+
+import zhipuai
+from dotenv import load_dotenv
+
+from api_cassette import Cassette, is_deterministic_status, request_key
+from cancellation import Cancelled, write_file_atomic
+
+# 批处理请求文件中每个请求的接口地址（智谱AI批处理接口与OpenAI的格式相同）
+BATCH_ENDPOINT = "/v4/chat/completions"
+
+# 批处理任务的完成时限
+DEFAULT_COMPLETION_WINDOW = "24h"
+
+# 工作目录中的文件：每一轮的请求文件，以及已导入的结果（录制格式）
+REQUESTS_FILE_PATTERN = "requests-{:03d}.jsonl"
+RESULTS_FILE = "results.json"
+
+# 暂时失败（限流、超时、5xx、过期等）、需要在下一轮重新提交的请求
+RETRY_FILE = "retry.json"
+
+# 批处理任务结束的状态
+FINISHED_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchPending(Cancelled):
+    """文档的模型请求已加入批处理，导入批处理结果后再继续处理该文档"""
+
+
+def run_all(*calls):
+    """
+    依次执行互不依赖的调用；某个调用的请求加入批处理时仍然执行其余调用，让它们在同一轮中提交
+
+    Args:
+        *calls: 无参数函数
+
+    Returns:
+        list: 各调用的返回值
+    """
+    results = []
+    pending = None
+    for call in calls:
+        try:
+            results.append(call())
+        except BatchPending as e:
+            pending = pending or e
+    if pending is not None:
+        raise pending
+    return results
+
+
+def _round_number(path):
+    match = re.search(r"requests-(\d+)\.jsonl$", path)
+    return int(match.group(1)) if match else 0
+
+
+def _entry_from_result(line):
+    """
+    把批处理结果文件中的一行转换为录制格式
+
+    Returns:
+        tuple: (custom_id, 录制条目)；暂时性的失败（不是由请求本身决定的错误）录制条目为None
+    """
+    custom_id = line["custom_id"]
+    response = line.get("response") or {}
+    body = response.get("body") or {}
+    error = line.get("error") or body.get("error")
+    status_code = response.get("status_code")
+    if error or (status_code is not None and status_code != 200):
+        if not is_deterministic_status(status_code):
+            return custom_id, None
+        error = error or {}
+        return custom_id, {"error": {"type": error.get("code") or error.get("type"),
+                                     "message": error.get("message") or f"批处理请求失败（{status_code}）",
+                                     "status_code": status_code}}
+    usage = body.get("usage") or {}
+    return custom_id, {"response": {
+        "content": body["choices"][0]["message"]["content"],
+        "model": body.get("model"),
+        "usage": {"prompt_tokens": usage.get("prompt_tokens", 0) or 0,
+                  "completion_tokens": usage.get("completion_tokens", 0) or 0}
+    }}
+
+
+def _result_line(custom_id, response=None, error=None):
+    """构建与批处理结果文件格式相同的一行"""
+    if error is not None:
+        status_code = getattr(error, "status_code", None) or 500
+        body = {"error": {"code": type(error).__name__, "message": str(error)}}
+    else:
+        status_code = 200
+        usage = getattr(response, "usage", None)
+        body = {
+            "model": getattr(response, "model", None),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": response.choices[0].message.content}}],
+            "usage": {"prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+                      "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+                      "total_tokens": getattr(usage, "total_tokens", 0) or 0}
+        }
+    return {"custom_id": custom_id, "response": {"status_code": status_code, "body": body}}
+
+
+class BatchJob(Cassette):
+    """
+    两阶段的离线批处理
+
+    作为ZhipuAI的录制使用：已导入结果的请求直接回放，其余请求不发送，而是记入待提交列表，
+    相应的文档抛出BatchPending后被跳过。write_requests把待提交的请求写成批处理请求文件（JSONL），
+    custom_id为规范化请求的哈希，同一请求在不同轮次中保持不变；ingest导入批处理接口返回的结果文件，
+    暂时失败的请求不导入，而是在下一轮的请求文件中重新提交。
+    分块文档的汇总请求依赖分块总结，需要在导入分块结果后的下一轮中提交。
+    """
+
+    def __init__(self, directory):
+        """
+        打开批处理工作目录
+
+        Args:
+            directory: 工作目录，保存每一轮的请求文件和已导入的结果，不存在时创建
+        """
+        os.makedirs(directory, exist_ok=True)
+        super().__init__(os.path.join(directory, RESULTS_FILE), mode="auto")
+        self.directory = directory
+        self.pending = {}
+        self.retry = set()
+        retry_path = os.path.join(directory, RETRY_FILE)
+        if os.path.exists(retry_path):
+            with open(retry_path, "r", encoding="utf-8") as f:
+                self.retry = set(json.load(f))
+
+    def _save_retry_locked(self):
+        write_file_atomic(os.path.join(self.directory, RETRY_FILE), json.dumps(sorted(self.retry)))
+
+    def fetch(self, params, send):
+        """
+        回放已导入的结果，没有结果时记入待提交列表并抛出BatchPending
+
+        Args:
+            params: 请求参数
+            send: 不会被调用，批处理模式下不直接调用接口
+
+        Returns:
+            回放的响应
+        """
+        return super().fetch(params, lambda: self._defer(params))
+
+    async def fetch_async(self, params, send):
+        """fetch的异步版本"""
+        return self.fetch(params, send)
+
+    def _defer(self, params):
+        key = request_key(params)
+        with self._lock:
+            self.pending[key] = params
+        raise BatchPending(f"等待批处理结果（请求{key[:12]}）")
+
+    def request_files(self):
+        """
+        Returns:
+            list: 工作目录中按轮次排列的请求文件
+        """
+        return sorted(glob.glob(os.path.join(self.directory, "requests-*.jsonl")), key=_round_number)
+
+    def _submitted(self):
+        """已写入请求文件的请求：{custom_id: 最近一次写入的请求文件}"""
+        submitted = {}
+        for path in self.request_files():
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        submitted[json.loads(line)["custom_id"]] = path
+        return submitted
+
+    def outstanding(self):
+        """
+        Returns:
+            dict: 已写入请求文件但还没有导入结果的请求，{custom_id: 请求文件}
+        """
+        with self._lock:
+            answered = set(self._interactions) | self.retry
+        return {custom_id: path for custom_id, path in self._submitted().items() if custom_id not in answered}
+
+    def write_requests(self):
+        """
+        把待提交的请求写入下一轮的请求文件；已经写入之前请求文件、尚未导入结果的请求不会重复写入
+        （需要重新提交时删除对应的请求文件即可），暂时失败的请求重新写入
+
+        Returns:
+            str: 新的请求文件路径，没有需要提交的新请求时为None
+        """
+        submitted = self._submitted()
+        with self._lock:
+            pending = {key: params for key, params in self.pending.items()
+                       if (key not in submitted or key in self.retry) and key not in self._interactions}
+            self.pending = {}
+        if not pending:
+            return None
+        files = self.request_files()
+        path = os.path.join(self.directory, REQUESTS_FILE_PATTERN.format(_round_number(files[-1]) + 1 if files else 1))
+        lines = [
+            json.dumps({"custom_id": key, "method": "POST", "url": BATCH_ENDPOINT, "body": params},
+                       ensure_ascii=False, sort_keys=True)
+            for key, params in sorted(pending.items())
+        ]
+        write_file_atomic(path, "\n".join(lines) + "\n")
+        with self._lock:
+            self.retry -= set(pending)
+            self._save_retry_locked()
+        return path
+
+    def ingest(self, results_path):
+        """
+        导入批处理结果文件（批处理接口的输出文件或错误文件）。由请求本身决定的错误回放时抛出；
+        暂时性的失败（限流、超时、5xx、任务过期等）不导入，记入retry，下一轮重新提交
+
+        Args:
+            results_path: 结果文件路径（JSONL）
+
+        Returns:
+            int: 导入的结果数
+        """
+        entries = {}
+        retry = set()
+        with open(results_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    custom_id, entry = _entry_from_result(json.loads(line))
+                    if entry is None:
+                        retry.add(custom_id)
+                    else:
+                        entries[custom_id] = entry
+        with self._lock:
+            self._interactions.update(entries)
+            self.retry = (self.retry | retry) - set(entries)
+            self._save_locked()
+            self._save_retry_locked()
+        return len(entries)
+
+
+def complete_locally(requests_path, results_path, respond):
+    """
+    在本地完成一个请求文件，按批处理接口的格式写出结果文件，用于测试或不使用批处理接口的小规模运行
+
+    Args:
+        requests_path: 请求文件路径
+        results_path: 结果文件路径
+        respond: 接收请求体（dict）并返回对话补全响应的函数，例如通过ZhipuAI逐个调用接口
+
+    Returns:
+        str: 结果文件路径
+    """
+    lines = []
+    with open(requests_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            try:
+                result = _result_line(request["custom_id"], response=respond(request["body"]))
+            except Exception as e:
+                result = _result_line(request["custom_id"], error=e)
+            lines.append(json.dumps(result, ensure_ascii=False))
+    write_file_atomic(results_path, "\n".join(lines) + "\n")
+    return results_path
+
+
+def submit_batch(client, requests_path, metadata=None):
+    """
+    上传请求文件并创建批处理任务
+
+    Args:
+        client: zhipuai.ZhipuAI客户端
+        requests_path: 请求文件路径
+        metadata: 可选的任务元数据
+
+    Returns:
+        str: 批处理任务ID
+    """
+    with open(requests_path, "rb") as f:
+        uploaded = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(input_file_id=uploaded.id, endpoint=BATCH_ENDPOINT,
+                                  completion_window=DEFAULT_COMPLETION_WINDOW,
+                                  metadata=metadata or {"requests": os.path.basename(requests_path)})
+    return batch.id
+
+
+def download_batch_results(client, batch_id, results_path, wait=False, poll_interval=60):
+    """
+    下载批处理任务的结果文件（包括失败请求的错误），可以直接用BatchJob.ingest导入
+
+    Args:
+        client: zhipuai.ZhipuAI客户端
+        batch_id: 批处理任务ID
+        results_path: 结果文件路径
+        wait: 如果为True，等待任务结束
+        poll_interval: 等待时查询任务状态的间隔（秒）
+
+    Returns:
+        str: 任务状态；任务尚未结束时不写出结果文件
+    """
+    batch = client.batches.retrieve(batch_id)
+    while wait and batch.status not in FINISHED_STATUSES:
+        time.sleep(poll_interval)
+        batch = client.batches.retrieve(batch_id)
+    if batch.status not in FINISHED_STATUSES:
+        return batch.status
+    content = b""
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if file_id:
+            data = client.files.content(file_id).content
+            content += data if data.endswith(b"\n") or not data else data + b"\n"
+    write_file_atomic(results_path, content)
+    return batch.status
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Submit a request file to the ZhipuAI batch API and download its results')
+    commands = parser.add_subparsers(dest='command', required=True)
+    submit_parser = commands.add_parser('submit', help='Upload a request file and create a batch job')
+    submit_parser.add_argument('requests_path', help='Request file written by main.py --batch')
+    fetch_parser = commands.add_parser('fetch', help='Download the results of a batch job')
+    fetch_parser.add_argument('batch_id', help='Batch job ID printed by submit')
+    fetch_parser.add_argument('results_path', help='Where to write the results file')
+    fetch_parser.add_argument('--wait', action='store_true', help='Wait until the batch job has finished')
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = zhipuai.ZhipuAI(api_key=os.getenv("ZHIPU_API_KEY"))
+    if args.command == "submit":
+        print(submit_batch(client, args.requests_path))
+        return
+    status = download_batch_results(client, args.batch_id, args.results_path, wait=args.wait)
+    if status in FINISHED_STATUSES:
+        print(f"{status}: {args.results_path}")
+    else:
+        print(f"{status}, results are not ready yet")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import fnmatch
+import math
+import os
+import threading
+
+from chunk_manifest import MAX_CHUNK_CHARS, SINGLE_REQUEST_CHARS, estimate_merges
+from pdf_reader import PDFReader
+
+# 支持的调度策略
+SCHEDULING_POLICIES = ("listdir", "shortest", "oldest", "priority")
+
+# 中英文混合文本按每个令牌约2个字符估算（偏保守，避免低估预算）
+ESTIMATED_CHARS_PER_TOKEN = 2
+
+# 每次请求发送给模型的文本上限（与ZhipuAI默认max_tokens=2000的截断一致）
+MAX_INPUT_CHARS = SINGLE_REQUEST_CHARS
+
+# 每次请求的系统提示词和指令开销，以及预计的输出长度（令牌）
+PROMPT_OVERHEAD_TOKENS = 200
+EXPECTED_COMPLETION_TOKENS = 1000
+
+# 每个文档的汇总请求数（总结 + 关键概念），分块总结时另有每个分块和每组合并各一次请求
+REQUESTS_PER_DOCUMENT = 2
+
+
+class BudgetExceededError(Exception):
+    """本次运行的令牌或费用预算不足以处理该文档"""
+
+
+class DocumentJob:
+    """
+    待处理的文档及其成本估算
+    """
+
+    def __init__(self, pdf_path, page_count=0, text_chars=0, mtime=0.0, priority=0, chunked=False):
+        """
+        初始化文档任务
+
+        Args:
+            pdf_path: PDF文件路径
+            page_count: 页数
+            text_chars: 估算的文本字符数
+            mtime: 文件修改时间
+            priority: 优先级，数值越大越先处理
+            chunked: 长文档是否按分块map-reduce总结（增量或低内存模式），见estimate_tokens
+        """
+        self.pdf_path = pdf_path
+        self.page_count = page_count
+        self.text_chars = text_chars
+        self.mtime = mtime
+        self.priority = priority
+        self.estimated_tokens = estimate_tokens(text_chars, chunked)
+
+    @property
+    def name(self):
+        return os.path.basename(self.pdf_path)
+
+
+def estimate_tokens(text_chars, chunked=False):
+    """
+    估算处理一个文档所需的令牌总数（输入+输出，所有请求合计）
+
+    不分块时两次请求的输入都是截断后的全文；分块时按与request_planner相同的分块计划估算：
+    每个分块一次请求（合计输入为全文），分块要点放不进一次请求时逐层合并，最后两次汇总请求。
+
+    Args:
+        text_chars: 文档文本字符数
+        chunked: 长文档是否按分块map-reduce总结
+
+    Returns:
+        int: 估算的令牌数
+    """
+    if not chunked or text_chars <= SINGLE_REQUEST_CHARS:
+        input_tokens = min(text_chars, MAX_INPUT_CHARS) // ESTIMATED_CHARS_PER_TOKEN
+        return REQUESTS_PER_DOCUMENT * (PROMPT_OVERHEAD_TOKENS + input_tokens + EXPECTED_COMPLETION_TOKENS)
+
+    chunks = math.ceil(text_chars / MAX_CHUNK_CHARS)
+    merges, merge_chars, reduce_chars = estimate_merges(chunks, EXPECTED_COMPLETION_TOKENS * ESTIMATED_CHARS_PER_TOKEN)
+    requests = chunks + merges + REQUESTS_PER_DOCUMENT
+    input_chars = text_chars + merge_chars + REQUESTS_PER_DOCUMENT * reduce_chars
+    return requests * (PROMPT_OVERHEAD_TOKENS + EXPECTED_COMPLETION_TOKENS) + input_chars // ESTIMATED_CHARS_PER_TOKEN
+
+
+def resolve_priority(file_name, priorities):
+    """
+    根据文件名匹配优先级标签
+
+    Args:
+        file_name: 文件名
+        priorities: {通配符模式: 优先级} 字典，匹配多个模式时取最高优先级
+
+    Returns:
+        int: 优先级，未匹配时为0
+    """
+    matched = [level for pattern, level in (priorities or {}).items() if fnmatch.fnmatch(file_name, pattern)]
+    return max(matched) if matched else 0
+
+
+def build_jobs(pdf_paths, priorities=None, sample_pages=3, extraction_limits=None, chunked=False):
+    """
+    为每个PDF文件估算成本并生成文档任务
+
+    Args:
+        pdf_paths: PDF文件路径列表
+        priorities: {通配符模式: 优先级} 字典
+        sample_pages: 估算文本长度时抽样的页数
+        extraction_limits: 可选的ExtractionLimits，提供时在隔离的工作进程中估算
+        chunked: 长文档是否按分块map-reduce总结
+
+    Returns:
+        list: DocumentJob列表，顺序与输入一致
+    """
+    jobs = []
+    for pdf_path in pdf_paths:
+        try:
+            page_count, text_chars = PDFReader(pdf_path, limits=extraction_limits).estimate_text_length(sample_pages)
+        except Exception as e:
+            # 估算失败时仍然保留任务，交给正常流程报告错误
+            print(f"估算文档成本失败: {os.path.basename(pdf_path)} - {str(e)}")
+            page_count, text_chars = 0, 0
+        jobs.append(DocumentJob(
+            pdf_path,
+            page_count=page_count,
+            text_chars=text_chars,
+            mtime=os.path.getmtime(pdf_path),
+            priority=resolve_priority(os.path.basename(pdf_path), priorities),
+            chunked=chunked
+        ))
+    return jobs
+
+
+def order_jobs(jobs, policy="shortest"):
+    """
+    按调度策略对文档任务排序
+
+    Args:
+        jobs: DocumentJob列表
+        policy: "listdir"（保持原顺序）、"shortest"（预计最短的优先）、
+                "oldest"（修改时间最早的优先）或"priority"（优先级高的优先，同级最短优先）
+
+    Returns:
+        list: 排序后的DocumentJob列表
+    """
+    if policy not in SCHEDULING_POLICIES:
+        raise ValueError(f"不支持的调度策略: {policy}，可选: {', '.join(SCHEDULING_POLICIES)}")
+
+    if policy == "shortest":
+        return sorted(jobs, key=lambda job: (job.estimated_tokens, job.page_count))
+    if policy == "oldest":
+        return sorted(jobs, key=lambda job: job.mtime)
+    if policy == "priority":
+        return sorted(jobs, key=lambda job: (-job.priority, job.estimated_tokens, job.page_count))
+    return list(jobs)
+
+
+class TokenBudget:
+    """
+    单次运行的令牌/费用上限
+
+    开始处理文档前按估算值预留额度，完成后按实际用量结算；
+    已用量加上预留量会超过上限的文档不会被处理。
+    """
+
+    def __init__(self, max_tokens=None, max_cost=None, price_per_1k_tokens=None):
+        """
+        初始化预算
+
+        Args:
+            max_tokens: 令牌总数上限，为None表示不限
+            max_cost: 费用上限，为None表示不限
+            price_per_1k_tokens: 每千令牌的价格，设置费用上限时必须提供
+        """
+        if max_cost is not None and not price_per_1k_tokens:
+            raise ValueError("设置费用上限时必须提供每千令牌价格")
+
+        self.max_tokens = max_tokens
+        if max_cost is not None:
+            cost_tokens = int(max_cost / price_per_1k_tokens * 1000)
+            self.max_tokens = cost_tokens if max_tokens is None else min(max_tokens, cost_tokens)
+        self.price_per_1k_tokens = price_per_1k_tokens
+        self.spent_tokens = 0
+        self.reserved_tokens = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, estimated_tokens):
+        """
+        为一个文档预留额度
+
+        Args:
+            estimated_tokens: 估算的令牌数
+
+        Raises:
+            BudgetExceededError: 额度不足
+        """
+        with self._lock:
+            if self.max_tokens is not None and \
+                    self.spent_tokens + self.reserved_tokens + estimated_tokens > self.max_tokens:
+                raise BudgetExceededError(
+                    f"超出本次运行的令牌预算（已用{self.spent_tokens}，预计还需{estimated_tokens}，上限{self.max_tokens}）"
+                )
+            self.reserved_tokens += estimated_tokens
+
+    def settle(self, estimated_tokens, actual_tokens):
+        """
+        文档处理结束后释放预留额度并记录实际用量
+
+        Args:
+            estimated_tokens: 预留时使用的估算令牌数
+            actual_tokens: 实际消耗的令牌数
+        """
+        with self._lock:
+            self.reserved_tokens -= estimated_tokens
+            self.spent_tokens += actual_tokens
+
+    def as_dict(self):
+        """
+        Returns:
+            dict: 预算使用情况
+        """
+        with self._lock:
+            result = {"max_tokens": self.max_tokens, "spent_tokens": self.spent_tokens}
+            if self.price_per_1k_tokens:
+                result["spent_cost"] = round(self.spent_tokens / 1000 * self.price_per_1k_tokens, 4)
+            return result
@@ -0,0 +1,188 @@
+import contextvars
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# 等待并发名额或密钥时，每隔这么多秒检查一次取消和期限
+CANCEL_POLL_INTERVAL = 0.5
+
+
+class Cancelled(Exception):
+    """处理被主动取消（例如按下Ctrl-C或关闭窗口）"""
+
+
+class DeadlineExceeded(TimeoutError):
+    """超过了文档的处理期限"""
+
+
+# 取消和超时需要原样向上传播，不能被当作普通错误处理
+ABORT_ERRORS = (Cancelled, DeadlineExceeded)
+
+
+class CancelToken:
+    """
+    协作式取消标记，多个线程共享
+
+    取消后不会中断正在执行的代码，处理流程在检查点（每页提取、每次模型调用前等）发现取消并停止。
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason = None
+
+    def cancel(self, reason="已取消"):
+        """
+        请求取消
+
+        Args:
+            reason: 取消原因
+        """
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        """已请求取消时抛出Cancelled"""
+        if self._event.is_set():
+            raise Cancelled(self.reason)
+
+
+class Deadline:
+    """处理期限和取消标记，可以嵌套，检查时同时检查外层的期限和标记"""
+
+    def __init__(self, timeout=None, token=None, parent=None):
+        """
+        创建期限
+
+        Args:
+            timeout: 从现在起允许的秒数，为None时不限时间
+            token: 可选的CancelToken
+            parent: 外层期限
+        """
+        self.expires_at = None if timeout is None else time.monotonic() + timeout
+        self.token = token
+        self.parent = parent
+
+    def remaining(self):
+        """
+        Returns:
+            float: 到期前剩余的秒数（包括外层期限），不限时间时为None
+        """
+        remaining = None
+        deadline = self
+        while deadline is not None:
+            if deadline.expires_at is not None:
+                left = deadline.expires_at - time.monotonic()
+                remaining = left if remaining is None else min(remaining, left)
+            deadline = deadline.parent
+        return remaining
+
+    def check(self):
+        """已取消时抛出Cancelled，已到期时抛出DeadlineExceeded"""
+        deadline = self
+        while deadline is not None:
+            if deadline.token is not None:
+                deadline.token.raise_if_cancelled()
+            deadline = deadline.parent
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded("超过处理期限")
+
+
+# 当前上下文（线程或协程）中生效的期限，由deadline_scope设置
+_current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(timeout=None, token=None):
+    """
+    在代码块内（当前线程或协程）设置处理期限和取消标记，提取和模型调用在检查点检查它们
+
+    Args:
+        timeout: 允许的秒数，为None时不限时间（仍受外层期限限制）
+        token: 可选的CancelToken
+
+    Yields:
+        Deadline: 生效的期限
+    """
+    deadline = Deadline(timeout, token, _current_deadline.get())
+    reset = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(reset)
+
+
+def check_deadline():
+    """检查点：当前上下文已取消时抛出Cancelled，已到期时抛出DeadlineExceeded，没有设置期限时不做任何事"""
+    deadline = _current_deadline.get()
+    if deadline is not None:
+        deadline.check()
+
+
+def request_timeout(default):
+    """
+    计算一次请求的超时时间
+
+    Args:
+        default: 请求本身的超时秒数
+
+    Returns:
+        float: default与当前期限剩余时间中较小的一个
+    """
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return default
+    deadline.check()
+    remaining = deadline.remaining()
+    return default if remaining is None else min(default, remaining)
+
+
+def carry_context(func):
+    """
+    让提交到其他线程的函数沿用当前上下文（期限、取消标记和用量统计）
+
+    Args:
+        func: 将在其他线程中执行的函数
+
+    Returns:
+        包装后的函数，每次调用在当前上下文的副本中执行，可以被多个线程同时调用
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+    return run
+
+
+def write_file_atomic(path, content):
+    """
+    先写入同目录下的临时文件再替换目标文件，处理被中断时不会留下写了一半的文件
+
+    Args:
+        path: 目标文件路径
+        content: 文本（按UTF-8写入）或字节
+    """
+    # 临时文件名按进程和线程区分，并发写入同一目标时互不干扰；用open创建以保留默认的文件权限
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        if isinstance(content, str):
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(content)
+        else:
+            with open(temp_path, "wb") as f:
+                f.write(content)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import math
+import os
+
+MANIFEST_VERSION = 1
+
+# 单次请求能完整处理的文本长度，超过时按分块做map-reduce总结
+SINGLE_REQUEST_CHARS = 2000 * 4
+
+# 分块的最大和最小字符数
+MAX_CHUNK_CHARS = SINGLE_REQUEST_CHARS
+MIN_CHUNK_CHARS = SINGLE_REQUEST_CHARS // 8
+
+# 页内容哈希对该值取模为0时可以在此处分块（基于内容的分块，插入或删除页面只影响相邻分块）
+BOUNDARY_MODULUS = 4
+
+
+def content_hash(text):
+    """
+    计算文本内容的哈希
+
+    Args:
+        text: 文本
+
+    Returns:
+        str: 十六进制哈希值
+    """
+    return hashlib.sha1((text or "").encode("utf-8")).hexdigest()
+
+
+def combine_hashes(hashes):
+    """
+    把多个哈希合并为一个
+
+    Args:
+        hashes: 哈希值列表
+
+    Returns:
+        str: 十六进制哈希值
+    """
+    return content_hash("\n".join(hashes))
+
+
+def chunk_pages(pages, page_hashes=None, max_chars=MAX_CHUNK_CHARS, min_chars=MIN_CHUNK_CHARS):
+    """
+    按页把文档切分为分块，分块边界由页内容决定，修改某页只会改变它所在的分块
+
+    Args:
+        pages: 每页文本列表
+        page_hashes: 每页的内容哈希，为None时自动计算
+        max_chars: 分块的最大字符数（单页超过时单独成块）
+        min_chars: 在内容边界处分块所需的最小字符数
+
+    Returns:
+        list: (起始页下标, 结束页下标) 元组列表，结束下标不包含在内
+    """
+    if page_hashes is None:
+        page_hashes = [content_hash(page) for page in pages]
+
+    chunks = []
+    start = 0
+    chars = 0
+    for index, page in enumerate(pages):
+        page_chars = len(page or "")
+        if index > start and chars + page_chars > max_chars:
+            chunks.append((start, index))
+            start, chars = index, 0
+        chars += page_chars
+        if chars >= min_chars and int(page_hashes[index][:8], 16) % BOUNDARY_MODULUS == 0:
+            chunks.append((start, index + 1))
+            start, chars = index + 1, 0
+
+    if start < len(pages):
+        chunks.append((start, len(pages)))
+    return chunks
+
+
+def merge_chunks(chunks, count):
+    """
+    把相邻的分块合并，使分块数不超过count
+
+    Args:
+        chunks: chunk_pages返回的 (起始页下标, 结束页下标) 列表
+        count: 分块数上限
+
+    Returns:
+        list: 合并后的 (起始页下标, 结束页下标) 列表
+    """
+    if len(chunks) <= count:
+        return chunks
+    size = math.ceil(len(chunks) / count)
+    return [(chunks[start][0], chunks[min(start + size, len(chunks)) - 1][1])
+            for start in range(0, len(chunks), size)]
+
+
+def estimate_merges(chunks, summary_chars):
+    """
+    估算把分块要点逐层合并到一次汇总请求所需的合并请求（与PDFSummarizer._reduce_chunks的分组方式一致）
+
+    Args:
+        chunks: 分块数
+        summary_chars: 每份要点（分块总结或合并结果）的字符数
+
+    Returns:
+        tuple: (合并请求数, 合并请求的输入字符数合计, 最终汇总请求的输入字符数)
+    """
+    calls = 0
+    merge_chars = 0
+    sections = chunks
+    while sections > 1 and sections * summary_chars > SINGLE_REQUEST_CHARS:
+        groups = math.ceil(sections / max(2, SINGLE_REQUEST_CHARS // summary_chars))
+        calls += groups
+        merge_chars += sections * summary_chars
+        sections = groups
+    return calls, merge_chars, min(sections * summary_chars, SINGLE_REQUEST_CHARS)
+
+
+def manifest_path_for(output_path):
+    """
+    获取输出文件对应的分块清单路径（与输出文件放在同一目录的隐藏文件）
+
+    Args:
+        output_path: Markdown输出文件路径
+
+    Returns:
+        str: 清单文件路径
+    """
+    directory, name = os.path.split(output_path)
+    return os.path.join(directory, f".{name}.chunks.json")
+
+
+def load_manifest(manifest_path):
+    """
+    读取分块清单，文件不存在、损坏或版本不符时返回None
+
+    Args:
+        manifest_path: 清单文件路径
+
+    Returns:
+        dict: 清单内容
+    """
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(manifest_path, manifest):
+    """
+    写入分块清单，先写临时文件再替换，避免留下写了一半的清单
+
+    Args:
+        manifest_path: 清单文件路径
+        manifest: 清单内容
+    """
+    manifest = dict(manifest, version=MANIFEST_VERSION)
+    temp_path = f"{manifest_path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(temp_path, manifest_path)
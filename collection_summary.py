@@ -0,0 +1,236 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from chunk_manifest import SINGLE_REQUEST_CHARS, chunk_pages, combine_hashes, content_hash, load_manifest, save_manifest
+from search_index import parse_markdown_output
+
+# 集合概述的默认输出文件名，扫描文档输出时跳过
+COLLECTION_OUTPUT_NAME = "_collection_summary.md"
+
+# 集合概述的缓存文件名（放在集合根目录）
+COLLECTION_CACHE_NAME = ".collection_summary.json"
+
+# 每篇文档参与汇总的字符数（摘要开头加关键概念），越短每次请求能容纳的文档越多
+DEFAULT_LEAF_CHARS = 300
+
+# 每次汇总请求的输入字符数上限
+DEFAULT_GROUP_CHARS = SINGLE_REQUEST_CHARS
+
+# 同一层级并发汇总的分组数，实际并发由ZhipuAI的限制器控制
+MAX_PARALLEL_GROUPS = 4
+
+
+class _Item:
+    """汇总树中的一个输入：文档摘录或下一级的汇总结果"""
+
+    def __init__(self, title, text, key, ok=True):
+        self.title = title
+        self.text = text
+        self.key = key
+        self.ok = ok
+
+
+def load_markdown_documents(folder):
+    """
+    读取文件夹（含子文件夹）中已生成的文档Markdown输出，不读取PDF
+
+    Args:
+        folder: 集合根目录
+
+    Returns:
+        dict: {相对目录（根目录为""）: [(文件名, 标题, 正文)]}
+    """
+    documents = {}
+    for directory, subdirectories, file_names in os.walk(folder):
+        subdirectories[:] = sorted(name for name in subdirectories if not name.startswith("."))
+        relative = os.path.relpath(directory, folder)
+        relative = "" if relative == "." else relative.replace(os.sep, "/")
+        for file_name in sorted(file_names):
+            if not file_name.lower().endswith(".md") or file_name == COLLECTION_OUTPUT_NAME:
+                continue
+            with open(os.path.join(directory, file_name), "r", encoding="utf-8") as f:
+                title, body = parse_markdown_output(f.read())
+            documents.setdefault(relative, []).append((file_name, title or os.path.splitext(file_name)[0], body))
+    return documents
+
+
+def load_store_documents(result_store, folder):
+    """
+    从结果库读取文件夹（含子文件夹）中文档的总结，不读取PDF
+
+    Args:
+        result_store: result_store.ResultStore
+        folder: 集合根目录
+
+    Returns:
+        dict: {相对目录（根目录为""）: [(文件名, 标题, 正文)]}
+    """
+    documents = {}
+    root = os.path.abspath(folder)
+    for row in result_store.iter_results(root):
+        relative = os.path.relpath(os.path.dirname(row["path"]), root)
+        relative = "" if relative == "." else relative.replace(os.sep, "/")
+        title = os.path.splitext(row["name"])[0]
+        documents.setdefault(relative, []).append((row["name"], title, f"{row['summary']}\n{row['key_concepts']}"))
+    for entries in documents.values():
+        entries.sort()
+    return documents
+
+
+class CollectionSummarizer:
+    """
+    由已有的单文档总结自底向上构建集合概述树（文件夹 → 子文件夹 → 文档）
+
+    每个文件夹的输入是其中文档的摘录和子文件夹的概述；输入超过一次请求的长度时，先按内容决定的边界
+    分组汇总，再汇总各组结果。每个汇总结果以其输入的哈希缓存，之后只有输入变化的分支需要重新汇总。
+    """
+
+    def __init__(self, zhipu_ai, leaf_chars=DEFAULT_LEAF_CHARS, group_chars=DEFAULT_GROUP_CHARS,
+                 as_questions=True, custom_instruction=None):
+        """
+        初始化集合总结器
+
+        Args:
+            zhipu_ai: ZhipuAI客户端
+            leaf_chars: 每篇文档参与汇总的字符数
+            group_chars: 每次汇总请求的输入字符数上限
+            as_questions: 如果为True，尽可能将内容格式化为问题形式
+            custom_instruction: 用户自定义处理说明
+        """
+        self.zhipu_ai = zhipu_ai
+        self.leaf_chars = leaf_chars
+        self.group_chars = group_chars
+        self.as_questions = as_questions
+        self.custom_instruction = custom_instruction
+        self._settings_key = content_hash(repr((leaf_chars, group_chars, as_questions, custom_instruction)))
+        self._cache = {}
+        self._used = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.reused = 0
+
+    def summarize_folder(self, folder, result_store=None, cache_path=None):
+        """
+        生成文件夹的集合概述树
+
+        Args:
+            folder: 集合根目录
+            result_store: 可选的ResultStore，提供时从结果库读取文档总结，否则读取文件夹中的Markdown输出
+            cache_path: 汇总缓存路径，为None时使用根目录下的.collection_summary.json
+
+        Returns:
+            dict: 根节点，包含path、summary、documents（文档总数）、children（子文件夹节点）、
+                  calls（本次调用模型的次数）和reused（复用缓存的汇总数）；没有任何文档时返回None
+        """
+        if not os.path.isdir(folder):
+            raise ValueError(f"文件夹路径不存在: {folder}")
+        if result_store is not None:
+            documents = load_store_documents(result_store, folder)
+        else:
+            documents = load_markdown_documents(folder)
+
+        if cache_path is None:
+            cache_path = os.path.join(folder, COLLECTION_CACHE_NAME)
+        self._cache = (load_manifest(cache_path) or {}).get("summaries", {})
+        self._used = {}
+        self.calls = 0
+        self.reused = 0
+
+        label = os.path.basename(os.path.abspath(folder))
+        node = self._summarize_node("", label, documents)
+        if node is None:
+            return None
+
+        # 只保留本次用到的汇总，缓存不会随文档变化无限增长
+        save_manifest(cache_path, {"summaries": self._used})
+        tree = node[1]
+        tree["calls"] = self.calls
+        tree["reused"] = self.reused
+        return tree
+
+    def _summarize_node(self, relative, label, documents):
+        """汇总一个文件夹，返回 (_Item, 节点字典)，文件夹及其子文件夹中没有文档时返回None"""
+        children = []
+        items = []
+        prefix = f"{relative}/" if relative else ""
+        subfolders = sorted({key[len(prefix):].split("/")[0] for key in documents
+                             if key.startswith(prefix) and key != relative})
+        for name in subfolders:
+            child = self._summarize_node(prefix + name, name, documents)
+            if child is not None:
+                items.append(_Item(f"子文件夹 {name}", child[0].text, child[0].key, child[0].ok))
+                children.append(child[1])
+
+        entries = documents.get(relative, [])
+        for file_name, title, text in entries:
+            excerpt = " ".join(text.split())[:self.leaf_chars]
+            items.append(_Item(title, excerpt, content_hash(f"{file_name}\n{title}\n{excerpt}")))
+
+        if not items:
+            return None
+
+        item = self._reduce(relative or label, items)
+        document_count = len(entries) + sum(child["documents"] for child in children)
+        return item, {"path": relative, "name": label, "summary": item.text, "documents": document_count,
+                      "children": children}
+
+    def _reduce(self, label, items):
+        """把一组输入汇总为一个结果，超过单次请求长度时先分组汇总"""
+        while True:
+            sections = [f"【{item.title}】\n{item.text}" for item in items]
+            if sum(len(section) for section in sections) <= self.group_chars or len(items) == 1:
+                return self._summarize_group(label, items)
+
+            # 分组边界由输入内容决定，增删一篇文档只影响相邻的分组
+            groups = chunk_pages(sections, [item.key for item in items],
+                                 max_chars=self.group_chars, min_chars=self.group_chars // 4)
+            if len(groups) == len(items):
+                # 每个输入都接近单次请求的上限，分组无法再缩短输入，直接汇总（过长部分被截断）
+                return self._summarize_group(label, items)
+            with ThreadPoolExecutor(max_workers=MAX_PARALLEL_GROUPS) as executor:
+                items = list(executor.map(lambda group: self._summarize_group(label, items[group[0]:group[1]]),
+                                          groups))
+
+    def _summarize_group(self, label, items):
+        key = combine_hashes([self._settings_key, label] + [item.key for item in items])
+        ok = all(item.ok for item in items)
+        summary = self._cache.get(key) if ok else None
+        if summary is not None:
+            with self._lock:
+                self.reused += 1
+        else:
+            with self._lock:
+                self.calls += 1
+            summary = self.zhipu_ai.summarize_collection(label, [(item.title, item.text) for item in items],
+                                                         as_questions=self.as_questions,
+                                                         custom_instruction=self.custom_instruction)
+            # 出错的汇总及依赖它的上级汇总都不缓存，下次重新生成
+            ok = ok and not summary.startswith("错误")
+        if ok:
+            with self._lock:
+                self._used[key] = summary
+        return _Item(label, summary, key, ok)
+
+
+def render_collection_markdown(tree):
+    """
+    把集合概述树格式化为Markdown，每级文件夹一个标题
+
+    Args:
+        tree: CollectionSummarizer.summarize_folder返回的根节点
+
+    Returns:
+        str: Markdown文本
+    """
+    parts = []
+
+    def render(node, level):
+        heading = "#" * min(level, 6)
+        title = node["name"] if level == 1 else node["path"]
+        parts.append(f"{heading} {title}\n\n> 文档数: {node['documents']}\n\n{node['summary']}\n")
+        for child in node["children"]:
+            render(child, level + 1)
+
+    render(tree, 1)
+    return "\n".join(parts)
@@ -0,0 +1,233 @@
+import asyncio
+import collections
+import threading
+import time
+
+
+def is_rate_limit_error(error):
+    """
+    判断异常是否为限流错误（HTTP 429）
+
+    Args:
+        error: 调用接口时抛出的异常
+
+    Returns:
+        bool: 是否为限流错误
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        response = getattr(error, "response", None)
+        status_code = getattr(response, "status_code", None)
+    if status_code == 429:
+        return True
+    return "RateLimit" in type(error).__name__
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD（加性增、乘性减）自适应并发限制器
+
+    每次成功且延迟正常的请求都会让并发上限缓慢增加（每轮约+1），
+    遇到限流（429）、延迟突增或错误率过高时，上限按比例下调。
+    同一个限制器可以同时被线程和asyncio协程使用。
+    """
+
+    def __init__(self, initial_limit=4, min_limit=1, max_limit=64, backoff_ratio=0.5,
+                 latency_tolerance=2.0, error_rate_threshold=0.2, smoothing=0.1):
+        """
+        初始化限制器
+
+        Args:
+            initial_limit: 初始并发上限
+            min_limit: 并发上限的最小值
+            max_limit: 并发上限的最大值
+            backoff_ratio: 乘性下调的比例
+            latency_tolerance: 延迟超过基线延迟的多少倍视为延迟突增
+            error_rate_threshold: 错误率（指数滑动平均）超过该值时下调上限
+            smoothing: 基线延迟和错误率的平滑系数
+        """
+        if not 1 <= min_limit <= initial_limit <= max_limit:
+            raise ValueError("并发上限参数必须满足 1 <= min_limit <= initial_limit <= max_limit")
+
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.latency_tolerance = latency_tolerance
+        self.error_rate_threshold = error_rate_threshold
+        self.smoothing = smoothing
+
+        self._cond = threading.Condition()
+        self._limit = float(initial_limit)
+        self._in_flight = 0
+        self._async_waiters = collections.deque()
+        self._baseline_latency = None
+        self._error_rate = 0.0
+        self._last_decrease = 0.0
+        self._counters = {"success": 0, "throttled": 0, "error": 0, "latency_spike": 0, "decrease": 0}
+
+    @property
+    def limit(self):
+        """当前并发上限"""
+        with self._cond:
+            return int(self._limit)
+
+    @property
+    def in_flight(self):
+        """当前正在执行的请求数"""
+        with self._cond:
+            return self._in_flight
+
+    def acquire(self, timeout=None):
+        """
+        阻塞直到获得一个并发名额
+
+        Args:
+            timeout: 最多等待的秒数，为None时一直等待
+
+        Returns:
+            bool: 是否获得了名额（只有设置了timeout时才可能为False）
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._in_flight >= int(self._limit):
+                if deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self._in_flight += 1
+            return True
+
+    async def acquire_async(self):
+        """
+        在事件循环中等待获得一个并发名额，等待期间不占用线程
+        """
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if self._in_flight < int(self._limit) and not self._async_waiters:
+                self._in_flight += 1
+                return
+            future = loop.create_future()
+            waiter = (loop, future)
+            self._async_waiters.append(waiter)
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._cond:
+                try:
+                    self._async_waiters.remove(waiter)
+                except ValueError:
+                    # 名额已经分配给了这个协程，需要归还
+                    if future.done() and not future.cancelled():
+                        self._in_flight -= 1
+                        self._wake_waiters()
+            raise
+
+    def release(self, latency=None, outcome="success"):
+        """
+        归还名额并根据请求结果调整并发上限
+
+        Args:
+            latency: 请求耗时（秒），为None时不参与延迟判断
+            outcome: 请求结果，"success"、"throttled"、"error"或"cancelled"（被取消的请求不参与调整）
+        """
+        with self._cond:
+            self._in_flight -= 1
+            self._record(latency, outcome)
+            self._wake_waiters()
+
+    def snapshot(self):
+        """
+        获取限制器的当前指标
+
+        Returns:
+            dict: 包含并发上限、执行中请求数、基线延迟和计数器的字典
+        """
+        with self._cond:
+            metrics = {
+                "limit": int(self._limit),
+                "in_flight": self._in_flight,
+                "baseline_latency": self._baseline_latency,
+                "error_rate": round(self._error_rate, 4)
+            }
+            metrics.update(self._counters)
+            return metrics
+
+    def _record(self, latency, outcome):
+        """根据单次请求结果执行AIMD调整，调用方需持有锁"""
+        self._counters[outcome] = self._counters.get(outcome, 0) + 1
+        if outcome == "cancelled":
+            return
+        self._error_rate += self.smoothing * ((0.0 if outcome == "success" else 1.0) - self._error_rate)
+
+        if outcome == "throttled":
+            self._decrease()
+            return
+
+        if outcome == "error":
+            if self._error_rate > self.error_rate_threshold:
+                self._decrease()
+            return
+
+        if latency is not None:
+            if self._baseline_latency is None:
+                self._baseline_latency = latency
+            elif latency > self._baseline_latency * self.latency_tolerance:
+                self._counters["latency_spike"] += 1
+                # 延迟突增时基线只缓慢跟随，避免持续变慢后一直被判定为突增
+                self._baseline_latency += self.smoothing / 4 * (latency - self._baseline_latency)
+                self._decrease()
+                return
+            else:
+                self._baseline_latency += self.smoothing * (latency - self._baseline_latency)
+
+        # 加性增：每完成约一个并发上限数量的请求，上限加1
+        self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+
+    def _decrease(self):
+        """乘性减，同一个延迟周期内只下调一次，调用方需持有锁"""
+        now = time.monotonic()
+        cooldown = self._baseline_latency or 1.0
+        if now - self._last_decrease < cooldown:
+            return
+        self._last_decrease = now
+        self._limit = max(self.min_limit, self._limit * self.backoff_ratio)
+        self._counters["decrease"] += 1
+
+    def _wake_waiters(self):
+        """把空闲名额分配给等待中的协程并唤醒等待中的线程，调用方需持有锁"""
+        while self._async_waiters and self._in_flight < int(self._limit):
+            loop, future = self._async_waiters.popleft()
+            self._in_flight += 1
+            loop.call_soon_threadsafe(self._grant, future)
+        self._cond.notify_all()
+
+    def _grant(self, future):
+        """在协程所在的事件循环中完成等待，协程已取消时归还名额"""
+        if future.cancelled():
+            with self._cond:
+                self._in_flight -= 1
+                self._wake_waiters()
+        else:
+            future.set_result(None)
+
+
+_default_limiter = None
+_default_limiter_lock = threading.Lock()
+
+
+def get_default_limiter():
+    """
+    获取进程内共享的默认限制器，所有未显式指定限制器的ZhipuAI实例共用
+
+    Returns:
+        AdaptiveConcurrencyLimiter: 默认限制器
+    """
+    global _default_limiter
+    with _default_limiter_lock:
+        if _default_limiter is None:
+            _default_limiter = AdaptiveConcurrencyLimiter()
+        return _default_limiter
@@ -0,0 +1,99 @@
+import re
+
+# 单个打包请求中文档文本的总字符数上限（与单文档截断长度一致）
+DEFAULT_MAX_PACK_CHARS = 2000 * 4
+
+# 单个打包请求最多包含的文档数，文档越多，输出越容易被截断或混淆
+DEFAULT_MAX_PACK_DOCUMENTS = 8
+
+# 分隔符格式，模型输出必须原样保留
+DOC_START = "<<<DOC {}>>>"
+DOC_END = "<<<END {}>>>"
+SUMMARY_MARK = "<<<SUMMARY>>>"
+CONCEPTS_MARK = "<<<CONCEPTS>>>"
+
+_DOC_PATTERN = re.compile(r"<<<DOC\s*(\d+)>>>(.*?)<<<END\s*\1>>>", re.S)
+_SECTIONS_PATTERN = re.compile(re.escape(SUMMARY_MARK) + r"(.*?)" + re.escape(CONCEPTS_MARK) + r"(.*)", re.S)
+
+
+def pack_documents(documents, max_chars=DEFAULT_MAX_PACK_CHARS, max_documents=DEFAULT_MAX_PACK_DOCUMENTS):
+    """
+    把小文档按顺序装入多个包，每个包的文本总长度和文档数都不超过上限
+
+    Args:
+        documents: (键, 文本) 元组列表
+        max_chars: 每个包的文本字符数上限
+        max_documents: 每个包的文档数上限
+
+    Returns:
+        tuple: (包列表, 无法打包的文档列表)，每个包是 (键, 文本) 元组列表
+    """
+    packs = []
+    oversized = []
+    current = []
+    current_chars = 0
+
+    for key, text in documents:
+        if len(text) > max_chars:
+            oversized.append((key, text))
+            continue
+        if current and (current_chars + len(text) > max_chars or len(current) >= max_documents):
+            packs.append(current)
+            current, current_chars = [], 0
+        current.append((key, text))
+        current_chars += len(text)
+
+    if current:
+        packs.append(current)
+    return packs, oversized
+
+
+def format_packed_documents(texts):
+    """
+    用分隔符把多个文档拼接成一段提示词
+
+    Args:
+        texts: 文档文本列表，编号从1开始
+
+    Returns:
+        str: 拼接后的文本
+    """
+    parts = []
+    for index, text in enumerate(texts, 1):
+        parts.append(f"{DOC_START.format(index)}\n{text.strip()}\n{DOC_END.format(index)}")
+    return "\n\n".join(parts)
+
+
+def split_packed_response(content, document_count):
+    """
+    把打包请求的回复拆分回各个文档
+
+    只有格式完整（编号唯一、包含非空的总结和关键概念）的文档才会返回，
+    调用方应对缺失的文档单独重试。
+
+    Args:
+        content: 模型回复
+        document_count: 包内的文档数
+
+    Returns:
+        dict: {编号(从1开始): (总结, 关键概念)}
+    """
+    found = {}
+    duplicates = set()
+    for match in _DOC_PATTERN.finditer(content or ""):
+        index = int(match.group(1))
+        if index < 1 or index > document_count:
+            continue
+        if index in found:
+            duplicates.add(index)
+            continue
+        sections = _SECTIONS_PATTERN.search(match.group(2))
+        if not sections:
+            continue
+        summary, concepts = sections.group(1).strip(), sections.group(2).strip()
+        if summary and concepts:
+            found[index] = (summary, concepts)
+
+    for index in duplicates:
+        found.pop(index, None)
+    return found
@@ -0,0 +1,152 @@
+"""
+PDF文本提取后端对比基准测试
+
+在自己的PDF文件夹上逐个后端提取全部页面，比较吞吐量和输出质量：
+失败页数、空白页比例、乱码字符比例，以及与参考后端提取结果的文本相似度（MinHash估算）。
+
+用法:
+    python extraction_benchmark.py path/to/folder [--backends pymupdf pypdf2] [--reference pypdf2] [--max-files 50]
+"""
+import argparse
+import os
+import sys
+import time
+import unicodedata
+
+from near_duplicates import compute_signature, estimate_similarity
+from pdf_backends import BACKENDS, available_backends, resolve_backend
+
+
+def garbled_ratio(text):
+    """
+    估算乱码比例：替换字符、私有区字符和除空白外的控制字符占非空白字符的比例
+
+    Args:
+        text: 提取的文本
+
+    Returns:
+        float: 0到1之间的比例
+    """
+    visible = 0
+    garbled = 0
+    for char in text:
+        if char.isspace():
+            continue
+        visible += 1
+        if char == "\ufffd" or unicodedata.category(char) in ("Co", "Cc", "Cs"):
+            garbled += 1
+    return garbled / visible if visible else 0.0
+
+
+def extract_document(backend_name, pdf_path):
+    """
+    用指定后端（不回退）提取一个文档的全部页面
+
+    Args:
+        backend_name: 后端名称
+        pdf_path: PDF文件路径
+
+    Returns:
+        tuple: (每页文本列表，失败页为None, 耗时秒数)
+    """
+    started = time.perf_counter()
+    pages = []
+    with resolve_backend(backend_name)(pdf_path) as backend:
+        for index in range(backend.page_count()):
+            try:
+                pages.append(backend.extract_page(index) or "")
+            except Exception:
+                pages.append(None)
+    return pages, time.perf_counter() - started
+
+
+def run_benchmark(pdf_paths, backend_names, reference):
+    """
+    对每个后端提取所有文档并汇总指标
+
+    Args:
+        pdf_paths: PDF文件路径列表
+        backend_names: 要比较的后端名称列表
+        reference: 计算相似度时作为参考的后端名称
+
+    Returns:
+        dict: {后端名称: 指标字典}
+    """
+    texts = {name: {} for name in backend_names}
+    results = {}
+    for name in backend_names:
+        stats = {"files": 0, "file_errors": 0, "pages": 0, "failed_pages": 0, "empty_pages": 0,
+                 "chars": 0, "seconds": 0.0, "garbled": 0.0}
+        for pdf_path in pdf_paths:
+            try:
+                pages, elapsed = extract_document(name, pdf_path)
+            except Exception as e:
+                stats["file_errors"] += 1
+                print(f"[{name}] 无法打开 {os.path.basename(pdf_path)}: {str(e)}", file=sys.stderr)
+                continue
+            extracted = [page for page in pages if page is not None]
+            text = "".join(extracted)
+            texts[name][pdf_path] = text
+            stats["files"] += 1
+            stats["pages"] += len(pages)
+            stats["failed_pages"] += len(pages) - len(extracted)
+            stats["empty_pages"] += sum(1 for page in extracted if not page.strip())
+            stats["chars"] += len(text)
+            stats["seconds"] += elapsed
+            stats["garbled"] += garbled_ratio(text) * len(text)
+        stats["garbled"] = stats["garbled"] / stats["chars"] if stats["chars"] else 0.0
+        results[name] = stats
+
+    # 与参考后端逐文档比较文本相似度
+    reference_texts = texts.get(reference, {})
+    reference_signatures = {path: compute_signature(text) for path, text in reference_texts.items()}
+    for name in backend_names:
+        similarities = [
+            estimate_similarity(compute_signature(text), reference_signatures[path])
+            for path, text in texts[name].items()
+            if reference_signatures.get(path)
+        ]
+        results[name]["similarity"] = sum(similarities) / len(similarities) if similarities else None
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare PDF text extraction backends on a folder of PDFs')
+    parser.add_argument('folder', help='Folder containing PDF files')
+    parser.add_argument('--backends', nargs='+', help='Backends to compare (default: all installed)')
+    parser.add_argument('--reference', help='Backend used as the similarity reference (default: pypdf2)')
+    parser.add_argument('--max-files', type=int, help='Only use the first N PDF files')
+    args = parser.parse_args()
+
+    pdf_paths = sorted(
+        os.path.join(args.folder, name) for name in os.listdir(args.folder) if name.lower().endswith('.pdf')
+    )[:args.max_files]
+    if not pdf_paths:
+        print(f"文件夹中没有PDF文件: {args.folder}")
+        sys.exit(1)
+
+    backend_names = args.backends or available_backends()
+    for name in backend_names:
+        resolve_backend(name)
+    reference = args.reference or ("pypdf2" if "pypdf2" in backend_names else backend_names[-1])
+
+    print(f"已安装的后端: {', '.join(available_backends())}（全部: {', '.join(b.name for b in BACKENDS)}）")
+    print(f"测试 {len(pdf_paths)} 个文件，相似度参考后端: {reference}\n")
+    results = run_benchmark(pdf_paths, backend_names, reference)
+
+    header = f"{'backend':>8} {'files':>6} {'pages':>7} {'pages/s':>9} {'failed':>7} {'empty%':>7} {'garbled%':>9} {'similarity':>11}"
+    print(header)
+    for name, stats in sorted(results.items(), key=lambda item: item[1]["seconds"]):
+        pages_per_second = stats["pages"] / stats["seconds"] if stats["seconds"] else 0.0
+        empty = stats["empty_pages"] / stats["pages"] * 100 if stats["pages"] else 0.0
+        similarity = "n/a" if stats["similarity"] is None else f"{stats['similarity']:.3f}"
+        print(f"{name:>8} {stats['files']:>6} {stats['pages']:>7} {pages_per_second:>9.1f} {stats['failed_pages']:>7} "
+              f"{empty:>7.1f} {stats['garbled'] * 100:>9.2f} {similarity:>11}")
+
+    fastest = min(results, key=lambda name: results[name]["seconds"])
+    print(f"\n自动选择的后端: {resolve_backend('auto').name}，本次最快: {fastest}")
+    print("可通过环境变量 PDF_EXTRACTION_BACKEND 或 --extractor 参数指定后端")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+
+class _DirtyPathHandler(FileSystemEventHandler):
+    """把文件系统事件涉及的PDF路径标记为待检查"""
+
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        for path in (getattr(event, "src_path", None), getattr(event, "dest_path", None)):
+            if path and path.lower().endswith(".pdf"):
+                self.watcher.mark_dirty(path)
+
+
+class FolderWatcher:
+    """
+    监视文件夹中新增或修改的PDF文件
+
+    安装了watchdog时使用文件系统通知，否则定期扫描目录。文件的大小和修改时间
+    在debounce_seconds内保持不变后才视为写入完成，然后交给回调处理。
+    """
+
+    def __init__(self, folder_path, on_ready, poll_interval=2.0, debounce_seconds=3.0, use_events=True):
+        """
+        初始化监视器
+
+        Args:
+            folder_path: 要监视的文件夹
+            on_ready: 回调函数，接收写入完成的 (文件名, (大小, 修改时间)) 列表
+            poll_interval: 检查间隔（秒）
+            debounce_seconds: 文件保持不变多久后视为写入完成（秒）
+            use_events: 如果为True且安装了watchdog，使用文件系统通知代替全目录扫描
+        """
+        if not os.path.isdir(folder_path):
+            raise ValueError(f"文件夹路径不存在: {folder_path}")
+
+        self.folder_path = folder_path
+        self.on_ready = on_ready
+        self.poll_interval = poll_interval
+        self.debounce_seconds = debounce_seconds
+        self.use_events = use_events and Observer is not None
+
+        # 已处理文件的(大小, 修改时间)，以及等待写入完成的文件
+        self.known = {}
+        self._pending = {}
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def mark_dirty(self, path):
+        """
+        标记文件需要检查（由文件系统事件调用）
+
+        Args:
+            path: 文件路径
+        """
+        with self._dirty_lock:
+            self._dirty.add(os.path.basename(path))
+
+    def mark_processed(self, file_name, signature):
+        """
+        记录文件已处理（例如上次运行已生成输出），之后只有在文件再次变化时才会重新处理
+
+        Args:
+            file_name: 文件名
+            signature: 文件处理时的(大小, 修改时间)
+        """
+        self.known[file_name] = signature
+
+    def _stat(self, file_name):
+        try:
+            stat = os.stat(os.path.join(self.folder_path, file_name))
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime
+
+    def _scan(self):
+        """全目录扫描，返回所有PDF文件名"""
+        with os.scandir(self.folder_path) as entries:
+            return [entry.name for entry in entries if entry.is_file() and entry.name.lower().endswith(".pdf")]
+
+    def check(self, candidates=None):
+        """
+        检查一次文件变化
+
+        Args:
+            candidates: 要检查的文件名，为None时扫描整个目录
+
+        Returns:
+            list: 写入完成且尚未处理的 (文件名, (大小, 修改时间)) 列表
+        """
+        now = time.monotonic()
+        names = set(self._scan() if candidates is None else candidates) | set(self._pending)
+
+        ready = []
+        for file_name in names:
+            signature = self._stat(file_name)
+            if signature is None:
+                self._pending.pop(file_name, None)
+                self.known.pop(file_name, None)
+                continue
+            if self.known.get(file_name) == signature:
+                self._pending.pop(file_name, None)
+                continue
+
+            previous = self._pending.get(file_name)
+            if previous is None or previous[0] != signature:
+                # 新出现或仍在写入，重新计时
+                self._pending[file_name] = (signature, now)
+            elif now - previous[1] >= self.debounce_seconds and signature[0] > 0:
+                # 交给回调时即记录，处理期间不会重复触发，处理失败的文件在再次修改后重试
+                del self._pending[file_name]
+                self.known[file_name] = signature
+                ready.append((file_name, signature))
+        return ready
+
+    def run(self):
+        """
+        持续监视直到调用stop（或收到KeyboardInterrupt）
+        """
+        observer = None
+        if self.use_events:
+            observer = Observer()
+            observer.schedule(_DirtyPathHandler(self), self.folder_path, recursive=False)
+            observer.start()
+
+        try:
+            # 首次全量扫描，之后有通知时只检查发生变化的文件
+            candidates = None
+            while not self._stop_event.is_set():
+                ready = self.check(candidates)
+                if ready:
+                    self.on_ready(ready)
+
+                self._stop_event.wait(self.poll_interval)
+                if observer is not None:
+                    with self._dirty_lock:
+                        candidates, self._dirty = self._dirty, set()
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+
+    def stop(self):
+        """停止监视"""
+        self._stop_event.set()
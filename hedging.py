@@ -0,0 +1,219 @@
+import asyncio
+import collections
+import math
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from cancellation import carry_context
+
+# 启用请求对冲的环境变量：触发对冲的延迟分位数（例如0.95），以及对冲请求占比上限
+HEDGE_PERCENTILE_ENV_VAR = "ZHIPU_HEDGE_PERCENTILE"
+HEDGE_MAX_RATE_ENV_VAR = "ZHIPU_HEDGE_MAX_RATE"
+
+# 同步调用对冲时使用的工作线程数
+HEDGE_WORKERS = 64
+
+
+class HedgePolicy:
+    """
+    请求对冲策略
+
+    按模型在线统计最近请求的延迟（由调用方通过observe记录接口本身的耗时），
+    请求超过设定分位数的延迟仍未返回时，再发送一个相同的请求，
+    先返回的结果生效，另一个被取消（同步调用无法中断已发出的HTTP请求，只丢弃其结果）。
+    对冲请求占全部请求的比例不超过max_hedge_rate，额外的令牌消耗因此有上限。
+    """
+
+    def __init__(self, percentile=0.95, max_hedge_rate=0.05, min_samples=20, window=500, min_delay=1.0):
+        """
+        初始化对冲策略
+
+        Args:
+            percentile: 触发对冲的延迟分位数（0-1）
+            max_hedge_rate: 对冲请求数占请求总数的比例上限
+            min_samples: 某个模型累计这么多次成功请求的延迟后才开始对冲
+            window: 每个模型保留的最近延迟样本数
+            min_delay: 对冲前至少等待的秒数
+        """
+        if not 0 < percentile < 1:
+            raise ValueError("percentile必须在0和1之间")
+        self.percentile = percentile
+        self.max_hedge_rate = max_hedge_rate
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+
+        self._lock = threading.Lock()
+        self._latencies = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self._executor = None
+        self._counters = {"requests": 0, "hedged": 0, "hedge_won": 0, "primary_won": 0, "skipped_rate_cap": 0}
+
+    @classmethod
+    def from_env(cls):
+        """
+        从环境变量创建对冲策略
+
+        Returns:
+            HedgePolicy: 设置了ZHIPU_HEDGE_PERCENTILE时返回策略，否则返回None（不对冲）
+        """
+        percentile = os.getenv(HEDGE_PERCENTILE_ENV_VAR)
+        if not percentile:
+            return None
+        kwargs = {"percentile": float(percentile)}
+        max_rate = os.getenv(HEDGE_MAX_RATE_ENV_VAR)
+        if max_rate:
+            kwargs["max_hedge_rate"] = float(max_rate)
+        return cls(**kwargs)
+
+    def observe(self, model, latency):
+        """
+        记录一次成功请求的延迟，应只包括接口调用本身，不包括排队等待的时间
+
+        Args:
+            model: 模型名称
+            latency: 延迟（秒）
+        """
+        with self._lock:
+            self._latencies[model].append(latency)
+
+    def hedge_delay(self, model):
+        """
+        Args:
+            model: 模型名称
+
+        Returns:
+            float: 发送对冲请求前等待的秒数，样本不足时为None（不对冲）
+        """
+        with self._lock:
+            samples = sorted(self._latencies[model])
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, math.ceil(self.percentile * len(samples)) - 1)
+        return max(self.min_delay, samples[index])
+
+    def _allow_hedge(self):
+        with self._lock:
+            if self._counters["hedged"] + 1 > self.max_hedge_rate * self._counters["requests"]:
+                self._counters["skipped_rate_cap"] += 1
+                return False
+            self._counters["hedged"] += 1
+            return True
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: 各模型当前的对冲延迟和计数器
+        """
+        with self._lock:
+            models = list(self._latencies)
+            metrics = dict(self._counters)
+        metrics["delays"] = {model: self.hedge_delay(model) for model in models}
+        return metrics
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+            return self._executor
+
+    def run(self, model, call, args, has_capacity=None, on_discarded=None):
+        """
+        执行一次可能被对冲的同步调用
+
+        Args:
+            model: 模型名称，延迟按模型分别统计
+            call: 执行请求的函数
+            args: 参数元组
+            has_capacity: 可选，返回是否还有空闲并发的函数，没有空闲并发时不对冲
+            on_discarded: 可选，被丢弃的请求成功返回时（可能在返回之后），以其结果调用（例如记录令牌用量），
+                          在调用run时的上下文中执行
+
+        Returns:
+            先成功返回的请求的结果
+        """
+        self._count("requests")
+        if on_discarded is not None:
+            # 落后的请求在工作线程中完成，回调需要沿用调用方的用量统计和文档上下文
+            on_discarded = carry_context(on_discarded)
+        executor = self._get_executor()
+        primary = executor.submit(call, *args)
+        delay = self.hedge_delay(model)
+        if delay is None:
+            return primary.result()
+
+        done, _ = wait([primary], timeout=delay)
+        if done or (has_capacity is not None and not has_capacity()) or not self._allow_hedge():
+            return primary.result()
+
+        hedge = executor.submit(call, *args)
+        pending = {primary, hedge}
+        first_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    first_error = first_error or future.exception()
+                    continue
+                self._count("hedge_won" if future is hedge else "primary_won")
+                # 另一个请求可能与之同时完成，已完成的请求立即执行回调
+                other = primary if future is hedge else hedge
+                if not other.cancel() and on_discarded is not None:
+                    other.add_done_callback(
+                        lambda f: on_discarded(f.result()) if f.exception() is None else None
+                    )
+                return future.result()
+        raise first_error
+
+    async def run_async(self, model, call, args, has_capacity=None, on_discarded=None):
+        """
+        执行一次可能被对冲的异步调用，落后的请求会被取消
+
+        Args:
+            model: 模型名称，延迟按模型分别统计
+            call: 执行请求的协程函数
+            args: 参数元组
+            has_capacity: 可选，返回是否还有空闲并发的函数，没有空闲并发时不对冲
+            on_discarded: 可选，落后的请求在被取消前已经成功返回时，以其结果调用（例如记录令牌用量）
+
+        Returns:
+            先成功返回的请求的结果
+        """
+        self._count("requests")
+        primary = asyncio.ensure_future(call(*args))
+        tasks = [primary]
+        winner = None
+        try:
+            delay = self.hedge_delay(model)
+            if delay is None:
+                return await asyncio.shield(primary)
+
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or (has_capacity is not None and not has_capacity()) or not self._allow_hedge():
+                return await asyncio.shield(primary)
+
+            hedge = asyncio.ensure_future(call(*args))
+            tasks.append(hedge)
+            pending = {primary, hedge}
+            first_error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        first_error = first_error or task.exception()
+                        continue
+                    self._count("hedge_won" if task is hedge else "primary_won")
+                    winner = task
+                    return task.result()
+            raise first_error
+        finally:
+            # 落后的请求（以及调用方被取消时的所有请求）在这里取消，已经完成的不能取消，结果交给on_discarded
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif task is not winner and winner is not None and on_discarded is not None \
+                        and not task.cancelled() and task.exception() is None:
+                    on_discarded(task.result())
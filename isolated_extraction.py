@@ -0,0 +1,203 @@
+import multiprocessing
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from pdf_backends import PageExtractor
+
+# 默认的单页超时、单文档超时（秒）和工作进程内存上限（MB）
+DEFAULT_PAGE_TIMEOUT = 30.0
+DEFAULT_DOCUMENT_TIMEOUT = 600.0
+DEFAULT_MEMORY_LIMIT_MB = 2048
+
+
+class ExtractionTimeoutError(Exception):
+    """隔离执行的提取任务超时、超出内存或工作进程崩溃"""
+
+
+class ExtractionLimits:
+    """
+    隔离提取的时间和内存限制
+
+    每个文档在独立的工作进程中逐页提取，单页超时、超出内存或导致进程崩溃的页面被记录并跳过，
+    工作进程随后重启并从下一页继续；整个文档超时后剩余页面全部跳过。
+    """
+
+    def __init__(self, page_timeout=DEFAULT_PAGE_TIMEOUT, document_timeout=DEFAULT_DOCUMENT_TIMEOUT,
+                 memory_limit_mb=DEFAULT_MEMORY_LIMIT_MB):
+        """
+        初始化限制
+
+        Args:
+            page_timeout: 单页提取的最长秒数
+            document_timeout: 单个文档提取的最长秒数，为None表示不限
+            memory_limit_mb: 工作进程的地址空间上限（MB），为None表示不限（仅POSIX系统生效）
+        """
+        self.page_timeout = page_timeout
+        self.document_timeout = document_timeout
+        self.memory_limit_mb = memory_limit_mb
+
+
+def _context():
+    # forkserver不会复制父进程的线程状态，比spawn启动快；不支持时（Windows）使用spawn
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def _apply_memory_limit(memory_limit_mb):
+    if memory_limit_mb and resource is not None:
+        limit = int(memory_limit_mb * 1024 * 1024)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _page_worker(connection, pdf_path, backend, page_indices, memory_limit_mb):
+    """工作进程：逐页提取并把结果发回父进程"""
+    _apply_memory_limit(memory_limit_mb)
+    try:
+        extractor = PageExtractor(pdf_path, backend)
+        page_count = extractor.page_count()
+    except Exception as e:
+        connection.send(("open_error", f"{type(e).__name__}: {e}"))
+        return
+    connection.send(("count", page_count))
+
+    for index in (range(page_count) if page_indices is None else page_indices):
+        try:
+            connection.send(("page", index, extractor.extract_page(index)))
+        except MemoryError:
+            # 内存耗尽后进程状态不可靠，由父进程重启
+            connection.send(("page_error", index, "超出内存上限"))
+            return
+        except Exception as e:
+            connection.send(("page_error", index, f"{type(e).__name__}: {e}"))
+    connection.send(("done",))
+
+
+def _call_worker(connection, function, args, memory_limit_mb):
+    """工作进程：执行一次函数调用并发回结果"""
+    _apply_memory_limit(memory_limit_mb)
+    try:
+        connection.send(("result", function(*args)))
+    except MemoryError:
+        connection.send(("error", "超出内存上限"))
+    except Exception as e:
+        connection.send(("error", f"{type(e).__name__}: {e}"))
+
+
+def _start(target, args):
+    receiver, sender = _context().Pipe(duplex=False)
+    process = _context().Process(target=target, args=(sender,) + args, daemon=True)
+    process.start()
+    sender.close()
+    return process, receiver
+
+
+def _stop(process, receiver):
+    receiver.close()
+    if process.is_alive():
+        process.kill()
+    process.join()
+
+
+def iter_pages_isolated(pdf_path, limits, page_indices=None, backend=None):
+    """
+    在隔离的工作进程中逐页提取文本
+
+    Args:
+        pdf_path: PDF文件路径
+        limits: ExtractionLimits
+        page_indices: 只提取这些页面（下标从0开始），为None时提取全部页面
+        backend: 提取后端名称
+
+    Yields:
+        tuple: (页面下标, 文本, 问题)，页面被跳过时文本为None、问题为原因说明，否则问题为None
+    """
+    deadline = time.monotonic() + limits.document_timeout if limits.document_timeout else None
+    remaining = None if page_indices is None else list(page_indices)
+
+    while remaining is None or remaining:
+        process, receiver = _start(_page_worker, (pdf_path, backend, remaining, limits.memory_limit_mb))
+        try:
+            while True:
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    if remaining is None:
+                        raise ExtractionTimeoutError("打开PDF文件超时")
+                    # 文档超时，剩余页面全部跳过
+                    for index in remaining:
+                        yield index, None, "文档提取超时"
+                    return
+
+                timeout = limits.page_timeout
+                if deadline is not None:
+                    timeout = deadline - now if timeout is None else min(timeout, deadline - now)
+                if not receiver.poll(timeout):
+                    if deadline is not None and time.monotonic() >= deadline:
+                        continue
+                    if remaining is None:
+                        raise ExtractionTimeoutError("打开PDF文件超时")
+                    yield remaining.pop(0), None, f"单页提取超过{limits.page_timeout:g}秒"
+                    break
+
+                try:
+                    message = receiver.recv()
+                except EOFError:
+                    # 工作进程崩溃（例如被系统因内存不足终止）
+                    if remaining is None:
+                        raise ExtractionTimeoutError("打开PDF文件时工作进程异常退出")
+                    if remaining:
+                        yield remaining.pop(0), None, "提取时工作进程异常退出"
+                    break
+
+                kind = message[0]
+                if kind == "open_error":
+                    raise Exception(message[1])
+                if kind == "count":
+                    if remaining is None:
+                        remaining = list(range(message[1]))
+                elif kind == "page":
+                    remaining.remove(message[1])
+                    yield message[1], message[2], None
+                elif kind == "page_error":
+                    remaining.remove(message[1])
+                    yield message[1], None, message[2]
+                if kind == "done" or not remaining:
+                    return
+        finally:
+            _stop(process, receiver)
+
+
+def call_isolated(function, args, limits, timeout=None):
+    """
+    在隔离的工作进程中执行一次函数调用
+
+    Args:
+        function: 模块级函数（需要能被子进程导入）
+        args: 参数元组
+        limits: ExtractionLimits，使用其内存上限
+        timeout: 最长秒数，为None时使用limits.document_timeout
+
+    Returns:
+        函数返回值
+
+    Raises:
+        ExtractionTimeoutError: 超时或工作进程崩溃
+        Exception: 函数抛出的异常（只保留说明文字）
+    """
+    timeout = limits.document_timeout if timeout is None else timeout
+    process, receiver = _start(_call_worker, (function, args, limits.memory_limit_mb))
+    try:
+        if not receiver.poll(timeout):
+            raise ExtractionTimeoutError(f"{getattr(function, '__name__', function)}超过{timeout:g}秒")
+        try:
+            kind, value = receiver.recv()
+        except EOFError:
+            raise ExtractionTimeoutError("工作进程异常退出")
+        if kind == "error":
+            raise Exception(value)
+        return value
+    finally:
+        _stop(process, receiver)
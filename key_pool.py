@@ -0,0 +1,268 @@
+import asyncio
+import collections
+import os
+import threading
+import time
+
+# 额度统计的时间窗口（秒）
+QUOTA_WINDOW = 60.0
+
+
+def is_key_error(error):
+    """
+    判断接口错误是否可能与所用的密钥或其线路有关，应计入密钥的连续错误
+
+    认证错误（401、403）、5xx错误和连接错误计入；请求本身的4xx错误（请求格式错误、输入过长等）
+    和客户端超时（通常是文档期限将到时缩短的超时）不计入，否则几个过长的请求就会剔除正常的密钥
+
+    Args:
+        error: 调用接口时抛出的异常
+
+    Returns:
+        bool: 是否计入密钥错误
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    if status_code is not None:
+        return status_code in (401, 403) or status_code >= 500
+    if isinstance(error, TimeoutError) or "Timeout" in type(error).__name__:
+        return False
+    return isinstance(error, ConnectionError) or "Connection" in type(error).__name__
+
+
+class APIKeyState:
+    """
+    单个API密钥的运行状态：额度使用、限流冷却和错误剔除
+    """
+
+    def __init__(self, api_key, requests_per_minute=None):
+        """
+        初始化密钥状态
+
+        Args:
+            api_key: API密钥
+            requests_per_minute: 该密钥每分钟允许的请求数，为None表示不限
+        """
+        self.api_key = api_key
+        self.requests_per_minute = requests_per_minute
+        self.in_flight = 0
+        self.request_times = collections.deque()
+        self.consecutive_errors = 0
+        self.total_requests = 0
+        self.total_errors = 0
+        self.total_throttled = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.cooldown_until = 0.0
+
+    def remaining_quota(self, now):
+        """
+        计算当前时间窗口内的剩余额度
+
+        Args:
+            now: 当前时间（time.monotonic()）
+
+        Returns:
+            float: 剩余可发出的请求数，不限额时返回无穷大
+        """
+        while self.request_times and now - self.request_times[0] >= QUOTA_WINDOW:
+            self.request_times.popleft()
+        if self.requests_per_minute is None:
+            return float("inf")
+        return self.requests_per_minute - len(self.request_times)
+
+    def available_at(self, now):
+        """
+        计算该密钥最早何时可以再次使用
+
+        Args:
+            now: 当前时间（time.monotonic()）
+
+        Returns:
+            float: 可用时间点，小于等于now表示立即可用
+        """
+        ready = max(self.ejected_until, self.cooldown_until)
+        if self.remaining_quota(now) <= 0 and self.request_times:
+            ready = max(ready, self.request_times[0] + QUOTA_WINDOW)
+        return ready
+
+    def masked(self):
+        """返回用于日志和指标的脱敏密钥"""
+        return f"{self.api_key[:6]}..." if len(self.api_key) > 6 else "***"
+
+
+class APIKeyPool:
+    """
+    多API密钥池
+
+    按剩余额度和在途请求数在多个密钥之间分配请求；被限流的密钥短暂冷却，
+    连续出错的密钥被临时剔除，剔除时间随剔除次数指数增长。
+    """
+
+    def __init__(self, api_keys, requests_per_minute=None, max_consecutive_errors=3,
+                 ejection_seconds=30.0, max_ejection_seconds=600.0, throttle_cooldown=5.0):
+        """
+        初始化密钥池
+
+        Args:
+            api_keys: API密钥列表，元素可以是字符串或(密钥, 每分钟请求数)元组
+            requests_per_minute: 未单独指定额度的密钥的每分钟请求数，为None表示不限
+            max_consecutive_errors: 连续出错多少次后剔除密钥
+            ejection_seconds: 首次剔除的时长（秒）
+            max_ejection_seconds: 剔除时长的上限（秒）
+            throttle_cooldown: 密钥被限流后的冷却时长（秒）
+        """
+        self.keys = []
+        for item in api_keys:
+            if isinstance(item, (tuple, list)):
+                key, rpm = item
+            else:
+                key, rpm = item, requests_per_minute
+            key = key.strip() if key else key
+            if key:
+                self.keys.append(APIKeyState(key, rpm))
+
+        if not self.keys:
+            raise ValueError("未提供API密钥，请设置ZHIPU_API_KEY环境变量或在初始化时提供")
+
+        self.max_consecutive_errors = max_consecutive_errors
+        self.ejection_seconds = ejection_seconds
+        self.max_ejection_seconds = max_ejection_seconds
+        self.throttle_cooldown = throttle_cooldown
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        """
+        从环境变量创建密钥池
+
+        ZHIPU_API_KEYS为逗号分隔的多个密钥，未设置时使用ZHIPU_API_KEY；
+        ZHIPU_KEY_RPM可以设置每个密钥的每分钟请求数。
+
+        Returns:
+            APIKeyPool: 密钥池
+        """
+        keys = os.getenv("ZHIPU_API_KEYS") or os.getenv("ZHIPU_API_KEY") or ""
+        rpm = os.getenv("ZHIPU_KEY_RPM")
+        if rpm and "requests_per_minute" not in kwargs:
+            kwargs["requests_per_minute"] = int(rpm)
+        return cls(keys.split(","), **kwargs)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _select(self):
+        """
+        选择一个密钥，调用方需持有锁
+
+        Returns:
+            tuple: (选中的密钥状态或None, 需要等待的秒数)
+        """
+        now = time.monotonic()
+        best = None
+        best_score = None
+        for state in self.keys:
+            if state.available_at(now) > now:
+                continue
+            # 剩余额度多的优先，额度相同（或不限额）时在途请求少的优先
+            score = (state.remaining_quota(now), -state.in_flight, -len(state.request_times))
+            if best is None or score > best_score:
+                best, best_score = state, score
+
+        if best is None:
+            wait = min(state.available_at(now) for state in self.keys) - now
+            return None, max(wait, 0.01)
+
+        best.in_flight += 1
+        best.total_requests += 1
+        best.request_times.append(now)
+        return best, 0.0
+
+    def acquire(self, timeout=None):
+        """
+        获取一个可用密钥，所有密钥都不可用时阻塞等待
+
+        Args:
+            timeout: 最多等待的秒数，为None时一直等待
+
+        Returns:
+            APIKeyState: 选中的密钥状态，使用完毕后需调用release；等待超时时为None
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                state, wait = self._select()
+            if state is not None:
+                return state
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """
+        acquire的异步版本，等待期间不阻塞事件循环
+
+        Returns:
+            APIKeyState: 选中的密钥状态，使用完毕后需调用release
+        """
+        while True:
+            with self._lock:
+                state, wait = self._select()
+            if state is not None:
+                return state
+            await asyncio.sleep(wait)
+
+    def release(self, state, outcome="success"):
+        """
+        归还密钥并记录请求结果
+
+        Args:
+            state: acquire返回的密钥状态
+            outcome: 请求结果，"success"、"throttled"、"error"（见is_key_error）、
+                     "failed"（与密钥无关的失败，不计入错误）或"cancelled"
+        """
+        with self._lock:
+            now = time.monotonic()
+            state.in_flight -= 1
+            if outcome == "success":
+                state.consecutive_errors = 0
+            elif outcome == "throttled":
+                state.total_throttled += 1
+                state.cooldown_until = now + self.throttle_cooldown
+            elif outcome == "error":
+                state.total_errors += 1
+                state.consecutive_errors += 1
+                # 只有一个密钥时没有可切换的对象，不做剔除
+                if len(self.keys) > 1 and state.consecutive_errors >= self.max_consecutive_errors:
+                    duration = min(self.max_ejection_seconds, self.ejection_seconds * (2 ** state.ejections))
+                    state.ejected_until = now + duration
+                    state.ejections += 1
+                    state.consecutive_errors = 0
+                    print(f"API密钥 {state.masked()} 连续出错，暂时剔除 {duration:.0f} 秒")
+
+    def snapshot(self):
+        """
+        获取每个密钥的状态指标
+
+        Returns:
+            list: 每个密钥一个字典
+        """
+        with self._lock:
+            now = time.monotonic()
+            return [
+                {
+                    "key": state.masked(),
+                    "in_flight": state.in_flight,
+                    "remaining_quota": state.remaining_quota(now) if state.requests_per_minute is not None else None,
+                    "requests": state.total_requests,
+                    "errors": state.total_errors,
+                    "throttled": state.total_throttled,
+                    "ejected": state.ejected_until > now,
+                    "cooling_down": state.cooldown_until > now
+                }
+                for state in self.keys
+            ]
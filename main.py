@@ -1,16 +1,95 @@
 import argparse
+import contextlib
+import json
 import os
 import sys
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 from PIL import Image, ImageTk
 from pdf_summarizer import PDFSummarizer
+from batch_scheduler import SCHEDULING_POLICIES, BudgetExceededError, DocumentJob, TokenBudget, build_jobs, order_jobs
+from document_packing import DEFAULT_MAX_PACK_DOCUMENTS
+from near_duplicates import DuplicateTracker, compute_signature, text_diff
+from pdf_reader import PDFReader
+from pdf_backends import BACKEND_ENV_VAR, BACKENDS
+from hedging import HEDGE_MAX_RATE_ENV_VAR, HEDGE_PERCENTILE_ENV_VAR
+from zhipu_ai import DEFAULT_REQUEST_TIMEOUT, REQUEST_TIMEOUT_ENV_VAR, ZhipuAI
+from model_routing import CASCADE_MAX_CHARS_ENV_VAR, DEFAULT_FAST_MODEL, DEFAULT_MAX_FAST_CHARS, FAST_MODEL_ENV_VAR
+from request_planner import COST_TARGET_ENV_VAR, LATENCY_TARGET_ENV_VAR, document_scope
+from scan_detection import SCANNED_POLICIES, ScannedDocumentError, check_extractable, ocr_available, require_text
+from chunk_manifest import manifest_path_for
+from folder_watcher import FolderWatcher
+from result_store import ResultStore
+from search_index import SearchIndex
+from collection_summary import COLLECTION_OUTPUT_NAME, CollectionSummarizer, render_collection_markdown
+from archive_io import OutputSink, StagedMember, is_archive, iter_archive_pdfs, output_name_for
+from batch_jobs import BatchJob, complete_locally
+from cancellation import ABORT_ERRORS, Cancelled, CancelToken, deadline_scope, write_file_atomic
+from profiling import DEFAULT_TOP_N, PROFILE_MODES, Profiler, profile_document, profile_stage, profiled
+from isolated_extraction import (DEFAULT_DOCUMENT_TIMEOUT, DEFAULT_MEMORY_LIMIT_MB, DEFAULT_PAGE_TIMEOUT,
+                                 ExtractionLimits)
 from dotenv import load_dotenv
+import threading
 import time
 import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
-def process_pdf(pdf_path, api_key=None, as_questions=True, custom_instruction=None):
+def render_markdown(pdf_path, result):
+    """
+    Format a summarization result as knowledge base friendly markdown
+    
+    Args:
+        pdf_path: Path to the source PDF file, its name is used as the title
+        result: Dict with 'summary' and 'key_concepts' as returned by PDFSummarizer
+    """
+    # Get filename without extension for title
+    filename = os.path.basename(pdf_path)
+    title = os.path.splitext(filename)[0]
+    
+    # Note the selected pages when only part of the document was summarized
+    scope = f"> 内容范围: {result['selection']}\n\n" if result.get("selection") else ""
+    
+    # Format output content in simplified format
+    return f"""# {title}
+
+{scope}## 内容摘要
+
+{result['summary']}
+
+## 关键概念
+
+{result['key_concepts']}
+"""
+
+
+def is_failed_result(result):
+    """
+    判断一个文档的总结是否失败：处理时抛出了异常，或模型调用出错、结果中只有错误信息
+    
+    Args:
+        result: PDFSummarizer返回的结果字典，或该文档的异常
+    """
+    if result is None or isinstance(result, Exception):
+        return True
+    return result["summary"].startswith("错误") or result["key_concepts"].startswith("错误")
+
+
+def is_output_up_to_date(pdf_path):
+    """
+    判断PDF文件同目录下的同名Markdown输出是否存在且不比PDF旧
+    
+    Args:
+        pdf_path: PDF文件路径
+    """
+    output_path = f"{os.path.splitext(pdf_path)[0]}.md"
+    return os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(pdf_path)
+
+
+@profiled
+def process_pdf(pdf_path, api_key=None, as_questions=True, custom_instruction=None, summarizer=None,
+                bounded_memory=False, page_range=None, section=None, scanned="skip", extraction_limits=None,
+                document_deadline=None, cancel_token=None, profiler=None):
     """
     Process PDF file and return results in knowledge base friendly markdown format
     
@@ -19,36 +98,63 @@ def process_pdf(pdf_path, api_key=None, as_questions=True, custom_instruction=No
         api_key: API key for ZhipuAI
         as_questions: If True, format summary and concepts as questions when possible
         custom_instruction: User's custom instructions for processing
+        summarizer: Optional shared PDFSummarizer, a new one is created if None
+        bounded_memory: If True, read the PDF in page windows and spool page text to disk
+        page_range: Only summarize these pages, e.g. "1-5,8"
+        section: Only summarize the pages of this outline (bookmark) section
+        scanned: What to do with scanned (image-only) documents: "skip" raises an error before
+                 any API call, "ocr" summarizes OCR text, "ignore" skips the pre-flight check
+        extraction_limits: Optional ExtractionLimits, extract pages in isolated worker processes and
+                           skip pages that exceed the time or memory limits
+        document_deadline: Optional number of seconds allowed for the whole document (extraction and model calls),
+                           DeadlineExceeded is raised once it has passed
+        cancel_token: Optional cancellation.CancelToken, processing stops with Cancelled at the next checkpoint
+                      after it has been cancelled
+        profiler: Optional profiling.Profiler (keyword only), record CPU and memory profiles of this document;
+                  if the profiler is not already running, its results are written when the call returns
     """
     try:
         # Initialize PDF summarizer
-        summarizer = PDFSummarizer(api_key=api_key)
+        if summarizer is None:
+            summarizer = PDFSummarizer(api_key=api_key, extraction_limits=extraction_limits)
         
         # Summarize PDF content
         print(f"Processing PDF file: {pdf_path}")
-        result = summarizer.summarize_pdf(pdf_path, as_questions=as_questions, custom_instruction=custom_instruction)
-        
-        # Get filename without extension for title
-        filename = os.path.basename(pdf_path)
-        title = os.path.splitext(filename)[0]
-        
-        # Format output content in simplified format
-        output_content = f"""# {title}
-
-## 内容摘要
-
-{result['summary']}
-
-## 关键概念
-
-{result['key_concepts']}
-"""
-        return output_content
+        with profile_document(pdf_path), deadline_scope(document_deadline, cancel_token), \
+                document_scope(summarizer.zhipu_ai.planner, os.path.basename(pdf_path)) as plan_scope:
+            if scanned != "ignore":
+                try:
+                    with profile_stage("preflight"):
+                        check_extractable(pdf_path, limits=extraction_limits)
+                except ScannedDocumentError:
+                    if scanned != "ocr":
+                        raise
+                    result = summarizer.summarize_scanned_pdf(pdf_path, as_questions=as_questions,
+                                                              custom_instruction=custom_instruction)
+                    if plan_scope is not None:
+                        plan_scope.succeeded = not is_failed_result(result)
+                    return render_markdown(pdf_path, result)
+            result = summarizer.summarize_pdf(pdf_path, as_questions=as_questions,
+                                              custom_instruction=custom_instruction, bounded_memory=bounded_memory,
+                                              page_range=page_range, section=section)
+            if plan_scope is not None:
+                plan_scope.succeeded = not is_failed_result(result)
+            
+            return render_markdown(pdf_path, result)
+    except ABORT_ERRORS:
+        raise
     except Exception as e:
         raise Exception(f"Error processing PDF: {str(e)}")
 
 
-def process_folder(folder_path, api_key=None, as_questions=True, progress_callback=None, custom_instruction=None):
+@profiled
+def process_folder(folder_path, api_key=None, as_questions=True, progress_callback=None, custom_instruction=None,
+                   max_workers=1, schedule="listdir", priorities=None, budget=None,
+                   pack_small=False, small_page_threshold=2, dedup_threshold=None, dedup_mode="reuse",
+                   incremental=False, files=None, summarizer=None, skip_up_to_date=False, event_callback=None,
+                   bounded_memory=False, page_range=None, section=None, scanned="skip", extraction_limits=None,
+                   result_store=None, write_markdown=True, search_index=None, document_deadline=None,
+                   cancel_token=None, profiler=None):
     """
     处理文件夹中的所有PDF文件，并在同一文件夹中生成同名的Markdown文件
     
@@ -56,68 +162,748 @@ def process_folder(folder_path, api_key=None, as_questions=True, progress_callba
         folder_path: 文件夹路径
         api_key: ZhipuAI的API密钥
         as_questions: 如果为True，尽可能将摘要和概念格式化为问题
-        progress_callback: 进度回调函数，接收当前处理的文件索引和总文件数
+        progress_callback: 进度回调函数，接收已完成的文件数和总文件数（在调用线程中执行）
         custom_instruction: 用户自定义处理说明
+        max_workers: 同时处理的文件数，实际的模型调用并发由ZhipuAI的自适应并发限制器控制
+        schedule: 调度策略，"listdir"、"shortest"、"oldest"或"priority"，见batch_scheduler.order_jobs
+        priorities: {文件名通配符: 优先级} 字典，用于"priority"策略
+        budget: 可选的batch_scheduler.TokenBudget，超出预算的文件会被跳过
+        pack_small: 如果为True，把页数不超过small_page_threshold的小文件合并到少量请求中处理
+        small_page_threshold: 打包模式下视为小文件的最大页数
+        dedup_threshold: 近似重复检测的相似度阈值（0-1），为None时不检测；
+                         与已总结文件相似度达到阈值的文件不再完整总结（打包处理的小文件不参与检测）
+        dedup_mode: "reuse"直接复用相似文件的结果，"diff"只把文本差异发送给模型更新相似文件的摘要
+        incremental: 如果为True，在每个输出旁保存分块哈希清单，文件修订后只重新总结变化的分块
+        files: 只处理文件夹中的这些文件名，为None时处理全部PDF文件
+        summarizer: 可选的共享PDFSummarizer，为None时新建
+        skip_up_to_date: 如果为True，跳过已有输出且输出比PDF新的文件
+        event_callback: 事件回调函数，接收start、file_done、file_failed、file_skipped和summary事件字典（在调用线程中执行）
+        bounded_memory: 如果为True，按页窗口读取PDF并把页面文本暂存到磁盘，超大文件的内存占用保持不变
+                        （近似重复检测仍需读取全文）
+        page_range: 每个文件只总结这些页，例如 "1-5"；选择页面时不打包小文件，也不做近似重复检测
+        section: 每个文件只总结该书签章节，没有该章节的文件记为失败
+        scanned: 扫描文档（没有可提取文本）的处理方式："skip"跳过并记录，不消耗API额度；
+                 "ocr"在其他文件处理完后放入单独的OCR队列处理；"ignore"不做预检
+        extraction_limits: 可选的ExtractionLimits，提供时每个文件在隔离的工作进程中提取，
+                           超时、超出内存或导致崩溃的页面被跳过并记录在file_done事件中，不会拖住其他文件
+        result_store: 可选的result_store.ResultStore，每个成功的结果连同哈希、耗时和令牌用量批量写入结果库
+        write_markdown: 如果为False，不在PDF旁生成Markdown文件，结果只写入result_store
+                        （之后可以用export_markdown重新生成），skip_up_to_date改为检查结果库
+        search_index: 可选的search_index.SearchIndex，每个成功的结果写入后增量更新全文检索索引
+        document_deadline: 每个文件（打包处理时每组）允许的处理秒数，包括文本提取和模型调用；
+                           超过期限的文件在下一个检查点停止并记为失败，不会一直占用工作线程
+        cancel_token: 可选的cancellation.CancelToken，取消后尚未开始的文件不再处理，进行中的文件在下一个
+                      检查点停止，这些文件记为跳过；已写出的输出都是完整的。处理被中断（Ctrl-C）时同样如此，
+                      随后重新抛出KeyboardInterrupt
+        profiler: 可选的profiling.Profiler（关键字参数），按文档和阶段记录CPU和内存分析；
+                  Profiler未在运行时由本次调用启动，处理结束后写出分析结果
     """
     processed_files = []
     errors = []
+    skipped = []
+    scanned_files = []
     
     # 检查文件夹是否存在
     if not os.path.isdir(folder_path):
         raise ValueError(f"文件夹路径不存在: {folder_path}")
+    if scanned not in SCANNED_POLICIES:
+        raise ValueError(f"不支持的扫描文档处理方式: {scanned}，可选: {', '.join(SCANNED_POLICIES)}")
+    if scanned == "ocr" and not ocr_available():
+        raise ValueError("OCR需要安装pymupdf、pytesseract和Pillow，以及tesseract程序")
+    if not write_markdown and result_store is None:
+        raise ValueError("不生成Markdown文件时必须提供result_store")
     
     # 获取文件夹中的所有PDF文件
-    pdf_files = [f for f in os.listdir(folder_path) if f.lower().endswith('.pdf')]
+    if files is None:
+        files = os.listdir(folder_path)
+    pdf_files = [f for f in files if f.lower().endswith('.pdf')]
+    
+    up_to_date = 0
+    if skip_up_to_date:
+        up_to_date_check = is_output_up_to_date if write_markdown else result_store.is_up_to_date
+        remaining = [f for f in pdf_files if not up_to_date_check(os.path.join(folder_path, f))]
+        up_to_date = len(pdf_files) - len(remaining)
+        pdf_files = remaining
+    
+    def emit(event, **fields):
+        if event_callback:
+            event_callback(dict(event=event, time=round(time.time(), 3), **fields))
+    
+    emit("start", folder=folder_path, total_files=len(pdf_files), up_to_date=up_to_date)
+    run_started = time.monotonic()
     
     if not pdf_files:
-        return {"processed_files": [], "errors": [], "total_processed": 0, "total_errors": 0}
+        result = {"processed_files": [], "errors": [], "skipped": [],
+                  "total_processed": 0, "total_errors": 0, "total_skipped": 0,
+                  "duplicate_clusters": {}, "scanned": [],
+                  "cancelled": cancel_token is not None and cancel_token.cancelled,
+                  "metrics": summarizer.zhipu_ai.get_metrics() if summarizer is not None else {}}
+        emit("summary", duration=0.0, **{key: value for key, value in result.items() if key != "processed_files"})
+        return result
     
     total_files = len(pdf_files)
+    pdf_paths = [os.path.join(folder_path, f) for f in pdf_files]
     
-    for i, pdf_file in enumerate(pdf_files):
-        # 更新进度
-        if progress_callback:
-            progress_callback(i+1, total_files)
-            
-        pdf_path = os.path.join(folder_path, pdf_file)
+    # 打包和近似重复检测基于全文，只选择部分页面时不使用
+    if page_range is not None or section is not None:
+        pack_small = False
+        dedup_threshold = None
+    
+    # 需要排序、控制预算或打包时才估算每个文件的成本
+    if schedule != "listdir" or budget is not None or pack_small:
+        # 增量和低内存模式下长文档按分块总结，请求数随分块数增加
+        jobs = order_jobs(build_jobs(pdf_paths, priorities, extraction_limits=extraction_limits,
+                                     chunked=incremental or bounded_memory), schedule)
+    else:
+        jobs = [DocumentJob(pdf_path) for pdf_path in pdf_paths]
+    
+    # 所有文件共用一个总结器（及其客户端和并发限制器）
+    if summarizer is None:
+        summarizer = PDFSummarizer(api_key=api_key, extraction_limits=extraction_limits)
+    
+    # 没有提供取消标记时也创建一个，中断时用它停止进行中的文件
+    if cancel_token is None:
+        cancel_token = CancelToken()
+
+    duplicates = DuplicateTracker(dedup_threshold) if dedup_threshold is not None else None
+    
+    def output_path_for(job):
+        # 生成输出文件名（与原PDF文件同名，但扩展名为.md）
+        base_name = os.path.splitext(job.name)[0]
+        return os.path.join(folder_path, f"{base_name}.md")
+    
+    def write_output(job, result, job_stats):
+        if result_store is not None:
+            result_store.put(job.pdf_path, result, job_stats)
+        if search_index is not None:
+            search_index.add_result(job.pdf_path, result)
+        if not write_markdown:
+            return f"{result_store.db_path}!{job.name}"
+        
+        # 保存内容到文件（先写临时文件再替换，中断时不会留下写了一半的输出）
+        content = render_markdown(job.pdf_path, result)
+        output_path = output_path_for(job)
+        write_file_atomic(output_path, content)
+        return output_path
+    
+    def run_jobs(batch, summarize):
+        """在预算内执行一组文件的总结，返回[(文件名, 输出路径, 异常, 统计信息)]"""
+        estimated_tokens = sum(job.estimated_tokens for job in batch)
+        started = time.monotonic()
+        
+        def stats(usage):
+            # 打包处理的文件平均分摊整组的用量
+            tokens = usage.as_dict() if usage else {}
+            return {
+                "duration": round(time.monotonic() - started, 3),
+                "tokens": {key: value // len(batch) for key, value in tokens.items()},
+                "batch_size": len(batch)
+            }
+        
+        # 已取消时不再开始新的文件
+        if cancel_token.cancelled:
+            return [(job.name, None, Cancelled(cancel_token.reason), stats(None)) for job in batch]
+        
+        # 预留预算，额度不足时整组跳过
+        if budget is not None:
+            try:
+                budget.reserve(estimated_tokens)
+            except BudgetExceededError as e:
+                return [(job.name, None, e, stats(None)) for job in batch]
+        
+        usage = None
         try:
-            # 处理PDF文件
-            content = process_pdf(pdf_path, api_key, as_questions, custom_instruction)
-            
-            # 生成输出文件名（与原PDF文件同名，但扩展名为.md）
-            base_name = os.path.splitext(pdf_file)[0]
-            output_path = os.path.join(folder_path, f"{base_name}.md")
-            
-            # 保存内容到文件
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(content)
-            
-            processed_files.append(output_path)
-            print(f"成功处理: {pdf_file} -> {base_name}.md")
-            
+            with summarizer.zhipu_ai.track_usage() as usage, deadline_scope(document_deadline, cancel_token), \
+                    document_scope(summarizer.zhipu_ai.planner, ", ".join(job.name for job in batch)) as plan_scope:
+                results = summarize(batch)
+                if plan_scope is not None:
+                    plan_scope.succeeded = not any(is_failed_result(results.get(job.pdf_path)) for job in batch)
         except Exception as e:
-            errors.append(f"{pdf_file}: {str(e)}")
-            print(f"处理失败: {pdf_file} - {str(e)}")
+            return [(job.name, None, e, stats(usage)) for job in batch]
+        finally:
+            if budget is not None:
+                budget.settle(estimated_tokens, usage.total_tokens if usage else 0)
+        
+        outcomes = []
+        for job in batch:
+            try:
+                result = results[job.pdf_path]
+                if isinstance(result, Exception):
+                    raise result
+                job_stats = stats(usage)
+                if result.get("skipped_pages"):
+                    job_stats["skipped_pages"] = result["skipped_pages"]
+                with profile_stage("write"):
+                    output_path = write_output(job, result, job_stats)
+                outcomes.append((job.name, output_path, None, job_stats))
+            except Exception as e:
+                outcomes.append((job.name, None, e, stats(usage)))
+        return outcomes
+    
+    def run_profiled(batch, summarize):
+        with profile_document(batch[0].pdf_path, len(batch)):
+            return run_jobs(batch, summarize)
     
-    # 完成所有处理后，更新进度为100%
-    if progress_callback:
-        progress_callback(total_files, total_files)
+    def manifest_path(job):
+        return manifest_path_for(output_path_for(job)) if incremental else None
+    
+    def preflight(job):
+        # 扫描文档在发送任何请求之前被识别出来
+        if scanned != "ignore":
+            with profile_stage("preflight"):
+                check_extractable(job.pdf_path, limits=extraction_limits)
+    
+    def summarize_single(batch):
+        job = batch[0]
+        print(f"Processing PDF file: {job.pdf_path}")
+        preflight(job)
+        if duplicates is None:
+            return {job.pdf_path: summarizer.summarize_pdf(job.pdf_path, as_questions=as_questions,
+                                                           custom_instruction=custom_instruction,
+                                                           manifest_path=manifest_path(job),
+                                                           bounded_memory=bounded_memory,
+                                                           page_range=page_range, section=section)}
+        return {job.pdf_path: summarize_deduplicated(job)}
+    
+    def summarize_deduplicated(job):
+        """总结一个文件，与已总结文件近似重复时复用或增量更新其结果"""
+        with profile_stage("extract"):
+            pdf_reader = PDFReader(job.pdf_path, limits=extraction_limits)
+            pages = pdf_reader.read_pages()
+        text = "".join(pages)
+        page_count = len(pages)
+        
+        if pdf_reader.problems and not text:
+            raise Exception(f"所有页面都未能提取（{pdf_reader.problems[0]['reason']}等）")
+        # 预检只看抽样页面，提取后没有任何文字的文档不参与查重，也不发送给模型
+        require_text(pages)
         
-    return {
+        match = duplicates.claim(job.pdf_path, compute_signature(text))
+        if match is not None:
+            canonical_path, similarity = match
+            canonical = duplicates.wait(canonical_path)
+            if canonical is not None:
+                print(f"{job.name} 与 {os.path.basename(canonical_path)} 近似重复（相似度{similarity:.2f}），复用其结果")
+                result = {"summary": canonical["summary"], "key_concepts": canonical["key_concepts"],
+                          "page_count": page_count}
+                if dedup_mode == "diff":
+                    canonical_text = PDFReader(canonical_path, limits=extraction_limits).read_pdf()
+                    added_text, removed_text = text_diff(canonical_text, text)
+                    if added_text or removed_text:
+                        result["summary"] = summarizer.zhipu_ai.update_summary(
+                            canonical["summary"], added_text, removed_text,
+                            as_questions=as_questions, custom_instruction=custom_instruction
+                        )
+                return result
+            # 代表文件处理失败，自行完整总结
+            with profile_stage("summarize"):
+                return summarizer.summarize_pages(pages, as_questions, custom_instruction, manifest_path(job))
+        
+        result = None
+        try:
+            with profile_stage("summarize"):
+                result = summarizer.summarize_pages(pages, as_questions, custom_instruction, manifest_path(job))
+            return result
+        finally:
+            # 出错的结果不能被重复文件复用
+            duplicates.complete(job.pdf_path, None if is_failed_result(result) else result)
+    
+    def summarize_pack(batch):
+        results = {}
+        for job in batch:
+            try:
+                preflight(job)
+            except Exception as e:
+                results[job.pdf_path] = e
+        results.update(summarizer.summarize_pdfs_packed([job.pdf_path for job in batch if job.pdf_path not in results],
+                                                        as_questions=as_questions,
+                                                        custom_instruction=custom_instruction))
+        return results
+    
+    def summarize_ocr(batch):
+        job = batch[0]
+        return {job.pdf_path: summarizer.summarize_scanned_pdf(job.pdf_path, as_questions=as_questions,
+                                                               custom_instruction=custom_instruction)}
+    
+    # 打包模式下，小文件按调度顺序每max_pack_documents个分为一组
+    batches = []
+    if pack_small:
+        small_jobs = [job for job in jobs if 0 < job.page_count <= small_page_threshold]
+        small_set = set(id(job) for job in small_jobs)
+        for start in range(0, len(small_jobs), DEFAULT_MAX_PACK_DOCUMENTS):
+            batches.append((summarize_pack, small_jobs[start:start + DEFAULT_MAX_PACK_DOCUMENTS]))
+        jobs = [job for job in jobs if id(job) not in small_set]
+    batches.extend((summarize_single, [job]) for job in jobs)
+    
+    jobs_by_name = {job.name: job for _, batch in batches for job in batch}
+    ocr_queue = []
+    completed = 0
+    
+    def record(pdf_file, output_path, error, stats, from_ocr=False):
+        nonlocal completed
+        if error is None:
+            processed_files.append(output_path)
+            print(f"成功处理: {pdf_file} -> {os.path.basename(output_path)}")
+            emit("file_done", file=pdf_file, output=output_path, **stats)
+        elif isinstance(error, ScannedDocumentError) and scanned == "ocr" and not from_ocr:
+            # 扫描文档放入OCR队列，完成后再计入进度
+            print(f"扫描文档，加入OCR队列: {pdf_file}")
+            ocr_queue.append(jobs_by_name[pdf_file])
+            return
+        elif isinstance(error, (BudgetExceededError, ScannedDocumentError, Cancelled)):
+            if isinstance(error, ScannedDocumentError):
+                scanned_files.append(pdf_file)
+            skipped.append(f"{pdf_file}: {str(error)}")
+            print(f"跳过: {pdf_file} - {str(error)}")
+            emit("file_skipped", file=pdf_file, reason=str(error), **stats)
+        else:
+            errors.append(f"{pdf_file}: {str(error)}")
+            print(f"处理失败: {pdf_file} - {str(error)}")
+            emit("file_failed", file=pdf_file, error=str(error), **stats)
+        
+        # 更新进度
+        completed += 1
+        if progress_callback:
+            progress_callback(completed, total_files)
+    
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        # 线程池按提交顺序开始任务，因此提交顺序即调度顺序
+        futures = [executor.submit(run_profiled, batch, summarize) for summarize, batch in batches]
+        
+        try:
+            for future in as_completed(futures):
+                for outcome in future.result():
+                    record(*outcome)
+        except BaseException:
+            # 中断（Ctrl-C）或回调出错：尚未开始的文件不再处理，进行中的文件在下一个检查点停止，
+            # 已完成的结果写入结果库和索引后再向上抛出
+            cancel_token.cancel("处理被中断")
+            executor.shutdown(wait=True, cancel_futures=True)
+            for store in (result_store, search_index):
+                if store is not None:
+                    store.flush()
+            raise
+    
+    # OCR占用大量CPU，扫描文档在单独的队列中逐个处理
+    if ocr_queue:
+        print(f"开始OCR队列，共{len(ocr_queue)}个扫描文档")
+        for job in ocr_queue:
+            scanned_files.append(job.name)
+            for outcome in run_profiled([job], summarize_ocr):
+                record(*outcome, from_ocr=True)
+    
+    # 不足一批的结果在本次运行结束时写入
+    if result_store is not None:
+        result_store.flush()
+    if search_index is not None:
+        search_index.flush()
+    
+    duplicate_clusters = {}
+    if duplicates is not None:
+        for canonical_path, members in duplicates.report().items():
+            duplicate_clusters[os.path.basename(canonical_path)] = [
+                {"file": os.path.basename(member["key"]), "similarity": member["similarity"]} for member in members
+            ]
+            print(f"近似重复: {os.path.basename(canonical_path)} <- "
+                  f"{', '.join(os.path.basename(member['key']) for member in members)}")
+    
+    metrics = summarizer.zhipu_ai.get_metrics()
+    if budget is not None:
+        metrics["budget"] = budget.as_dict()
+    print(f"当前模型调用并发上限: {metrics['concurrency']['limit']}，"
+          f"本次消耗令牌: {metrics['usage']['total_tokens']}")
+    
+    result = {
         "processed_files": processed_files,
         "errors": errors,
+        "skipped": skipped,
         "total_processed": len(processed_files),
-        "total_errors": len(errors)
+        "total_errors": len(errors),
+        "total_skipped": len(skipped),
+        "duplicate_clusters": duplicate_clusters,
+        "scanned": scanned_files,
+        "cancelled": cancel_token.cancelled,
+        "metrics": metrics
     }
-    if progress_callback:
-        progress_callback(total_files, total_files)
+    emit("summary", duration=round(time.monotonic() - run_started, 3),
+         **{key: value for key, value in result.items() if key != "processed_files"})
+    return result
+
+
+def default_archive_output(archive_path):
+    """
+    Default output directory for an archive: next to it, named after it with a _summaries suffix
+    """
+    name = os.path.basename(archive_path)
+    for extension in (".tar.gz", ".tar.bz2", ".tar.xz"):
+        if name.lower().endswith(extension):
+            name = name[:-len(extension)]
+            break
+    else:
+        name = os.path.splitext(name)[0]
+    return os.path.join(os.path.dirname(os.path.abspath(archive_path)), f"{name}_summaries")
+
+
+@profiled
+def process_archive(archive_path, output_path=None, api_key=None, as_questions=True, progress_callback=None,
+                    custom_instruction=None, max_workers=1, summarizer=None, event_callback=None,
+                    bounded_memory=False, page_range=None, section=None, scanned="skip", extraction_limits=None,
+                    temp_dir=None, document_deadline=None, cancel_token=None, profiler=None):
+    """
+    直接处理ZIP/TAR归档中的PDF文件，不需要先把归档解压到磁盘
+    
+    归档按顺序流式读取，每个PDF成员只在处理期间暂存为临时文件，处理完立即删除，
+    同一时刻最多暂存max_workers个成员，磁盘占用与归档大小无关。
+    
+    Args:
+        archive_path: ZIP或TAR归档路径（支持.tar.gz、.tar.bz2、.tar.xz）
+        output_path: 输出目录，或以归档扩展名结尾的输出归档；为None时输出到归档旁的"<归档名>_summaries"目录。
+                     输出文件保持成员在归档中的相对路径，扩展名改为.md
+        api_key: ZhipuAI的API密钥
+        as_questions: 如果为True，尽可能将摘要和概念格式化为问题
+        progress_callback: 进度回调函数，接收已完成的文件数和总文件数（总数未知，为None）
+        custom_instruction: 用户自定义处理说明
+        max_workers: 同时处理的文件数，也是同时暂存的成员数
+        summarizer: 可选的共享PDFSummarizer，为None时新建
+        event_callback: 事件回调函数，接收start、file_done、file_failed、file_skipped和summary事件字典
+        bounded_memory: 如果为True，按页窗口读取PDF并把页面文本暂存到磁盘
+        page_range: 每个文件只总结这些页，例如 "1-5"
+        section: 每个文件只总结该书签章节
+        scanned: 扫描文档的处理方式："skip"跳过并记录，"ocr"OCR后总结，"ignore"不做预检
+        extraction_limits: 可选的ExtractionLimits，提供时在隔离的工作进程中提取
+        temp_dir: 暂存成员的目录，为None时使用系统临时目录
+        document_deadline: 每个文件允许的处理秒数，超过期限的文件记为失败
+        cancel_token: 可选的cancellation.CancelToken，取消（或Ctrl-C中断）后不再读取新的成员，
+                      进行中的文件在下一个检查点停止并记为跳过
+        profiler: 可选的profiling.Profiler（关键字参数），按成员和阶段记录CPU和内存分析
+    
+    Returns:
+        dict: 与process_folder相同的结果字典，文件名为成员在归档中的路径
+    """
+    if not os.path.isfile(archive_path):
+        raise ValueError(f"归档文件不存在: {archive_path}")
+    if not is_archive(archive_path):
+        raise ValueError(f"不支持的归档格式: {archive_path}")
+    if scanned not in SCANNED_POLICIES:
+        raise ValueError(f"不支持的扫描文档处理方式: {scanned}，可选: {', '.join(SCANNED_POLICIES)}")
+    if scanned == "ocr" and not ocr_available():
+        raise ValueError("OCR需要安装pymupdf、pytesseract和Pillow，以及tesseract程序")
+    
+    if output_path is None:
+        output_path = default_archive_output(archive_path)
+    if summarizer is None:
+        summarizer = PDFSummarizer(api_key=api_key, extraction_limits=extraction_limits)
+    if cancel_token is None:
+        cancel_token = CancelToken()
+    
+    processed_files = []
+    errors = []
+    skipped = []
+    scanned_files = []
+    completed = 0
+    results_lock = threading.Lock()
+    
+    def emit(event, **fields):
+        if event_callback:
+            event_callback(dict(event=event, time=round(time.time(), 3), **fields))
+    
+    def summarize(staged):
+        if scanned != "ignore":
+            try:
+                with profile_stage("preflight"):
+                    check_extractable(staged.path, limits=extraction_limits)
+            except ScannedDocumentError:
+                if scanned != "ocr":
+                    raise
+                return summarizer.summarize_scanned_pdf(staged.path, as_questions=as_questions,
+                                                        custom_instruction=custom_instruction)
+        return summarizer.summarize_pdf(staged.path, as_questions=as_questions, custom_instruction=custom_instruction,
+                                        bounded_memory=bounded_memory, page_range=page_range, section=section)
+    
+    def process_member(staged, sink):
+        nonlocal completed
+        member_name = staged.member_name
+        started = time.monotonic()
+        print(f"Processing PDF file: {member_name}")
+        output = error = None
+        try:
+            with staged, summarizer.zhipu_ai.track_usage() as usage, profile_document(member_name), \
+                    deadline_scope(document_deadline, cancel_token), \
+                    document_scope(summarizer.zhipu_ai.planner, member_name) as plan_scope:
+                result = summarize(staged)
+                with profile_stage("write"):
+                    output = sink.write(output_name_for(member_name), render_markdown(staged.path, result))
+                if plan_scope is not None:
+                    plan_scope.succeeded = not is_failed_result(result)
+        except Exception as e:
+            error = e
+        stats = {"duration": round(time.monotonic() - started, 3), "tokens": usage.as_dict()}
         
-    return {
+        with results_lock:
+            if error is None:
+                processed_files.append(output)
+                print(f"成功处理: {member_name} -> {output}")
+                emit("file_done", file=member_name, output=output, **stats)
+            elif isinstance(error, (ScannedDocumentError, Cancelled)):
+                if isinstance(error, ScannedDocumentError):
+                    scanned_files.append(member_name)
+                skipped.append(f"{member_name}: {str(error)}")
+                print(f"跳过: {member_name} - {str(error)}")
+                emit("file_skipped", file=member_name, reason=str(error), **stats)
+            else:
+                errors.append(f"{member_name}: {str(error)}")
+                print(f"处理失败: {member_name} - {str(error)}")
+                emit("file_failed", file=member_name, error=str(error), **stats)
+            completed += 1
+            if progress_callback:
+                progress_callback(completed, None)
+    
+    emit("start", archive=archive_path, output=output_path)
+    run_started = time.monotonic()
+    
+    # 暂存名额在成员处理完后释放，限制同时存在的临时文件数
+    slots = threading.BoundedSemaphore(max(1, max_workers))
+    
+    def run(staged, sink):
+        try:
+            process_member(staged, sink)
+        finally:
+            slots.release()
+    
+    with OutputSink(output_path) as sink, ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = []
+        try:
+            # 归档只能在当前线程中按顺序读取（TAR为流式读取），成员暂存后交给线程池处理
+            for member_name, member, _ in iter_archive_pdfs(archive_path):
+                if cancel_token.cancelled:
+                    break
+                slots.acquire()
+                try:
+                    staged = StagedMember(member_name, member, temp_dir)
+                except Exception as e:
+                    slots.release()
+                    with results_lock:
+                        errors.append(f"{member_name}: {str(e)}")
+                        completed += 1
+                    print(f"读取归档成员失败: {member_name} - {str(e)}")
+                    emit("file_failed", file=member_name, error=str(e), duration=0.0, tokens={})
+                    continue
+                futures.append(executor.submit(run, staged, sink))
+            
+            for future in as_completed(futures):
+                future.result()
+        except BaseException:
+            # 中断（Ctrl-C）：进行中的成员在下一个检查点停止，输出归档仍被完整关闭
+            cancel_token.cancel("处理被中断")
+            executor.shutdown(wait=True)
+            raise
+    
+    metrics = summarizer.zhipu_ai.get_metrics()
+    result = {
         "processed_files": processed_files,
         "errors": errors,
+        "skipped": skipped,
         "total_processed": len(processed_files),
-        "total_errors": len(errors)
+        "total_errors": len(errors),
+        "total_skipped": len(skipped),
+        "scanned": scanned_files,
+        "cancelled": cancel_token.cancelled,
+        "output": output_path,
+        "metrics": metrics
+    }
+    emit("summary", duration=round(time.monotonic() - run_started, 3),
+         **{key: value for key, value in result.items() if key != "processed_files"})
+    return result
+
+
+def export_markdown(result_store, output_dir=None, folder=None):
+    """
+    从结果库重新生成Markdown输出
+    
+    Args:
+        result_store: result_store.ResultStore
+        output_dir: 输出目录，为None时与process_folder相同，写在每个源PDF旁边；
+                    同时提供folder时在输出目录中保持相对于folder的子目录结构
+        folder: 只导出该文件夹（含子文件夹）中的文件，为None时导出全部
+    
+    Returns:
+        list: 生成的Markdown文件路径
+    """
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    
+    exported = []
+    for row in result_store.iter_results(folder):
+        base_name = os.path.splitext(row["name"])[0]
+        directory = os.path.dirname(row["path"])
+        if output_dir is not None:
+            relative = os.path.relpath(directory, os.path.abspath(folder)) if folder is not None else "."
+            directory = os.path.normpath(os.path.join(output_dir, relative))
+            os.makedirs(directory, exist_ok=True)
+        output_path = os.path.join(directory, f"{base_name}.md")
+        write_file_atomic(output_path, render_markdown(row["path"], row))
+        exported.append(output_path)
+    return exported
+
+
+def summarize_collection(folder_path, api_key=None, output_path=None, result_store=None, as_questions=True,
+                         custom_instruction=None, summarizer=None):
+    """
+    由文件夹中已有的单文档结果生成整个集合的分层概述，不重新读取PDF
+    
+    只有输入发生变化的文件夹分支会重新汇总，其余汇总从集合根目录的缓存中复用。
+    
+    Args:
+        folder_path: 集合根目录（通常是process_folder处理过的文件夹）
+        api_key: ZhipuAI的API密钥
+        output_path: 概述的Markdown输出路径，为None时写入根目录下的_collection_summary.md
+        result_store: 可选的ResultStore，提供时从结果库读取文档总结，否则读取文件夹中的Markdown输出
+        as_questions: 如果为True，尽可能将内容格式化为问题形式
+        custom_instruction: 用户自定义处理说明
+        summarizer: 可选的共享PDFSummarizer，为None时新建
+    
+    Returns:
+        dict: 概述树的根节点（见CollectionSummarizer.summarize_folder），另含output
+    """
+    if summarizer is None:
+        summarizer = PDFSummarizer(api_key=api_key)
+    
+    collection = CollectionSummarizer(summarizer.zhipu_ai, as_questions=as_questions,
+                                      custom_instruction=custom_instruction)
+    tree = collection.summarize_folder(folder_path, result_store)
+    if tree is None:
+        raise ValueError(f"文件夹中没有已生成的文档总结: {folder_path}")
+    
+    if output_path is None:
+        output_path = os.path.join(folder_path, COLLECTION_OUTPUT_NAME)
+    write_file_atomic(output_path, render_collection_markdown(tree))
+    tree["output"] = output_path
+    print(f"集合概述已保存: {output_path}（{tree['documents']}个文档，调用模型{tree['calls']}次，复用{tree['reused']}个汇总）")
+    return tree
+
+
+def process_folder_batch(folder_path, batch_dir, api_key=None, results_files=(), complete_locally_rounds=0,
+                         summarizer=None, **folder_options):
+    """
+    以离线批处理方式处理文件夹：文本提取和提示词构建在本地完成，模型请求写入批处理请求文件，
+    通过（有折扣的）异步批处理接口完成后再导入结果
+
+    每次调用先导入results_files，再按process_folder的流程处理文件夹：请求都已有结果的文件正常写出输出，
+    其余文件跳过，它们的请求写入batch_dir中下一轮的请求文件。长文档的汇总请求依赖分块总结，
+    需要再导入一轮结果。两次调用之间不要修改文件夹中的PDF和处理选项，否则请求的custom_id会变化。
+
+    Args:
+        folder_path: 文件夹路径
+        batch_dir: 批处理工作目录，保存请求文件和已导入的结果
+        api_key: ZhipuAI的API密钥，只在本地完成请求时使用
+        results_files: 要导入的批处理结果文件（输出文件或错误文件）
+        complete_locally_rounds: 大于0时，不使用批处理接口，而是逐个调用接口在本地完成请求文件并导入，
+                                 最多重复这么多轮（用于测试，设置ZHIPU_CASSETTE时可以离线回放）
+        summarizer: 可选的共享PDFSummarizer，为None时新建
+        **folder_options: 传给process_folder的其他参数
+
+    Returns:
+        dict: 最后一轮process_folder的结果，另含batch：requests（新写出的请求文件）、
+              pending（待提交的请求数）和outstanding（已写出但尚未导入结果的请求数）
+    """
+    job = BatchJob(batch_dir)
+    for path in results_files:
+        print(f"导入批处理结果: {path}（{job.ingest(path)}条）")
+    if job.retry:
+        print(f"{len(job.retry)}个请求暂时失败（限流、超时或服务端错误），将写入下一轮请求文件重新提交")
+
+    if summarizer is None:
+        summarizer = PDFSummarizer(api_key=api_key, extraction_limits=folder_options.get("extraction_limits"))
+    summarizer.zhipu_ai.cassette = job
+    live = ZhipuAI(api_key) if complete_locally_rounds else None
+
+    rounds = 0
+    while True:
+        result = process_folder(folder_path, api_key, summarizer=summarizer, **folder_options)
+        requests_path = job.write_requests()
+        if requests_path is None or rounds >= complete_locally_rounds:
+            break
+        rounds += 1
+        results_path = requests_path.replace("requests-", "results-")
+        print(f"在本地完成批处理请求: {requests_path} -> {results_path}")
+        complete_locally(requests_path, results_path, lambda body: live._create(body["messages"], body["model"],
+                                                                            body.get("max_tokens")))
+        job.ingest(results_path)
+
+    outstanding = job.outstanding()
+    result["batch"] = {
+        "requests": requests_path,
+        "pending": sum(1 for path in outstanding.values() if path == requests_path),
+        "outstanding": len(outstanding)
     }
+    if requests_path:
+        print(f"已写出批处理请求文件: {requests_path}（{result['batch']['pending']}个请求），"
+              f"完成后用 --batch-results 导入结果")
+    elif outstanding:
+        print(f"还有{len(outstanding)}个已提交的请求没有结果，请导入对应的批处理结果文件")
+    return result
+
+
+def watch_folder(folder_path, api_key=None, as_questions=True, custom_instruction=None, max_workers=2,
+                 poll_interval=2.0, debounce_seconds=3.0, **folder_options):
+    """
+    持续监视文件夹，新增或修改的PDF写入完成后自动生成同名Markdown文件
+    
+    启动时先处理没有输出或输出比PDF旧的文件，之后只处理发生变化的文件。
+    按Ctrl-C停止。
+    
+    Args:
+        folder_path: 文件夹路径
+        api_key: ZhipuAI的API密钥
+        as_questions: 如果为True，尽可能将摘要和概念格式化为问题
+        custom_instruction: 用户自定义处理说明
+        max_workers: 同时处理的文件数
+        poll_interval: 检查间隔（秒）
+        debounce_seconds: 文件保持不变多久后视为写入完成（秒）
+        folder_options: 传递给process_folder的其他参数，如incremental、dedup_threshold、profiler
+    """
+    summarizer = PDFSummarizer(api_key=api_key, extraction_limits=folder_options.get("extraction_limits"))
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    
+    def process_file(file_name):
+        started = time.time()
+        try:
+            result = process_folder(folder_path, api_key, as_questions, custom_instruction=custom_instruction,
+                                    files=[file_name], summarizer=summarizer, **folder_options)
+            status = "完成" if result["total_processed"] else "失败"
+            print(f"[watch] {file_name} 处理{status}，耗时 {time.time() - started:.1f} 秒")
+        except Exception as e:
+            print(f"[watch] {file_name} 处理失败: {str(e)}")
+    
+    def on_ready(ready):
+        for file_name, _ in ready:
+            executor.submit(process_file, file_name)
+    
+    watcher = FolderWatcher(folder_path, on_ready, poll_interval=poll_interval, debounce_seconds=debounce_seconds)
+    
+    # 已有最新输出的文件视为已处理
+    for file_name in os.listdir(folder_path):
+        if not file_name.lower().endswith('.pdf'):
+            continue
+        pdf_path = os.path.join(folder_path, file_name)
+        if is_output_up_to_date(pdf_path):
+            stat = os.stat(pdf_path)
+            watcher.mark_processed(file_name, (stat.st_size, stat.st_mtime))
+    
+    mode = "文件系统通知" if watcher.use_events else "定期扫描"
+    print(f"[watch] 正在监视 {folder_path}（{mode}），按Ctrl-C停止")
+    # 提供了profiler时，整个监视期间只写出一次分析结果
+    profiler = folder_options.get("profiler") or contextlib.nullcontext()
+    with profiler:
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            print("[watch] 收到停止信号，等待进行中的文件处理完成...")
+        finally:
+            watcher.stop()
+            executor.shutdown(wait=True)
+
+
 def save_to_markdown(content, pdf_path):
     """
     Save content to Markdown file optimized for knowledge base
@@ -139,8 +925,7 @@ def save_to_markdown(content, pdf_path):
         return None
     
     # Save content to file
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(content)
+    write_file_atomic(output_path, content)
     
     return output_path
 
@@ -158,6 +943,15 @@ def gui_mode():
     root.geometry("800x650")
     root.minsize(700, 600)
     
+    # 处理文件夹时会在进度回调里刷新窗口，关闭窗口时取消仍在进行的处理
+    cancel_token = CancelToken()
+    
+    def close_window():
+        cancel_token.cancel("窗口已关闭")
+        root.destroy()
+    
+    root.protocol("WM_DELETE_WINDOW", close_window)
+    
     # Set window style with a modern look
     style = ttk.Style()
     style.theme_use('clam')  # Use a modern theme
@@ -391,6 +1185,8 @@ def gui_mode():
         
         # 定义进度回调函数
         def update_progress(current, total):
+            if cancel_token.cancelled:
+                return
             if total > 0:
                 progress_value = int((current / total) * 100)
                 progress_bar.config(value=progress_value)
@@ -402,7 +1198,10 @@ def gui_mode():
             api_key = os.getenv("ZHIPUAI_API_KEY")
             result = process_folder(folder_path, api_key, as_questions=True, 
                                    progress_callback=update_progress,
-                                   custom_instruction=custom_text if custom_text else None)
+                                   custom_instruction=custom_text if custom_text else None,
+                                   cancel_token=cancel_token)
+            if cancel_token.cancelled:
+                return
             
             # 停止进度条
             progress_bar.config(value=100)
@@ -424,6 +1223,8 @@ def gui_mode():
             file_progress_label.pack_forget()
             
         except Exception as e:
+            if cancel_token.cancelled:
+                return
             progress_bar.pack_forget()
             file_progress_label.pack_forget()
             status_label.config(text=f"处理出错: {str(e)}")
@@ -478,7 +1279,7 @@ def gui_mode():
     exit_button = tk.Button(
         button_frame,
         text="退出程序",
-        command=root.destroy,
+        command=close_window,
         width=10,
         height=2,
         bg="#dc2626",
@@ -537,6 +1338,153 @@ def gui_mode():
     root.mainloop()
 
 
+def extraction_limits_from_args(args):
+    """
+    Build ExtractionLimits from parsed command line arguments, None unless --isolate is given
+    """
+    if not args.isolate:
+        return None
+    return ExtractionLimits(page_timeout=args.page_timeout, document_timeout=args.document_timeout,
+                            memory_limit_mb=args.memory_limit)
+
+
+def profiler_from_args(args):
+    """
+    Build a Profiler from parsed command line arguments, None unless --profile is given
+    """
+    if not args.profile:
+        return None
+    return Profiler(args.profile, mode=args.profile_mode, top_n=args.profile_top)
+
+
+def folder_options_from_args(args):
+    """
+    Build process_folder keyword arguments from parsed command line arguments
+    """
+    options = {
+        "max_workers": args.workers,
+        "schedule": args.schedule,
+        "pack_small": args.pack_small,
+        "incremental": args.incremental,
+        "bounded_memory": args.bounded_memory,
+        "page_range": args.page_range,
+        "section": args.section,
+        "scanned": args.scanned,
+        "dedup_threshold": args.dedup_threshold,
+        "extraction_limits": extraction_limits_from_args(args),
+        "document_deadline": args.deadline,
+        "profiler": profiler_from_args(args)
+    }
+    if args.store:
+        options["result_store"] = ResultStore(args.store)
+        options["write_markdown"] = not args.no_markdown
+    if args.index:
+        options["search_index"] = SearchIndex(args.index)
+    if args.max_tokens is not None:
+        options["budget"] = TokenBudget(max_tokens=args.max_tokens)
+    return options
+
+
+def print_routing_stats(routing):
+    """
+    Print per-route request counts, latency and estimated cost of the model cascade
+    """
+    if not routing or not routing["routes"]:
+        return
+    print(f"Model cascade ({routing['fast_model']} -> {routing['large_model']}):")
+    for route, stats in routing["routes"].items():
+        print(f"  {route:<22} requests: {stats['requests']:>5}  p50: {stats['p50_latency']}s  "
+              f"p95: {stats['p95_latency']}s  tokens: {stats['prompt_tokens'] + stats['completion_tokens']}  "
+              f"cost: {stats['cost']:.4f}")
+    total = routing["total"]
+    print(f"  total requests: {total['requests']}, escalated: {total['escalation_rate']:.1%}, "
+          f"p50: {total['p50_latency']}s, cost: {total['cost']:.4f}")
+    if routing["escalations"]:
+        print("  escalation reasons: " + ", ".join(f"{reason} {count}" for reason, count
+                                                    in sorted(routing["escalations"].items())))
+
+
+def print_planning_stats(planning):
+    """
+    Print how many documents met the per-document latency or cost target
+    """
+    if not planning or not planning["documents"]:
+        return
+    targets = []
+    if planning["latency_target"] is not None:
+        targets.append(f"{planning['latency_target']:g}s")
+    if planning["cost_target"] is not None:
+        targets.append(f"{planning['cost_target']:g} yuan")
+    print(f"Request planning (target {' / '.join(targets)} per document): "
+          f"{planning['met']}/{planning['documents']} met ({planning['met_rate']:.1%}), "
+          f"p50: {planning['p50_elapsed']}s, p95: {planning['p95_elapsed']}s, cost: {planning['total_cost']:.4f}")
+    for miss in planning["misses"]:
+        print(f"  missed: {miss['document']} ({miss['elapsed']}s, {miss['cost']:.4f})")
+
+
+def batch_mode(args):
+    """
+    Headless folder (or archive) batch mode, optionally emitting JSON-lines progress events on stdout
+    """
+    options = folder_options_from_args(args)
+    
+    if args.archive:
+        # Archives are streamed member by member, folder-only options do not apply
+        options = {key: options[key] for key in ("max_workers", "bounded_memory", "page_range", "section",
+                                                 "scanned", "extraction_limits", "document_deadline", "profiler")}
+    
+    def run(**extra):
+        try:
+            if args.archive:
+                return process_archive(args.archive, args.output, args.api_key, **extra, **options)
+            if args.batch:
+                return process_folder_batch(args.folder, args.batch, args.api_key, results_files=args.batch_results,
+                                            complete_locally_rounds=args.batch_local,
+                                            skip_up_to_date=args.skip_unchanged, **extra, **options)
+            return process_folder(args.folder, args.api_key, skip_up_to_date=args.skip_unchanged, **extra, **options)
+        finally:
+            for name in ("result_store", "search_index"):
+                if options.get(name) is not None:
+                    options[name].close()
+    
+    if not args.jsonl:
+        result = run()
+        print(f"Processed: {result['total_processed']}, failed: {result['total_errors']}, "
+              f"skipped: {result['total_skipped']}")
+        print_routing_stats(result.get("metrics", {}).get("routing"))
+        print_planning_stats(result.get("metrics", {}).get("planning"))
+        return result
+    
+    # stdout is reserved for events, all other output goes to stderr
+    event_stream = sys.stdout
+    
+    def write_event(event):
+        event_stream.write(json.dumps(event, ensure_ascii=False, default=str) + "\n")
+        event_stream.flush()
+    
+    with contextlib.redirect_stdout(sys.stderr):
+        return run(event_callback=write_event)
+
+
+def search_mode(args):
+    """
+    Print documents matching a full-text query, best match first
+    """
+    with SearchIndex(args.index) as index:
+        if args.folder:
+            updated, removed = index.sync_markdown(args.folder)
+            if updated or removed:
+                print(f"Indexed {updated} new or changed outputs, removed {removed}", file=sys.stderr)
+        
+        started = time.perf_counter()
+        results = index.search(args.search, args.limit)
+        elapsed = (time.perf_counter() - started) * 1000
+    
+    for rank, hit in enumerate(results, 1):
+        print(f"{rank}. {hit['title']}  ({hit['score']:.2f})\n   {hit['path']}\n   {hit['snippet']}")
+    print(f"{len(results)} results in {elapsed:.1f} ms", file=sys.stderr)
+
+
 def cli_mode():
     """
     Command Line Interface mode
@@ -547,12 +1495,176 @@ def cli_mode():
     # Create command line argument parser
     parser = argparse.ArgumentParser(description='Summarize PDF document content using ZhipuAI')
     parser.add_argument('pdf_path', nargs='?', help='PDF file path')
+    parser.add_argument('--file', dest='file_path', help='PDF file path (same as the positional argument)')
     parser.add_argument('--api-key', '-k', help='ZhipuAI API key, if not provided it will be retrieved from ZHIPU_API_KEY environment variable')
     parser.add_argument('--output', '-o', help='Output file path, if not provided output will be sent to console')
     parser.add_argument('--gui', '-g', action='store_true', help='Enable graphical user interface mode')
+    parser.add_argument('--watch', '-w', metavar='FOLDER', help='Watch a folder and summarize new or modified PDFs as they arrive')
+    parser.add_argument('--bounded-memory', action='store_true', help='Read huge PDFs in page windows and spool text to disk to keep memory flat')
+    parser.add_argument('--pages', '-p', dest='page_range', help='Only summarize these pages, e.g. "1-5,8,20-"')
+    parser.add_argument('--section', '-s', help='Only summarize the pages of the outline (bookmark) section with this title')
+    parser.add_argument('--scanned', choices=SCANNED_POLICIES, default='skip',
+                        help='Scanned (image-only) PDFs: skip them without API calls, OCR them, or ignore the check')
+    parser.add_argument('--extractor', choices=['auto'] + [backend.name for backend in BACKENDS],
+                        help='PDF text extraction backend (default: fastest installed, or PDF_EXTRACTION_BACKEND)')
+    parser.add_argument('--hedge', type=float, metavar='PERCENTILE',
+                        help='Send a duplicate model request when a call is slower than this latency percentile, e.g. 0.95')
+    parser.add_argument('--hedge-max-rate', type=float,
+                        help='Maximum share of requests that may be hedged (default: 0.05)')
+    parser.add_argument('--cascade', nargs='?', const=DEFAULT_FAST_MODEL, metavar='FAST_MODEL',
+                        help=f'Send short, simple requests to a fast model first and escalate to the large model '
+                             f'only when cheap checks on the output fail (default fast model: {DEFAULT_FAST_MODEL})')
+    parser.add_argument('--cascade-max-chars', type=int,
+                        help=f'With --cascade, inputs longer than this go straight to the large model '
+                             f'(default: {DEFAULT_MAX_FAST_CHARS})')
+    parser.add_argument('--latency-target', type=float, metavar='SECONDS',
+                        help='Plan output length, chunking, concurrency and model so each document finishes '
+                             'within this many seconds, and report how many did')
+    parser.add_argument('--cost-target', type=float, metavar='YUAN',
+                        help='Plan requests so each document stays within this estimated cost')
+    parser.add_argument('--isolate', action='store_true',
+                        help='Extract pages in worker processes, skipping pages that hang, crash or exhaust memory')
+    parser.add_argument('--page-timeout', type=float, default=DEFAULT_PAGE_TIMEOUT,
+                        help=f'Seconds allowed per page with --isolate (default: {DEFAULT_PAGE_TIMEOUT:g})')
+    parser.add_argument('--document-timeout', type=float, default=DEFAULT_DOCUMENT_TIMEOUT,
+                        help=f'Seconds allowed per document with --isolate (default: {DEFAULT_DOCUMENT_TIMEOUT:g})')
+    parser.add_argument('--memory-limit', type=int, default=DEFAULT_MEMORY_LIMIT_MB,
+                        help=f'Worker memory limit in MB with --isolate, POSIX only (default: {DEFAULT_MEMORY_LIMIT_MB})')
+    parser.add_argument('--deadline', type=float, metavar='SECONDS',
+                        help='Give up on a document (extraction and model calls) after this many seconds')
+    parser.add_argument('--request-timeout', type=float, metavar='SECONDS',
+                        help=f'Timeout of a single model request (default: {DEFAULT_REQUEST_TIMEOUT:g}, '
+                             f'or {REQUEST_TIMEOUT_ENV_VAR})')
+    parser.add_argument('--profile', nargs='?', const='profile', metavar='DIR',
+                        help='Write per-stage and per-document CPU/memory profiles and a hot-spot report to DIR '
+                             '(default: ./profile)')
+    parser.add_argument('--profile-mode', choices=PROFILE_MODES, default='all',
+                        help='Profile CPU, memory or both (memory tracing slows CPU-bound code down)')
+    parser.add_argument('--profile-top', type=int, default=DEFAULT_TOP_N,
+                        help=f'Number of entries in each hot-spot list (default: {DEFAULT_TOP_N})')
+    
+    parser.add_argument('--search', metavar='QUERY',
+                        help='Search the --index built from generated summaries; with --folder, '
+                             'new or changed .md outputs in that folder are indexed first')
+    parser.add_argument('--limit', type=int, default=10, help='Maximum number of search results (default: 10)')
+    
+    # Folder batch options
+    batch = parser.add_argument_group('folder batch mode')
+    batch.add_argument('--folder', '-f', help='Summarize every PDF in a folder, writing a .md file next to each one')
+    batch.add_argument('--archive', '-a', help='Summarize every PDF in a ZIP/TAR archive without extracting it; '
+                                               '--output names the output directory or archive (.zip/.tar/.tar.gz)')
+    batch.add_argument('--workers', type=int, default=1, help='Number of files processed concurrently (default: 1)')
+    batch.add_argument('--schedule', choices=SCHEDULING_POLICIES, default='listdir', help='Order in which files are processed')
+    batch.add_argument('--max-tokens', type=int, help='Hard token ceiling for the run, files beyond it are skipped')
+    batch.add_argument('--pack-small', action='store_true', help='Pack small PDFs into shared requests')
+    batch.add_argument('--incremental', action='store_true', help='Cache chunk summaries and only re-summarize changed chunks')
+    batch.add_argument('--skip-unchanged', action='store_true', help='Skip PDFs whose .md output is newer than the PDF')
+    batch.add_argument('--dedup-threshold', type=float, help='Reuse results for near-duplicate documents above this similarity (0-1)')
+    batch.add_argument('--store', metavar='DB', help='Also save results in this SQLite result store (batched writes)')
+    batch.add_argument('--no-markdown', action='store_true', help='With --store, do not write .md files next to the PDFs')
+    batch.add_argument('--export-store', metavar='DB',
+                       help='Regenerate .md files from a result store (into --output, or next to each source PDF)')
+    batch.add_argument('--index', metavar='DB', help='Update this full-text search index as results are written')
+    batch.add_argument('--collection-summary', action='store_true',
+                       help='Summarize the whole --folder tree from existing outputs (or --store) instead of the PDFs')
+    batch.add_argument('--jsonl', action='store_true', help='Emit JSON-lines progress events on stdout')
+    batch.add_argument('--batch', metavar='DIR',
+                       help='Offline batch-job mode for --folder: write model requests to DIR/requests-NNN.jsonl '
+                            'for the batch API instead of calling the model, and write outputs for files whose '
+                            'requests all have results')
+    batch.add_argument('--batch-results', metavar='FILE', action='append', default=[],
+                       help='With --batch, ingest this batch results (or errors) file first; may be repeated')
+    batch.add_argument('--batch-local', metavar='ROUNDS', type=int, nargs='?', const=10, default=0,
+                       help='With --batch, complete request files locally one request at a time instead of using '
+                            'the batch API, for up to ROUNDS rounds (default: 10)')
     
     # Parse command line arguments
     args = parser.parse_args()
+    args.pdf_path = args.pdf_path or args.file_path
+    
+    # Every PDFReader picks the backend up from the environment
+    if args.extractor:
+        os.environ[BACKEND_ENV_VAR] = args.extractor
+    
+    # Every ZhipuAI client picks the hedging policy up from the environment
+    if args.hedge is not None:
+        os.environ[HEDGE_PERCENTILE_ENV_VAR] = str(args.hedge)
+    if args.hedge_max_rate is not None:
+        os.environ[HEDGE_MAX_RATE_ENV_VAR] = str(args.hedge_max_rate)
+    if args.request_timeout is not None:
+        os.environ[REQUEST_TIMEOUT_ENV_VAR] = str(args.request_timeout)
+    
+    # ...and the model cascade
+    if args.cascade:
+        os.environ[FAST_MODEL_ENV_VAR] = args.cascade
+    if args.cascade_max_chars is not None:
+        os.environ[CASCADE_MAX_CHARS_ENV_VAR] = str(args.cascade_max_chars)
+    
+    # ...and the per-document request planner
+    if args.latency_target is not None:
+        os.environ[LATENCY_TARGET_ENV_VAR] = str(args.latency_target)
+    if args.cost_target is not None:
+        os.environ[COST_TARGET_ENV_VAR] = str(args.cost_target)
+    
+    if args.no_markdown and not args.store:
+        parser.error('--no-markdown requires --store')
+    if args.store and args.archive:
+        parser.error('--store is not supported with --archive')
+    if args.index and args.archive:
+        parser.error('--index is not supported with --archive')
+    if args.search and not args.index:
+        parser.error('--search requires --index')
+    if args.batch and not args.folder:
+        parser.error('--batch requires --folder')
+    if (args.batch_results or args.batch_local) and not args.batch:
+        parser.error('--batch-results and --batch-local require --batch')
+    
+    # Build the collection overview from existing per-document results
+    if args.collection_summary:
+        if not args.folder:
+            parser.error('--collection-summary requires --folder')
+        try:
+            if args.store:
+                with ResultStore(args.store) as store:
+                    summarize_collection(args.folder, args.api_key, args.output, store)
+            else:
+                summarize_collection(args.folder, args.api_key, args.output)
+        except Exception as e:
+            print(f"Error: {str(e)}", file=sys.stderr)
+            sys.exit(1)
+        return
+    
+    # Query the full-text index of generated summaries
+    if args.search:
+        search_mode(args)
+        return
+    
+    # Regenerate markdown from a result store
+    if args.export_store:
+        with ResultStore(args.export_store) as store:
+            exported = export_markdown(store, args.output, args.folder)
+        print(f"Exported {len(exported)} markdown files")
+        return
+    
+    # Watch a folder until interrupted
+    if args.watch:
+        watch_folder(args.watch, args.api_key, **folder_options_from_args(args))
+        return
+    
+    # Process a whole folder without the GUI
+    if args.folder or args.archive:
+        try:
+            result = batch_mode(args)
+        except KeyboardInterrupt:
+            # 进行中的文件已停止，已写出的输出都是完整的
+            print("Interrupted, completed outputs were kept", file=sys.stderr)
+            sys.exit(130)
+        except Exception as e:
+            print(f"Error: {str(e)}", file=sys.stderr)
+            sys.exit(1)
+        if result["total_errors"]:
+            sys.exit(1)
+        return
     
     # If --gui parameter is specified or pdf_path is not provided, start GUI mode
     if args.gui or not args.pdf_path:
@@ -566,13 +1678,15 @@ def cli_mode():
     
     try:
         # Process PDF file
-        output_content = process_pdf(args.pdf_path, args.api_key)
+        output_content = process_pdf(args.pdf_path, args.api_key, bounded_memory=args.bounded_memory,
+                                     page_range=args.page_range, section=args.section, scanned=args.scanned,
+                                     extraction_limits=extraction_limits_from_args(args),
+                                     document_deadline=args.deadline, profiler=profiler_from_args(args))
         
         # Output results
         if args.output:
             # Output to file
-            with open(args.output, 'w', encoding='utf-8') as f:
-                f.write(output_content)
+            write_file_atomic(args.output, output_content)
             print(f"Summary saved to: {args.output}")
         else:
             # Output to console
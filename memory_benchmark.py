@@ -0,0 +1,141 @@
+"""
+低内存模式的内存基准测试
+
+生成不同页数的合成PDF，分别用全文读取（read_pages）和低内存模式（iter_pages + PageSpool）
+提取并按分块遍历全部文本，在独立子进程中测量峰值内存。低内存模式的峰值应基本不随页数增长。
+
+用法:
+    python memory_benchmark.py [--pages 100 400 1600] [--window 16]
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from chunk_manifest import chunk_pages
+from page_spool import PageSpool
+from pdf_reader import DEFAULT_PAGE_WINDOW, PDFReader
+
+WORDS = ("document summary knowledge concept memory window stream chunk page archive "
+         "extraction model request token budget latency throughput").split()
+
+
+def write_synthetic_pdf(path, page_count, lines_per_page=40, seed=0):
+    """
+    不依赖第三方库写出一个纯文本PDF
+
+    Args:
+        path: 输出路径
+        page_count: 页数
+        lines_per_page: 每页的文本行数
+        seed: 随机种子
+    """
+    rng = random.Random(seed)
+    offsets = []
+    font_id = 3
+    first_page_id = 4
+
+    with open(path, 'wb') as f:
+        def write_object(object_id, body):
+            offsets.append((object_id, f.tell()))
+            f.write(f"{object_id} 0 obj\n".encode("latin-1") + body + b"\nendobj\n")
+
+        f.write(b"%PDF-1.4\n")
+        write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        kids = " ".join(f"{first_page_id + 2 * i} 0 R" for i in range(page_count))
+        write_object(2, f"<< /Type /Pages /Kids [{kids}] /Count {page_count} >>".encode("latin-1"))
+        write_object(font_id, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+        for i in range(page_count):
+            page_id = first_page_id + 2 * i
+            lines = [f"Page {i + 1}"] + [" ".join(rng.choice(WORDS) for _ in range(10)) for _ in range(lines_per_page)]
+            stream = "BT /F1 10 Tf 12 TL 40 800 Td " + " ".join(f"({line}) '" for line in lines) + " ET"
+            stream = stream.encode("latin-1")
+            write_object(page_id, (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                                   f"/Resources << /Font << /F1 {font_id} 0 R >> >> "
+                                   f"/Contents {page_id + 1} 0 R >>").encode("latin-1"))
+            write_object(page_id + 1, f"<< /Length {len(stream)} >>\nstream\n".encode("latin-1") + stream + b"\nendstream")
+
+        xref_offset = f.tell()
+        total = len(offsets) + 1
+        f.write(f"xref\n0 {total}\n0000000000 65535 f \n".encode("latin-1"))
+        for _, offset in sorted(offsets):
+            f.write(f"{offset:010d} 00000 n \n".encode("latin-1"))
+        f.write(f"trailer\n<< /Size {total} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode("latin-1"))
+
+
+def run_child(mode, pdf_path, window):
+    """
+    在子进程中执行一次提取并输出测量结果
+
+    Args:
+        mode: "full"或"bounded"
+        pdf_path: PDF文件路径
+        window: 低内存模式的页窗口大小
+    """
+    tracemalloc.start()
+    started = time.perf_counter()
+    reader = PDFReader(pdf_path)
+    chars = 0
+
+    if mode == "full":
+        pages = reader.read_pages()
+        for start, end in chunk_pages(pages):
+            chars += len("".join(pages[start:end]))
+    else:
+        with PageSpool(reader.iter_pages(window)) as pages:
+            for start, end in chunk_pages(pages, pages.page_hashes):
+                chars += len("".join(pages[start:end]))
+
+    _, peak = tracemalloc.get_traced_memory()
+    elapsed = time.perf_counter() - started
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else 0
+    if sys.platform == "darwin":
+        max_rss //= 1024
+    print(f"{peak} {max_rss} {elapsed:.3f} {chars}")
+
+
+def measure(mode, pdf_path, window):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", mode, pdf_path, "--window", str(window)],
+        capture_output=True, text=True, check=True
+    ).stdout.split()
+    peak, max_rss, elapsed, chars = output
+    return int(peak), int(max_rss), float(elapsed), int(chars)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark peak memory of full vs bounded-memory PDF extraction')
+    parser.add_argument('--pages', type=int, nargs='+', default=[100, 400, 1600], help='Synthetic document sizes in pages')
+    parser.add_argument('--window', type=int, default=DEFAULT_PAGE_WINDOW, help='Page window for bounded-memory mode')
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'PDF'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child[0], args.child[1], args.window)
+        return
+
+    print(f"{'pages':>6} {'file MB':>8} {'mode':>8} {'py peak MB':>11} {'max RSS MB':>11} {'seconds':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for page_count in args.pages:
+            pdf_path = os.path.join(directory, f"synthetic_{page_count}.pdf")
+            write_synthetic_pdf(pdf_path, page_count)
+            size_mb = os.path.getsize(pdf_path) / 1024 / 1024
+
+            for mode in ("full", "bounded"):
+                peak, max_rss, elapsed, _ = measure(mode, pdf_path, args.window)
+                rss = f"{max_rss / 1024:.1f}" if max_rss else "n/a"
+                print(f"{page_count:>6} {size_mb:>8.1f} {mode:>8} {peak / 1024 / 1024:>11.1f} {rss:>11} {elapsed:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
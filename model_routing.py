@@ -0,0 +1,230 @@
+import collections
+import math
+import os
+import re
+import threading
+
+from document_packing import split_packed_response
+
+# 启用模型级联的环境变量：快速模型名称，以及直接使用大模型的输入字符数阈值
+FAST_MODEL_ENV_VAR = "ZHIPU_FAST_MODEL"
+CASCADE_MAX_CHARS_ENV_VAR = "ZHIPU_CASCADE_MAX_CHARS"
+
+DEFAULT_FAST_MODEL = "glm-4.5-air"
+
+# 输入超过这么多字符（约为一次请求不截断时的上限）的请求直接交给大模型
+DEFAULT_MAX_FAST_CHARS = 8000
+
+# 数字和符号占比超过这个比例的文本（表格、公式、财务数据等）直接交给大模型
+DEFAULT_MAX_FAST_SYMBOL_RATIO = 0.3
+
+# 估算成本用的价格（元/百万令牌：输入, 输出），以官网价格为准，未列出的模型不计成本
+MODEL_PRICES = {
+    "glm-4.6": (2.0, 8.0),
+    "glm-4.5": (2.0, 8.0),
+    "glm-4.5-air": (0.8, 2.0),
+    "glm-4-air": (0.5, 0.5),
+    "glm-4-flash": (0.0, 0.0),
+    "glm-4.5-flash": (0.0, 0.0),
+}
+
+# 所有提示词都要求中文输出，中文字符数在中文字符数与英文单词数之和中的占比低于这个比例时视为语言错误
+# （按单词而不是字母计数，夹杂英文术语的中文输出不会被误判）
+MIN_CHINESE_RATIO = 0.5
+
+# 关键概念至少应包含的条目数
+MIN_CONCEPT_ITEMS = 3
+
+# 复杂度只根据文本开头的这么多字符估计
+COMPLEXITY_SAMPLE_CHARS = 20000
+
+_CJK_PATTERN = re.compile(r"[一-鿿]")
+_LATIN_WORD_PATTERN = re.compile(r"[A-Za-z]+")
+_SYMBOL_PATTERN = re.compile(r"[0-9%$¥€£+\-*/=<>|_^~#@&]")
+_LIST_ITEM_PATTERN = re.compile(r"^\s*(?:\d+[.、)）]|[-*•·]|[（(]?[一二三四五六七八九十]+[、.)）]|#+\s)")
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    """
+    Args:
+        model: 模型名称
+        prompt_tokens: 输入令牌数
+        completion_tokens: 输出令牌数
+
+    Returns:
+        float: 估算的成本（元），没有价格的模型为0
+    """
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+def symbol_ratio(text):
+    """
+    Args:
+        text: 文本
+
+    Returns:
+        float: 数字和符号在非空白字符中的占比，用作内容复杂度的粗略估计
+    """
+    sample = "".join(text[:COMPLEXITY_SAMPLE_CHARS].split())
+    if not sample:
+        return 0.0
+    return len(_SYMBOL_PATTERN.findall(sample)) / len(sample)
+
+
+def check_output(kind, content, finish_reason=None, documents=None):
+    """
+    用本地规则快速检查模型输出，不调用模型
+
+    Args:
+        kind: 请求类型（summary、concepts、chunk、packed、update或collection）
+        content: 去除前缀后的模型输出
+        finish_reason: 接口返回的结束原因，为"length"时表示输出被截断
+        documents: 打包请求中的文档数
+
+    Returns:
+        str: 未通过的检查（empty、truncated、language或sections），全部通过时为None
+    """
+    if not content or not content.strip():
+        return "empty"
+    if finish_reason == "length":
+        return "truncated"
+    chinese = len(_CJK_PATTERN.findall(content))
+    latin_words = len(_LATIN_WORD_PATTERN.findall(content))
+    if chinese + latin_words and chinese / (chinese + latin_words) < MIN_CHINESE_RATIO:
+        return "language"
+    if kind == "packed":
+        if len(split_packed_response(content, documents)) < documents:
+            return "sections"
+    elif kind == "concepts":
+        if sum(1 for line in content.splitlines() if _LIST_ITEM_PATTERN.match(line)) < MIN_CONCEPT_ITEMS:
+            return "sections"
+    elif kind in ("summary", "update", "collection"):
+        # 要求输出结构化的总结，只有一段的回复通常是拒绝回答或敷衍
+        if sum(1 for line in content.splitlines() if line.strip()) < 2:
+            return "sections"
+    return None
+
+
+class ModelRouter:
+    """
+    模型级联
+
+    按输入大小和复杂度选择模型：短而简单的请求先交给快速模型，输出未通过本地检查（为空、被截断、
+    不是中文或缺少应有的部分）时再交给大模型；长或复杂的请求直接交给大模型。
+    按请求类型和路径（fast、escalated、large）统计请求数、延迟、令牌和估算成本。
+    """
+
+    def __init__(self, large_model, fast_model=DEFAULT_FAST_MODEL, max_fast_chars=DEFAULT_MAX_FAST_CHARS,
+                 max_fast_symbol_ratio=DEFAULT_MAX_FAST_SYMBOL_RATIO, window=500):
+        """
+        初始化模型级联
+
+        Args:
+            large_model: 大模型（未启用级联时使用的模型）
+            fast_model: 快速模型
+            max_fast_chars: 输入超过这么多字符时直接使用大模型
+            max_fast_symbol_ratio: 输入中数字和符号的占比超过这个比例时直接使用大模型
+            window: 每条路径保留的最近延迟样本数
+        """
+        self.fast_model = fast_model
+        self.large_model = large_model
+        self.max_fast_chars = max_fast_chars
+        self.max_fast_symbol_ratio = max_fast_symbol_ratio
+
+        self._lock = threading.Lock()
+        self._latencies = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self._routes = collections.defaultdict(lambda: {"requests": 0, "prompt_tokens": 0,
+                                                        "completion_tokens": 0, "cost": 0.0})
+        self._escalations = collections.Counter()
+
+    @classmethod
+    def from_env(cls, large_model):
+        """
+        从环境变量创建模型级联
+
+        Args:
+            large_model: 大模型
+
+        Returns:
+            ModelRouter: 设置了ZHIPU_FAST_MODEL时返回级联，否则返回None（所有请求使用大模型）
+        """
+        fast_model = os.getenv(FAST_MODEL_ENV_VAR)
+        if not fast_model:
+            return None
+        kwargs = {"large_model": large_model, "fast_model": fast_model}
+        max_chars = os.getenv(CASCADE_MAX_CHARS_ENV_VAR)
+        if max_chars:
+            kwargs["max_fast_chars"] = int(max_chars)
+        return cls(**kwargs)
+
+    def choose(self, text):
+        """
+        Args:
+            text: 请求的输入文本（截断前）
+
+        Returns:
+            str: 首先使用的模型
+        """
+        if len(text) > self.max_fast_chars or symbol_ratio(text) > self.max_fast_symbol_ratio:
+            return self.large_model
+        return self.fast_model
+
+    def record(self, kind, route, latency, calls, reason=None):
+        """
+        记录一次路由的结果
+
+        Args:
+            kind: 请求类型
+            route: "fast"（快速模型的输出被采用）、"escalated"（升级到大模型）或"large"（直接使用大模型）
+            latency: 包括升级在内的总延迟（秒）
+            calls: (模型, 响应) 列表，用于统计令牌和成本
+            reason: 升级的原因
+        """
+        with self._lock:
+            stats = self._routes[(kind, route)]
+            stats["requests"] += 1
+            for model, response in calls:
+                usage = getattr(response, "usage", None)
+                prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+                completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+                stats["prompt_tokens"] += prompt_tokens
+                stats["completion_tokens"] += completion_tokens
+                stats["cost"] += estimate_cost(model, prompt_tokens, completion_tokens)
+            self._latencies[(kind, route)].append(latency)
+            if reason is not None:
+                self._escalations[reason] += 1
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: 各路径的请求数、延迟中位数和P95、令牌和估算成本，以及全部请求的汇总和升级原因
+        """
+        with self._lock:
+            routes = {key: dict(stats) for key, stats in self._routes.items()}
+            latencies = {key: sorted(samples) for key, samples in self._latencies.items()}
+            escalations = dict(self._escalations)
+
+        def percentile(samples, q):
+            if not samples:
+                return None
+            return round(samples[min(len(samples) - 1, math.ceil(q * len(samples)) - 1)], 3)
+
+        metrics = {"fast_model": self.fast_model, "large_model": self.large_model, "routes": {},
+                   "escalations": escalations}
+        for (kind, route), stats in sorted(routes.items()):
+            stats["p50_latency"] = percentile(latencies[(kind, route)], 0.5)
+            stats["p95_latency"] = percentile(latencies[(kind, route)], 0.95)
+            stats["cost"] = round(stats["cost"], 6)
+            metrics["routes"][f"{kind}/{route}"] = stats
+
+        all_latencies = sorted(latency for samples in latencies.values() for latency in samples)
+        requests = sum(stats["requests"] for stats in routes.values())
+        escalated = sum(stats["requests"] for (_, route), stats in routes.items() if route == "escalated")
+        metrics["total"] = {
+            "requests": requests,
+            "escalation_rate": round(escalated / requests, 4) if requests else 0.0,
+            "p50_latency": percentile(all_latencies, 0.5),
+            "cost": round(sum(stats["cost"] for stats in routes.values()), 6)
+        }
+        return metrics
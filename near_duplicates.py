@@ -0,0 +1,272 @@
+import difflib
+import re
+import threading
+import time
+import zlib
+
+from cancellation import CANCEL_POLL_INTERVAL, check_deadline
+
+# 签名长度（哈希桶数），必须是2的幂
+DEFAULT_NUM_PERM = 128
+
+# LSH分段数，每段 DEFAULT_NUM_PERM // DEFAULT_BANDS 个值
+DEFAULT_BANDS = 16
+
+# 字符级shingle长度，对中文和英文都适用
+DEFAULT_SHINGLE_SIZE = 5
+
+_MASK32 = 0xFFFFFFFF
+
+
+def _mix32(value):
+    """MurmurHash3的32位finalizer，打散crc32的低位分布"""
+    value ^= value >> 16
+    value = (value * 0x85EBCA6B) & _MASK32
+    value ^= value >> 13
+    value = (value * 0xC2B2AE35) & _MASK32
+    value ^= value >> 16
+    return value
+
+
+def compute_signature(text, num_perm=DEFAULT_NUM_PERM, shingle_size=DEFAULT_SHINGLE_SIZE):
+    """
+    计算文本的MinHash签名
+
+    使用单次哈希的one-permutation MinHash：每个shingle只哈希一次，按哈希值分桶取最小值，
+    再对空桶做旋转填充，计算量与文本长度成线性关系。
+
+    Args:
+        text: 文本内容
+        num_perm: 签名长度（2的幂）
+        shingle_size: shingle的字符数
+
+    Returns:
+        list: 长度为num_perm的整数签名，空文本返回空列表
+    """
+    if num_perm & (num_perm - 1):
+        raise ValueError("num_perm必须是2的幂")
+
+    normalized = re.sub(r"\s+", "", text or "").lower()
+    if not normalized:
+        return []
+
+    shingles = {normalized[i:i + shingle_size] for i in range(max(1, len(normalized) - shingle_size + 1))}
+    bin_bits = num_perm.bit_length() - 1
+    empty = _MASK32 + 1
+    bins = [empty] * num_perm
+
+    for shingle in shingles:
+        value = _mix32(zlib.crc32(shingle.encode("utf-8")))
+        index = value & (num_perm - 1)
+        value >>= bin_bits
+        if value < bins[index]:
+            bins[index] = value
+
+    # 空桶从右侧最近的非空桶借值，加上距离偏移以区分来源
+    filled = [index for index in range(num_perm) if bins[index] != empty]
+    if len(filled) < num_perm:
+        signature = list(bins)
+        for index in range(num_perm):
+            if bins[index] == empty:
+                distance = 1
+                while bins[(index + distance) % num_perm] == empty:
+                    distance += 1
+                signature[index] = bins[(index + distance) % num_perm] + distance * (empty >> bin_bits)
+        return signature
+    return bins
+
+
+def estimate_similarity(signature_a, signature_b):
+    """
+    根据两个签名估算Jaccard相似度
+
+    Args:
+        signature_a: 签名
+        signature_b: 签名
+
+    Returns:
+        float: 0到1之间的相似度估计
+    """
+    if not signature_a or not signature_b or len(signature_a) != len(signature_b):
+        return 0.0
+    return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / len(signature_a)
+
+
+def text_diff(old_text, new_text):
+    """
+    按行比较两段文本
+
+    Args:
+        old_text: 旧文本
+        new_text: 新文本
+
+    Returns:
+        tuple: (新增的文本, 删除的文本)
+    """
+    added = []
+    removed = []
+    for line in difflib.unified_diff(old_text.splitlines(), new_text.splitlines(), lineterm="", n=0):
+        if line.startswith("+++") or line.startswith("---") or line.startswith("@@"):
+            continue
+        if line.startswith("+"):
+            added.append(line[1:])
+        elif line.startswith("-"):
+            removed.append(line[1:])
+    return "\n".join(added), "\n".join(removed)
+
+
+class LSHIndex:
+    """
+    MinHash签名的LSH（分段哈希）索引，查询只比较落入相同桶的候选文档
+    """
+
+    def __init__(self, threshold=0.9, num_perm=DEFAULT_NUM_PERM, bands=DEFAULT_BANDS):
+        """
+        初始化索引
+
+        Args:
+            threshold: 视为近似重复的最小相似度
+            num_perm: 签名长度
+            bands: 分段数，必须能整除num_perm
+        """
+        if num_perm % bands:
+            raise ValueError("bands必须能整除num_perm")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.signatures = {}
+        self._buckets = {}
+
+    def _band_keys(self, signature):
+        for band in range(self.bands):
+            yield band, tuple(signature[band * self.rows:(band + 1) * self.rows])
+
+    def add(self, key, signature):
+        """
+        加入一个文档
+
+        Args:
+            key: 文档标识
+            signature: compute_signature返回的签名
+        """
+        if not signature:
+            return
+        self.signatures[key] = signature
+        for band_key in self._band_keys(signature):
+            self._buckets.setdefault(band_key, []).append(key)
+
+    def query(self, signature):
+        """
+        查找与签名最相似且超过阈值的已索引文档
+
+        Args:
+            signature: compute_signature返回的签名
+
+        Returns:
+            tuple: (文档标识, 相似度)，没有超过阈值的文档时返回None
+        """
+        if not signature:
+            return None
+        candidates = set()
+        for band_key in self._band_keys(signature):
+            candidates.update(self._buckets.get(band_key, ()))
+
+        best = None
+        for key in candidates:
+            similarity = estimate_similarity(signature, self.signatures[key])
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (key, similarity)
+        return best
+
+
+class DuplicateTracker:
+    """
+    批量处理中的近似重复跟踪器，可以被多个工作线程同时使用
+
+    第一个出现的文档成为簇的代表并正常总结，之后与之相似的文档等待代表完成后复用其结果。
+    """
+
+    def __init__(self, threshold=0.9, num_perm=DEFAULT_NUM_PERM, bands=DEFAULT_BANDS):
+        """
+        初始化跟踪器
+
+        Args:
+            threshold: 视为近似重复的最小相似度
+            num_perm: 签名长度
+            bands: LSH分段数
+        """
+        self.index = LSHIndex(threshold, num_perm, bands)
+        self._lock = threading.Lock()
+        self._events = {}
+        self._results = {}
+        self.clusters = {}
+
+    def claim(self, key, signature):
+        """
+        登记一个文档：如果与已登记的文档近似重复则返回其代表，否则登记为新的代表
+
+        Args:
+            key: 文档标识
+            signature: compute_signature返回的签名
+
+        Returns:
+            tuple: (代表文档标识, 相似度)，文档成为新代表时返回None
+        """
+        with self._lock:
+            match = self.index.query(signature)
+            if match is not None:
+                self.clusters.setdefault(match[0], []).append({"key": key, "similarity": round(match[1], 4)})
+                return match
+            self.index.add(key, signature)
+            self._events[key] = threading.Event()
+            return None
+
+    def complete(self, key, result):
+        """
+        记录代表文档的结果，唤醒等待的重复文档
+
+        Args:
+            key: 代表文档标识
+            result: 结果，为None表示处理失败，重复文档需要自行处理
+        """
+        with self._lock:
+            self._results[key] = result
+            event = self._events.get(key)
+        if event is not None:
+            event.set()
+
+    def wait(self, key, timeout=None):
+        """
+        等待代表文档完成，等待期间定期检查当前上下文的取消和期限（cancellation.deadline_scope）
+
+        Args:
+            key: 代表文档标识
+            timeout: 最长等待秒数
+
+        Returns:
+            代表文档的结果，失败或超时时返回None
+
+        Raises:
+            Cancelled: 等待期间被取消
+            DeadlineExceeded: 等待期间超过期限
+        """
+        with self._lock:
+            event = self._events.get(key)
+        if event is not None:
+            ends = time.monotonic() + timeout if timeout is not None else None
+            while True:
+                interval = CANCEL_POLL_INTERVAL if ends is None else min(CANCEL_POLL_INTERVAL, ends - time.monotonic())
+                if interval <= 0 or event.wait(interval):
+                    break
+                check_deadline()
+        with self._lock:
+            return self._results.get(key)
+
+    def report(self):
+        """
+        Returns:
+            dict: {代表文档: [{"key": 重复文档, "similarity": 相似度}]}
+        """
+        with self._lock:
+            return {key: list(members) for key, members in self.clusters.items()}
@@ -0,0 +1,91 @@
+import tempfile
+import threading
+
+from chunk_manifest import content_hash
+
+
+class PageSpool:
+    """
+    把逐页提取的文本写入磁盘临时文件，内存中只保留每页的偏移、长度和内容哈希
+
+    用法与页面文本列表相同（len、下标、切片、迭代），读取时才从磁盘加载对应页面，
+    处理超大PDF时内存占用与文档大小无关。多个线程可以同时读取（分块的map阶段并发切片）。
+    """
+
+    def __init__(self, pages=None, directory=None):
+        """
+        初始化页面缓存
+
+        Args:
+            pages: 可选，要写入的页面文本（可以是生成器）
+            directory: 临时文件所在目录，为None时使用系统临时目录
+        """
+        self._file = tempfile.TemporaryFile(mode="w+b", dir=directory)
+        # 读写共用一个文件位置，seek和read/write必须一起完成
+        self._lock = threading.Lock()
+        self._offsets = []
+        self._lengths = []
+        self.page_hashes = []
+        self.total_chars = 0
+        if pages is not None:
+            self.extend(pages)
+
+    def append(self, text):
+        """
+        追加一页文本
+
+        Args:
+            text: 页面文本
+        """
+        text = text or ""
+        data = text.encode("utf-8")
+        with self._lock:
+            self._file.seek(0, 2)
+            offset = self._file.tell()
+            self._file.write(data)
+        self._offsets.append(offset)
+        self._lengths.append(len(data))
+        self.page_hashes.append(content_hash(text))
+        self.total_chars += len(text)
+
+    def extend(self, pages):
+        """
+        依次追加多页文本
+
+        Args:
+            pages: 页面文本的可迭代对象
+        """
+        for text in pages:
+            self.append(text)
+
+    def _read(self, index):
+        with self._lock:
+            self._file.seek(self._offsets[index])
+            data = self._file.read(self._lengths[index])
+        return data.decode("utf-8")
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._read(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("页面下标超出范围")
+        return self._read(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self._read(index)
+
+    def close(self):
+        """删除临时文件"""
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,284 @@
+import os
+
+import PyPDF2
+
+try:
+    import pymupdf
+except ImportError:
+    try:
+        import fitz as pymupdf
+    except ImportError:
+        pymupdf = None
+
+try:
+    import pypdfium2
+except ImportError:
+    pypdfium2 = None
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+# 通过环境变量指定提取后端，默认自动选择
+BACKEND_ENV_VAR = "PDF_EXTRACTION_BACKEND"
+
+
+class ExtractionBackend:
+    """
+    PDF文本提取后端
+
+    子类打开文档后按页提取文本，不可用（未安装对应库）的后端不会被自动选择。
+    """
+
+    name = None
+
+    def __init__(self, file_path):
+        """
+        打开PDF文档
+
+        Args:
+            file_path: PDF文件路径
+        """
+        self.file_path = file_path
+
+    @classmethod
+    def is_available(cls):
+        """
+        Returns:
+            bool: 依赖库是否已安装
+        """
+        return True
+
+    def page_count(self):
+        """
+        Returns:
+            int: 页数
+        """
+        raise NotImplementedError
+
+    def extract_page(self, index):
+        """
+        提取一页的文本
+
+        Args:
+            index: 页面下标（从0开始）
+
+        Returns:
+            str: 页面文本
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """关闭文档"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class PyMuPDFBackend(ExtractionBackend):
+    """基于PyMuPDF（MuPDF）的提取，速度最快"""
+
+    name = "pymupdf"
+
+    def __init__(self, file_path):
+        super().__init__(file_path)
+        self.document = pymupdf.open(file_path)
+
+    @classmethod
+    def is_available(cls):
+        return pymupdf is not None
+
+    def page_count(self):
+        return self.document.page_count
+
+    def extract_page(self, index):
+        return self.document.load_page(index).get_text()
+
+    def close(self):
+        self.document.close()
+
+
+class PdfiumBackend(ExtractionBackend):
+    """基于pypdfium2（PDFium）的提取"""
+
+    name = "pdfium"
+
+    def __init__(self, file_path):
+        super().__init__(file_path)
+        self.document = pypdfium2.PdfDocument(file_path)
+
+    @classmethod
+    def is_available(cls):
+        return pypdfium2 is not None
+
+    def page_count(self):
+        return len(self.document)
+
+    def extract_page(self, index):
+        page = self.document[index]
+        text_page = page.get_textpage()
+        try:
+            return text_page.get_text_range()
+        finally:
+            text_page.close()
+            page.close()
+
+    def close(self):
+        self.document.close()
+
+
+class PypdfBackend(ExtractionBackend):
+    """基于pypdf（PyPDF2的后续版本）的提取，纯Python，比PyPDF2慢，但对部分文档的兼容性更好，主要作为回退"""
+
+    name = "pypdf"
+
+    def __init__(self, file_path):
+        super().__init__(file_path)
+        self._file = open(file_path, 'rb')
+        self.reader = pypdf.PdfReader(self._file)
+
+    @classmethod
+    def is_available(cls):
+        return pypdf is not None
+
+    def page_count(self):
+        return len(self.reader.pages)
+
+    def extract_page(self, index):
+        return self.reader.pages[index].extract_text()
+
+    def close(self):
+        self._file.close()
+
+
+class PyPDF2Backend(ExtractionBackend):
+    """基于PyPDF2的提取，始终可用"""
+
+    name = "pypdf2"
+
+    def __init__(self, file_path):
+        super().__init__(file_path)
+        self._file = open(file_path, 'rb')
+        self.reader = PyPDF2.PdfReader(self._file)
+
+    def page_count(self):
+        return len(self.reader.pages)
+
+    def extract_page(self, index):
+        return self.reader.pages[index].extract_text()
+
+    def close(self):
+        self._file.close()
+
+
+# 按提取速度从快到慢排列（见extraction_benchmark.py），自动选择时取第一个可用的后端
+BACKENDS = (PyMuPDFBackend, PdfiumBackend, PyPDF2Backend, PypdfBackend)
+
+
+def available_backends():
+    """
+    Returns:
+        list: 已安装的后端名称，按速度从快到慢排列
+    """
+    return [backend.name for backend in BACKENDS if backend.is_available()]
+
+
+def resolve_backend(name=None):
+    """
+    根据名称获取提取后端
+
+    Args:
+        name: 后端名称，为None或"auto"时读取PDF_EXTRACTION_BACKEND环境变量，仍未指定时选择最快的可用后端
+
+    Returns:
+        type: ExtractionBackend子类
+    """
+    name = (name or os.environ.get(BACKEND_ENV_VAR) or "auto").lower()
+    if name == "auto":
+        return next(backend for backend in BACKENDS if backend.is_available())
+
+    for backend in BACKENDS:
+        if backend.name == name:
+            if not backend.is_available():
+                raise ValueError(f"PDF提取后端 {name} 所需的库未安装")
+            return backend
+    raise ValueError(f"不支持的PDF提取后端: {name}，可选: auto, {', '.join(backend.name for backend in BACKENDS)}")
+
+
+class PageExtractor:
+    """
+    使用首选后端逐页提取文本，某页提取失败时依次换用其他可用后端重试该页
+
+    备用后端在第一次需要时才打开。
+    """
+
+    def __init__(self, file_path, backend=None):
+        """
+        打开PDF文档
+
+        Args:
+            file_path: PDF文件路径
+            backend: 首选后端名称，见resolve_backend
+        """
+        self.file_path = file_path
+        primary = resolve_backend(backend)
+        self._fallbacks = [candidate for candidate in BACKENDS if candidate is not primary and candidate.is_available()]
+        self._open = [primary(file_path)]
+        self.backend = self._open[0].name
+        self.fallback_pages = {}
+
+    def page_count(self):
+        """
+        Returns:
+            int: 页数
+        """
+        return self._open[0].page_count()
+
+    def extract_page(self, index):
+        """
+        提取一页的文本，所有后端都失败时抛出第一个后端的异常
+
+        Args:
+            index: 页面下标（从0开始）
+
+        Returns:
+            str: 页面文本
+        """
+        first_error = None
+        position = 0
+        while True:
+            if position == len(self._open):
+                if not self._fallbacks:
+                    raise first_error
+                try:
+                    self._open.append(self._fallbacks.pop(0)(self.file_path))
+                except Exception:
+                    continue
+
+            extractor = self._open[position]
+            try:
+                text = extractor.extract_page(index) or ""
+            except Exception as e:
+                first_error = first_error or e
+                position += 1
+                continue
+
+            if position > 0:
+                self.fallback_pages[index] = extractor.name
+                print(f"第{index + 1}页使用{self.backend}提取失败（{first_error!r}），已改用{extractor.name}")
+            return text
+
+    def close(self):
+        """关闭所有打开的后端"""
+        for extractor in self._open:
+            extractor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,13 +1,157 @@
 import PyPDF2
+import mmap
 import os
 
+from pdf_backends import PyPDF2Backend, PageExtractor, resolve_backend
+from isolated_extraction import call_isolated, iter_pages_isolated
+from cancellation import ABORT_ERRORS, check_deadline
+
+# 低内存模式下每次解析的页数，处理完一个窗口后释放解析器缓存的对象
+DEFAULT_PAGE_WINDOW = 16
+
+# 页面可以从上级页面树节点继承的属性
+_INHERITABLE_ATTRIBUTES = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+
+
+def _walk_pages(reader):
+    """
+    按顺序惰性遍历页面树，与reader.pages不同，不会一次性为所有页面创建对象
+    
+    Args:
+        reader: PyPDF2.PdfReader
+    
+    Yields:
+        PyPDF2.PageObject: 页面对象
+    """
+    root = reader.trailer["/Root"].get_object()["/Pages"]
+    stack = [(iter([root]), {})]
+    while stack:
+        kids, inherited = stack[-1]
+        reference = next(kids, None)
+        if reference is None:
+            stack.pop()
+            continue
+        
+        node = reference.get_object()
+        attributes = dict(inherited)
+        attributes.update((key, node[key]) for key in _INHERITABLE_ATTRIBUTES if key in node)
+        if "/Kids" in node:
+            stack.append((iter(node["/Kids"]), attributes))
+            continue
+        
+        page = PyPDF2.PageObject(reader, reference if isinstance(reference, PyPDF2.generic.IndirectObject) else None)
+        page.update(node)
+        for key, value in attributes.items():
+            if key not in page:
+                page[PyPDF2.generic.NameObject(key)] = value
+        yield page
+
+
+def parse_page_ranges(spec, page_count):
+    """
+    解析页码范围，例如 "1-5,8,20-"（页码从1开始，"20-"表示第20页到最后一页）
+    
+    Args:
+        spec: 页码范围字符串
+        page_count: 文档页数
+    
+    Returns:
+        list: 排序去重后的页面下标（从0开始）
+    """
+    indices = set()
+    for part in spec.replace(" ", "").split(","):
+        if not part:
+            continue
+        try:
+            if "-" in part:
+                start, end = part.split("-", 1)
+                start = int(start) if start else 1
+                end = int(end) if end else page_count
+            else:
+                start = end = int(part)
+        except ValueError:
+            raise ValueError(f"无效的页码范围: {part}")
+        if start < 1 or end < start:
+            raise ValueError(f"无效的页码范围: {part}")
+        if start > page_count:
+            raise ValueError(f"页码范围超出文档页数（共{page_count}页）: {part}")
+        indices.update(range(start - 1, min(end, page_count)))
+    
+    if not indices:
+        raise ValueError(f"页码范围为空: {spec}")
+    return sorted(indices)
+
+
+def format_page_ranges(page_indices):
+    """
+    把页面下标列表格式化为页码范围字符串，是parse_page_ranges的逆操作
+    
+    Args:
+        page_indices: 排序后的页面下标列表（从0开始）
+    
+    Returns:
+        str: 例如 "1-5,8"
+    """
+    parts = []
+    start = previous = None
+    for index in page_indices:
+        if start is None:
+            start = previous = index
+        elif index == previous + 1:
+            previous = index
+        else:
+            parts.append(f"{start + 1}" if start == previous else f"{start + 1}-{previous + 1}")
+            start = previous = index
+    if start is not None:
+        parts.append(f"{start + 1}" if start == previous else f"{start + 1}-{previous + 1}")
+    return ",".join(parts)
+
+
+def _page_count(file_path, backend):
+    """获取页数（模块级函数，可以在隔离进程中执行）"""
+    with PageExtractor(file_path, backend) as extractor:
+        return extractor.page_count()
+
+
+def _estimate_text_length(file_path, backend, sample_pages):
+    """抽样估算文本长度（模块级函数，可以在隔离进程中执行）"""
+    with PageExtractor(file_path, backend) as extractor:
+        page_count = extractor.page_count()
+        if page_count == 0:
+            return 0, 0
+        
+        # 在文档中均匀抽取页面
+        step = max(1, page_count // sample_pages)
+        sampled = list(range(0, page_count, step))[:sample_pages]
+        sampled_chars = sum(len(extractor.extract_page(i)) for i in sampled)
+        
+        return page_count, int(sampled_chars / len(sampled) * page_count)
+
+
+def _flatten_outline(reader, outline, level=0):
+    """把PyPDF2的嵌套书签列表展开为 (标题, 层级, 起始页下标) 列表"""
+    entries = []
+    for item in outline:
+        if isinstance(item, list):
+            entries.extend(_flatten_outline(reader, item, level + 1))
+            continue
+        page_index = reader.get_destination_page_number(item)
+        if page_index is not None and page_index >= 0:
+            entries.append((str(item.title), level, page_index))
+    return entries
+
+
 class PDFReader:
-    def __init__(self, file_path):
+    def __init__(self, file_path, backend=None, limits=None):
         """
         初始化PDF读取器
         
         Args:
             file_path: PDF文件路径
+            backend: 文本提取后端名称（"auto"、"pymupdf"、"pdfium"、"pypdf"或"pypdf2"），
+                     为None时读取PDF_EXTRACTION_BACKEND环境变量，仍未指定时自动选择最快的可用后端
+            limits: 可选的isolated_extraction.ExtractionLimits，提供时在隔离的工作进程中提取，
+                    超时、超出内存或导致崩溃的页面被跳过并记录在problems中
         """
         self.file_path = file_path
         if not os.path.exists(file_path):
@@ -15,6 +159,20 @@ class PDFReader:
         
         if not file_path.lower().endswith('.pdf'):
             raise ValueError(f"文件不是PDF格式: {file_path}")
+        
+        self.backend = resolve_backend(backend).name
+        self.limits = limits
+        self.problems = []
+    
+    def _iter_isolated(self, page_indices):
+        """在隔离进程中逐页提取，被跳过的页面记录问题并返回空文本"""
+        for index, text, problem in iter_pages_isolated(self.file_path, self.limits, page_indices, self.backend):
+            check_deadline()
+            if problem is not None:
+                print(f"跳过第{index + 1}页: {problem}")
+                self.problems.append({"page": index + 1, "reason": problem})
+                text = ""
+            yield text
     
     def read_pdf(self):
         """
@@ -23,20 +181,148 @@ class PDFReader:
         Returns:
             str: PDF文件的文本内容
         """
+        return "".join(self.read_pages())
+    
+    def read_pages(self, page_indices=None):
+        """
+        逐页读取PDF文件内容
+        
+        Args:
+            page_indices: 只读取这些页面（下标从0开始），为None时读取全部页面；未选中的页面不会被解析
+        
+        Returns:
+            list: 每页的文本内容
+        """
         try:
-            with open(self.file_path, 'rb') as file:
-                reader = PyPDF2.PdfReader(file)
-                text = ""
+            if self.limits is not None:
+                return list(self._iter_isolated(page_indices))
+            
+            with PageExtractor(self.file_path, self.backend) as extractor:
+                pages = []
+                if page_indices is None:
+                    page_indices = range(extractor.page_count())
                 
-                # 读取每一页内容
-                for page_num in range(len(reader.pages)):
-                    page = reader.pages[page_num]
-                    text += page.extract_text()
+                # 读取每一页内容，某页提取失败时换用其他后端；每页之前检查取消和处理期限
+                for page_num in page_indices:
+                    check_deadline()
+                    pages.append(extractor.extract_page(page_num))
                 
-                return text
+                return pages
+        except ABORT_ERRORS:
+            raise
         except Exception as e:
             raise Exception(f"读取PDF文件时出错: {str(e)}")
     
+    def iter_pages(self, window_pages=DEFAULT_PAGE_WINDOW, page_indices=None):
+        """
+        以有限内存逐页读取PDF文件内容
+        
+        使用PyPDF2后端时，文件通过内存映射读取，由操作系统按需加载；页面树按需遍历，不一次性展开
+        所有页面对象，每处理window_pages页就清空PyPDF2缓存的已解析对象（内容流等），峰值内存只与
+        窗口大小有关，与文档大小无关。其他后端由原生库按需加载页面，逐页提取即可。
+        
+        Args:
+            window_pages: 每个窗口的页数
+            page_indices: 只读取这些页面（下标从0开始），为None时读取全部页面
+        
+        Yields:
+            str: 每页的文本内容
+        """
+        try:
+            if self.limits is not None:
+                yield from self._iter_isolated(page_indices)
+                return
+            
+            if self.backend != PyPDF2Backend.name:
+                with PageExtractor(self.file_path, self.backend) as extractor:
+                    if page_indices is None:
+                        page_indices = range(extractor.page_count())
+                    for page_index in page_indices:
+                        check_deadline()
+                        yield extractor.extract_page(page_index)
+                return
+            
+            with open(self.file_path, 'rb') as file, \
+                    mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                reader = PyPDF2.PdfReader(mapped)
+                selected = None if page_indices is None else set(page_indices)
+                extracted = 0
+                for page_index, page in enumerate(_walk_pages(reader)):
+                    if selected is not None and page_index not in selected:
+                        continue
+                    check_deadline()
+                    try:
+                        text = page.extract_text()
+                    except Exception:
+                        # 该页单独用其他后端重试
+                        with PageExtractor(self.file_path, self.backend) as extractor:
+                            text = extractor.extract_page(page_index)
+                    yield text
+                    extracted += 1
+                    if extracted % window_pages == 0:
+                        reader.resolved_objects.clear()
+        except ABORT_ERRORS:
+            raise
+        except Exception as e:
+            raise Exception(f"读取PDF文件时出错: {str(e)}")
+    
+    def get_outline(self):
+        """
+        获取PDF书签（目录）
+        
+        Returns:
+            list: (标题, 层级, 起始页下标) 元组列表，层级从0开始，按书签顺序排列
+        """
+        try:
+            with open(self.file_path, 'rb') as file:
+                reader = PyPDF2.PdfReader(file)
+                return _flatten_outline(reader, reader.outline)
+        except Exception as e:
+            raise Exception(f"读取PDF书签时出错: {str(e)}")
+    
+    def select_pages(self, page_range=None, section=None):
+        """
+        根据页码范围和/或书签章节确定要读取的页面，两者同时提供时取交集
+        
+        章节从书签标题匹配（不区分大小写，优先完全匹配，其次包含匹配），
+        范围是从该书签的起始页到下一个同级或更高级书签之前的一页。
+        
+        Args:
+            page_range: 页码范围字符串，见parse_page_ranges
+            section: 书签标题
+        
+        Returns:
+            list: 页面下标列表（从0开始），两者都未提供时返回None
+        """
+        if page_range is None and section is None:
+            return None
+        
+        page_count = self.get_page_count()
+        selected = parse_page_ranges(page_range, page_count) if page_range is not None else range(page_count)
+        
+        if section is not None:
+            outline = self.get_outline()
+            if not outline:
+                raise ValueError("PDF文件没有书签，无法按章节选择页面")
+            wanted = section.strip().lower()
+            matches = [i for i, (title, _, _) in enumerate(outline) if title.strip().lower() == wanted] or \
+                      [i for i, (title, _, _) in enumerate(outline) if wanted in title.lower()]
+            if not matches:
+                titles = "、".join(title for title, _, _ in outline[:20])
+                raise ValueError(f"未找到章节: {section}（可选书签: {titles}）")
+            
+            _, level, start = outline[matches[0]]
+            end = page_count
+            for _, next_level, next_start in outline[matches[0] + 1:]:
+                if next_level <= level:
+                    end = max(next_start, start + 1)
+                    break
+            selected = [index for index in selected if start <= index < end]
+            if not selected:
+                raise ValueError(f"页码范围与章节 {section} 没有重叠")
+        
+        return list(selected)
+    
     def get_page_count(self):
         """
         获取PDF文件页数
@@ -45,8 +331,26 @@ class PDFReader:
             int: PDF文件的页数
         """
         try:
-            with open(self.file_path, 'rb') as file:
-                reader = PyPDF2.PdfReader(file)
-                return len(reader.pages)
+            if self.limits is not None:
+                return call_isolated(_page_count, (self.file_path, self.backend), self.limits)
+            return _page_count(self.file_path, self.backend)
+        except Exception as e:
+            raise Exception(f"获取PDF页数时出错: {str(e)}")
+    
+    def estimate_text_length(self, sample_pages=3):
+        """
+        通过抽样少量页面估算PDF的文本长度，避免为估算而解析全部页面
+        
+        Args:
+            sample_pages: 抽样的页数
+        
+        Returns:
+            tuple: (页数, 估算的文本字符数)
+        """
+        try:
+            args = (self.file_path, self.backend, sample_pages)
+            if self.limits is not None:
+                return call_isolated(_estimate_text_length, args, self.limits)
+            return _estimate_text_length(*args)
         except Exception as e:
-            raise Exception(f"获取PDF页数时出错: {str(e)}")
\ No newline at end of file
+            raise Exception(f"估算PDF文本长度时出错: {str(e)}")
\ No newline at end of file
@@ -1,17 +1,37 @@
-from pdf_reader import PDFReader
+import asyncio
+import math
+from concurrent.futures import ThreadPoolExecutor
+from pdf_reader import DEFAULT_PAGE_WINDOW, PDFReader, format_page_ranges
+from page_spool import PageSpool
+from profiling import carry_document, profile_stage
+from cancellation import carry_context
+from batch_jobs import run_all
+from request_planner import plan_document
+from scan_detection import DEFAULT_OCR_LANGUAGE, ScannedDocumentError, ocr_pages, require_text
 from zhipu_ai import ZhipuAI
+from document_packing import DEFAULT_MAX_PACK_CHARS, DEFAULT_MAX_PACK_DOCUMENTS, pack_documents
+from chunk_manifest import (MAX_CHUNK_CHARS, SINGLE_REQUEST_CHARS, chunk_pages, combine_hashes, content_hash,
+                            load_manifest, merge_chunks, save_manifest)
+
+def _label_section(section):
+    """在分块要点前标注页码范围"""
+    return f"[第{section['pages'][0]}-{section['pages'][1]}页]\n{section['summary']}"
+
 
 class PDFSummarizer:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, extraction_limits=None):
         """
         初始化PDF总结器
         
         Args:
             api_key: 智谱AI的API密钥，如果为None则从环境变量获取
+            extraction_limits: 可选的isolated_extraction.ExtractionLimits，提供时在隔离的工作进程中提取PDF文本
         """
         self.zhipu_ai = ZhipuAI(api_key)
+        self.extraction_limits = extraction_limits
     
-    def summarize_pdf(self, pdf_path, as_questions=True, custom_instruction=None):
+    def summarize_pdf(self, pdf_path, as_questions=True, custom_instruction=None, manifest_path=None,
+                      bounded_memory=False, page_window=DEFAULT_PAGE_WINDOW, page_range=None, section=None):
         """
         总结PDF文件内容
         
@@ -19,24 +39,362 @@ class PDFSummarizer:
             pdf_path: PDF文件路径
             as_questions: 如果为True，尽可能将内容格式化为问题形式
             custom_instruction: 用户自定义处理说明
+            manifest_path: 分块清单路径，提供时按分块增量总结，见summarize_pages
+            bounded_memory: 如果为True，按页窗口读取PDF并把页面文本暂存到磁盘，
+                            长文档按分块map-reduce总结，内存占用不随文档大小增长
+            page_window: 低内存模式下每次解析的页数
+            page_range: 只总结这些页，例如 "1-5,8"，见pdf_reader.parse_page_ranges
+            section: 只总结该书签章节的页面，与page_range同时提供时取交集
+        
+        Returns:
+            dict: 包含总结和关键概念的字典，选择了部分页面时还包含selection，
+                  隔离提取时跳过了页面还包含skipped_pages
+        """
+        # 读取PDF文件，未选中的页面不会被解析
+        pdf_reader = PDFReader(pdf_path, limits=self.extraction_limits)
+        page_indices = pdf_reader.select_pages(page_range, section)
+        selection = None
+        if page_indices is not None:
+            selection = f"第{format_page_ranges(page_indices)}页"
+            if section is not None:
+                selection = f"{section}（{selection}）"
+            print(f"只读取选中的{len(page_indices)}页: {selection}")
+        
+        if bounded_memory:
+            with profile_stage("extract"):
+                spool = PageSpool(pdf_reader.iter_pages(page_window, page_indices))
+            with spool as pages:
+                print(f"成功读取PDF文件，共{len(pages)}页（低内存模式）")
+                self._check_problems(pdf_reader, pages.total_chars)
+                with profile_stage("summarize"):
+                    result = self.summarize_pages(pages, as_questions, custom_instruction, manifest_path,
+                                                  map_reduce=True)
+        else:
+            with profile_stage("extract"):
+                pages = pdf_reader.read_pages(page_indices)
+            page_count = len(pages)
+            
+            print(f"成功读取PDF文件，共{page_count}页")
+            self._check_problems(pdf_reader, sum(len(page) for page in pages))
+            
+            with profile_stage("summarize"):
+                result = self.summarize_pages(pages, as_questions, custom_instruction, manifest_path)
+        
+        if selection is not None:
+            result["selection"] = selection
+        if pdf_reader.problems:
+            result["skipped_pages"] = pdf_reader.problems
+        return result
+    
+    @staticmethod
+    def _check_problems(pdf_reader, total_chars):
+        """隔离提取跳过了页面且没有剩下任何文本时，不再调用模型"""
+        if pdf_reader.problems and total_chars == 0:
+            raise Exception(f"所有页面都未能提取（{pdf_reader.problems[0]['reason']}等）")
+    
+    def summarize_pages(self, pages, as_questions=True, custom_instruction=None, manifest_path=None,
+                        map_reduce=False):
+        """
+        总结逐页提取的PDF文本
+        
+        提供manifest_path时，每页和每个分块的内容哈希以及分块总结会保存在清单中。
+        文档修订后只有内容变化的分块需要重新总结（map阶段），未变化的分块直接复用，
+        再由所有分块总结汇总出整篇文档的总结和关键概念（reduce阶段）；文档完全未变化时直接复用上次结果。
+        分块总结合起来超过一次请求的长度时，先逐层把相邻分块的要点合并（见_reduce_chunks），
+        每个分块都会进入最终的汇总请求，合并结果同样按内容缓存在清单中。
+        
+        Args:
+            pages: 每页文本列表，或PageSpool（只在需要时从磁盘读取页面）
+            as_questions: 如果为True，尽可能将内容格式化为问题形式
+            custom_instruction: 用户自定义处理说明
+            manifest_path: 分块清单路径，为None时不保存清单
+            map_reduce: 如果为True，即使没有清单也对长文档分块总结，而不是拼接全文
+        
+        Returns:
+            dict: 包含总结和关键概念的字典，分块模式下还包含chunk_stats
+        
+        Raises:
+            ScannedDocumentError: 所有页面都没有文字，不调用模型
+        """
+        require_text(pages)
+        if manifest_path is None and not map_reduce:
+            text = "".join(pages)
+            plan_document(len(text), chunked=False)
+            return self.summarize_extracted_text(text, len(pages), as_questions, custom_instruction)
+        
+        page_hashes = getattr(pages, "page_hashes", None) or [content_hash(page) for page in pages]
+        total_chars = getattr(pages, "total_chars", None)
+        if total_chars is None:
+            total_chars = sum(len(page) for page in pages)
+        
+        previous = (load_manifest(manifest_path) if manifest_path else None) or {}
+        settings = {"as_questions": as_questions, "custom_instruction": custom_instruction}
+        document_hash = combine_hashes(page_hashes)
+        
+        # 文档和处理设置都未变化，直接复用上次结果
+        if previous.get("document_hash") == document_hash and previous.get("settings") == settings \
+                and previous.get("summary") is not None:
+            print("文档内容未变化，复用上次的总结")
+            chunk_count = len(previous.get("chunks", []))
+            return {
+                "summary": previous["summary"],
+                "key_concepts": previous["key_concepts"],
+                "page_count": len(pages),
+                "chunk_stats": {"chunks": chunk_count, "reused": chunk_count, "unchanged": True}
+            }
+        
+        # 有请求规划器时按目标决定分块数和并发数，分块数为1时只总结（截断后的）全文
+        plan = plan_document(total_chars)
+        
+        chunks = []
+        merged = {}
+        reused = 0
+        if total_chars <= SINGLE_REQUEST_CHARS or (plan is not None and plan.chunks <= 1):
+            # 短文档一次请求即可完整处理，不需要分块
+            result = self.summarize_extracted_text("".join(pages), len(pages), as_questions, custom_instruction)
+        else:
+            max_chars = plan.chunk_chars if plan is not None else MAX_CHUNK_CHARS
+            bounds = chunk_pages(pages, page_hashes, max_chars, max_chars // 8)
+            if plan is not None:
+                bounds = merge_chunks(bounds, plan.chunks)
+            
+            cached = {chunk["hash"]: chunk["summary"] for chunk in previous.get("chunks", [])}
+            for start, end in bounds:
+                chunk_hash = combine_hashes(page_hashes[start:end])
+                chunks.append({"hash": chunk_hash, "pages": [start + 1, end], "summary": cached.get(chunk_hash)})
+            
+            changed = [chunk for chunk in chunks if chunk["summary"] is None]
+            reused = len(chunks) - len(changed)
+            print(f"文档共{len(chunks)}个分块，复用{reused}个，重新总结{len(changed)}个")
+            
+            # map阶段：并发总结变化的分块，实际并发由ZhipuAI的限制器控制
+            concurrency = plan.concurrency if plan is not None else 4
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                summaries = executor.map(
+                    carry_context(carry_document(lambda chunk: self.zhipu_ai.summarize_chunk(
+                        "".join(pages[chunk["pages"][0] - 1:chunk["pages"][1]])))),
+                    changed
+                )
+                for chunk, summary in zip(changed, summaries):
+                    chunk["summary"] = summary
+            
+            # reduce阶段：由分块总结（太多时先逐层合并）汇总出整篇文档的总结和关键概念
+            sections, merged = self._reduce_chunks(chunks, previous.get("merged", {}), concurrency)
+            combined = "\n\n".join(_label_section(section) for section in sections)
+            result = self.summarize_extracted_text(combined, len(pages), as_questions, custom_instruction)
+        
+        # 出错的分块和结果不写入清单，下次重新生成
+        failed = result["summary"].startswith("错误") or result["key_concepts"].startswith("错误")
+        if manifest_path is not None:
+            save_manifest(manifest_path, {
+                "document_hash": None if failed else document_hash,
+                "settings": settings,
+                "page_hashes": page_hashes,
+                "chunks": [chunk for chunk in chunks if not chunk["summary"].startswith("错误")],
+                "merged": {key: summary for key, summary in merged.items() if not summary.startswith("错误")},
+                "summary": None if failed else result["summary"],
+                "key_concepts": None if failed else result["key_concepts"]
+            })
+        
+        result["chunk_stats"] = {"chunks": len(chunks), "reused": reused, "unchanged": False}
+        return result
+    
+    def _reduce_chunks(self, chunks, cached, concurrency):
+        """
+        逐层合并相邻分块的要点，直到所有要点合起来能放进一次汇总请求
+
+        每一层按要点内容决定分组边界（与chunk_pages对页面分块的方式相同），修改某个分块只影响它所在的组；
+        每组合并后成为上一层的一个要点，覆盖组内所有页面。
+
+        Args:
+            chunks: 分块列表，每项包含pages（[起始页, 结束页]）和summary
+            cached: 上次保存的合并结果 {组内要点哈希: 合并后的要点}
+            concurrency: 同时合并的组数
+
+        Returns:
+            tuple: (要点列表, 本次用到的合并结果 {组内要点哈希: 合并后的要点})
+        """
+        sections = [{"pages": chunk["pages"], "summary": chunk["summary"]} for chunk in chunks]
+        merged = {}
+        condensed = False
+        while len(sections) > 1 and len("\n\n".join(_label_section(section) for section in sections)) > SINGLE_REQUEST_CHARS:
+            # 分组时把要点之间的分隔符计入长度，保证每组合并请求都不会被截断
+            texts = [_label_section(section) for section in sections]
+            hashes = [content_hash(text) for text in texts]
+            bounds = chunk_pages([text + "\n\n" for text in texts], hashes,
+                                 SINGLE_REQUEST_CHARS + 2, SINGLE_REQUEST_CHARS // 8)
+            # 相邻要点都放不进同一组时，先逐个压缩要点；压缩后仍然如此才两两合并，保证每一层都有进展
+            condense = len(bounds) >= len(sections) and not condensed
+            if len(bounds) >= len(sections) and condensed:
+                bounds = merge_chunks(bounds, math.ceil(len(sections) / 2))
+            condensed = condense
+            
+            # 单独成组且不超长的要点原样进入上一层，不需要合并
+            groups = []
+            for start, end in bounds:
+                key = combine_hashes(hashes[start:end])
+                text = "\n\n".join(texts[start:end])
+                merge = condense or end - start > 1 or len(text) > SINGLE_REQUEST_CHARS
+                groups.append({"key": key, "pages": [sections[start]["pages"][0], sections[end - 1]["pages"][1]],
+                               "text": text, "merge": merge,
+                               "summary": cached.get(key) if merge else sections[start]["summary"]})
+            pending = [group for group in groups if group["summary"] is None]
+            print(f"合并{len(sections)}个分块要点为{len(groups)}组，重新合并{len(pending)}组")
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                summaries = executor.map(
+                    carry_context(carry_document(lambda group: self.zhipu_ai.merge_chunk_summaries(group["text"]))),
+                    pending
+                )
+                for group, summary in zip(pending, summaries):
+                    group["summary"] = summary
+            
+            merged.update((group["key"], group["summary"]) for group in groups if group["merge"])
+            sections = [{"pages": group["pages"], "summary": group["summary"]} for group in groups]
+        return sections, merged
+    
+    def summarize_scanned_pdf(self, pdf_path, as_questions=True, custom_instruction=None,
+                              language=DEFAULT_OCR_LANGUAGE):
+        """
+        用OCR识别扫描PDF的文字后总结
+        
+        Args:
+            pdf_path: PDF文件路径
+            as_questions: 如果为True，尽可能将内容格式化为问题形式
+            custom_instruction: 用户自定义处理说明
+            language: tesseract语言
+        
+        Returns:
+            dict: 包含总结和关键概念的字典，另含ocr标记
+        """
+        print(f"正在对扫描文档进行OCR: {pdf_path}")
+        with profile_stage("ocr"):
+            pages = ocr_pages(pdf_path, language)
+        if not "".join(pages).strip():
+            raise ScannedDocumentError("OCR未识别出任何文字")
+        print(f"OCR识别完成，共{len(pages)}页")
+        
+        with profile_stage("summarize"):
+            result = self.summarize_pages(pages, as_questions, custom_instruction, map_reduce=True)
+        result["ocr"] = True
+        return result
+    
+    def summarize_extracted_text(self, text, page_count, as_questions=True, custom_instruction=None):
+        """
+        总结已经提取好的PDF文本
+        
+        Args:
+            text: PDF文本内容
+            page_count: PDF页数
+            as_questions: 如果为True，尽可能将内容格式化为问题形式
+            custom_instruction: 用户自定义处理说明
         
         Returns:
             dict: 包含总结和关键概念的字典
         """
-        # 读取PDF文件
-        pdf_reader = PDFReader(pdf_path)
-        text = pdf_reader.read_pdf()
-        page_count = pdf_reader.get_page_count()
+        def summarize():
+            print("正在使用智谱AI总结内容...")
+            return self.zhipu_ai.summarize_text(text, as_questions=as_questions, custom_instruction=custom_instruction)
+        
+        def extract_concepts():
+            print("正在提取关键概念...")
+            return self.zhipu_ai.extract_key_concepts(text, as_questions=as_questions,
+                                                      custom_instruction=custom_instruction)
         
-        print(f"成功读取PDF文件，共{page_count}页")
+        # 总结内容并提取关键概念（批处理模式下两个请求在同一轮中提交）
+        summary, key_concepts = run_all(summarize, extract_concepts)
         
-        # 总结内容
-        print("正在使用智谱AI总结内容...")
-        summary = self.zhipu_ai.summarize_text(text, as_questions=as_questions, custom_instruction=custom_instruction)
+        return {
+            "summary": summary,
+            "key_concepts": key_concepts,
+            "page_count": page_count
+        }
+    
+    def summarize_pdfs_packed(self, pdf_paths, as_questions=True, custom_instruction=None,
+                              max_pack_chars=DEFAULT_MAX_PACK_CHARS, max_pack_documents=DEFAULT_MAX_PACK_DOCUMENTS):
+        """
+        把多个小PDF合并到少量请求中总结，每个包一次请求同时生成总结和关键概念
+        
+        包的回复无法拆分出某个文档（或文档太长无法打包）时，该文档回退为单独总结。
+        
+        Args:
+            pdf_paths: PDF文件路径列表
+            as_questions: 如果为True，尽可能将内容格式化为问题形式
+            custom_instruction: 用户自定义处理说明
+            max_pack_chars: 每个包的文本字符数上限
+            max_pack_documents: 每个包的文档数上限
+        
+        Returns:
+            dict: {PDF路径: 结果字典或读取时抛出的异常}，没有文字的文档为ScannedDocumentError
+        """
+        results = {}
+        texts = {}
+        page_counts = {}
+        
+        # 读取所有PDF文件
+        for pdf_path in pdf_paths:
+            try:
+                with profile_stage("extract"):
+                    pdf_reader = PDFReader(pdf_path, limits=self.extraction_limits)
+                    text = pdf_reader.read_pdf()
+                    require_text([text])
+                    texts[pdf_path] = text
+                    page_counts[pdf_path] = pdf_reader.get_page_count()
+            except Exception as e:
+                results[pdf_path] = e
+        
+        packs, oversized = pack_documents(list(texts.items()), max_pack_chars, max_pack_documents)
+        fallback = [pdf_path for pdf_path, _ in oversized]
+        
+        for pack in packs:
+            # 只有一个文档的包直接单独处理
+            if len(pack) == 1:
+                fallback.append(pack[0][0])
+                continue
+            
+            print(f"正在使用智谱AI批量总结{len(pack)}个小文档...")
+            packed = self.zhipu_ai.summarize_packed([text for _, text in pack], as_questions, custom_instruction)
+            for index, (pdf_path, _) in enumerate(pack):
+                if index in packed:
+                    summary, key_concepts = packed[index]
+                    results[pdf_path] = {
+                        "summary": summary,
+                        "key_concepts": key_concepts,
+                        "page_count": page_counts[pdf_path]
+                    }
+                else:
+                    fallback.append(pdf_path)
+        
+        if fallback:
+            print(f"{len(fallback)}个文档无法批量处理，改为单独总结")
+        for pdf_path in fallback:
+            results[pdf_path] = self.summarize_extracted_text(
+                texts[pdf_path], page_counts[pdf_path], as_questions, custom_instruction
+            )
+        
+        return results
+    
+    async def summarize_pdf_async(self, pdf_path, as_questions=True, custom_instruction=None):
+        """
+        summarize_pdf的异步版本，总结与关键概念提取并发执行
+        
+        Args:
+            pdf_path: PDF文件路径
+            as_questions: 如果为True，尽可能将内容格式化为问题形式
+            custom_instruction: 用户自定义处理说明
+        
+        Returns:
+            dict: 包含总结和关键概念的字典
+        """
+        # PDF解析是CPU密集的同步操作，放到线程中执行以免阻塞事件循环
+        pdf_reader = PDFReader(pdf_path, limits=self.extraction_limits)
+        text = await asyncio.to_thread(pdf_reader.read_pdf)
+        require_text([text])
+        page_count = await asyncio.to_thread(pdf_reader.get_page_count)
         
-        # 提取关键概念
-        print("正在提取关键概念...")
-        key_concepts = self.zhipu_ai.extract_key_concepts(text, as_questions=as_questions, custom_instruction=custom_instruction)
+        summary, key_concepts = await asyncio.gather(
+            self.zhipu_ai.summarize_text_async(text, as_questions=as_questions, custom_instruction=custom_instruction),
+            self.zhipu_ai.extract_key_concepts_async(text, as_questions=as_questions, custom_instruction=custom_instruction)
+        )
         
         return {
             "summary": summary,
@@ -0,0 +1,527 @@
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+# 分析内容："cpu"只做CPU分析，"memory"只做内存分析，"all"两者都做（内存追踪会拖慢CPU密集的代码）
+PROFILE_MODES = ("all", "cpu", "memory")
+
+# 报告中每个列表显示的条目数
+DEFAULT_TOP_N = 20
+
+# 调用栈采样间隔（秒）
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+# 每个采样的调用栈保留的最大帧数
+MAX_STACK_DEPTH = 64
+
+# 内存快照中每次分配保留的调用帧数
+MEMORY_FRAMES = 1
+
+# 文档中不属于任何已标记阶段的时间
+OTHER_STAGE = "other"
+
+# 当前运行中的Profiler，profile_stage()和profile_document()在没有运行中的Profiler时不做任何事
+_active = None
+_active_lock = threading.Lock()
+
+
+@contextmanager
+def profile_stage(name):
+    """
+    标记当前线程进入一个处理阶段（例如extract、api、write），阶段可以嵌套，时间只计入最内层的阶段
+
+    Args:
+        name: 阶段名称
+    """
+    profiler = _active
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(name):
+        yield
+
+
+@contextmanager
+def profile_document(path, count=1):
+    """
+    标记当前线程开始处理一个文档，期间的CPU分析、内存快照和阶段时间都归属于该文档
+
+    Args:
+        path: 文档路径
+        count: 一起处理的文档数（打包处理时大于1）
+    """
+    profiler = _active
+    if profiler is None:
+        yield
+        return
+    with profiler.document(path, count):
+        yield
+
+
+def carry_document(func):
+    """
+    让提交到其他线程的函数归属于当前线程正在处理的文档
+
+    Args:
+        func: 将在其他线程中执行的函数
+
+    Returns:
+        包装后的函数，没有运行中的Profiler时返回func本身
+    """
+    profiler = _active
+    if profiler is None:
+        return func
+    label = profiler.current_document()
+
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        with profiler.attach(label):
+            return func(*args, **kwargs)
+    return run
+
+
+def profiled(func):
+    """
+    让函数支持profiler关键字参数：提供了Profiler时，函数在该Profiler运行期间执行，
+    Profiler由这次调用启动时，函数返回后写出分析结果
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = kwargs.get("profiler")
+        if profiler is None:
+            return func(*args, **kwargs)
+        with profiler:
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _safe_name(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    return re.sub(r"[^\w.-]+", "_", name)[:80] or "document"
+
+
+def _take_snapshot():
+    """内存快照，不包含性能分析本身（cProfile、pstats、tracemalloc和本模块）的分配"""
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, module.__file__) for module in (cProfile, pstats, tracemalloc, sys.modules[__name__])
+    ])
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class _Entry:
+    """一个进行中的阶段"""
+
+    __slots__ = ("name", "wall", "cpu", "memory", "child_wall", "child_cpu", "child_memory")
+
+    def __init__(self, name, memory):
+        self.name = name
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        self.memory = memory
+        self.child_wall = 0.0
+        self.child_cpu = 0.0
+        self.child_memory = 0
+
+
+class Profiler:
+    """
+    批量处理的CPU和内存性能分析
+
+    运行期间同时收集：每个文档的cProfile确定性分析（pstats格式，可用snakeviz等工具查看）、
+    所有线程的调用栈采样（折叠栈格式，可用flamegraph.pl或speedscope生成火焰图）、
+    每个文档和整次运行的tracemalloc快照，以及每个阶段的耗时、CPU时间和内存增量。
+    停止时把这些结果和一份热点报告写入输出目录。
+
+    可以作为上下文管理器嵌套使用，最外层退出时才停止并写出结果。
+    """
+
+    def __init__(self, output_dir, mode="all", top_n=DEFAULT_TOP_N, sample_interval=DEFAULT_SAMPLE_INTERVAL):
+        """
+        初始化性能分析器
+
+        Args:
+            output_dir: 分析结果的输出目录，不存在时创建
+            mode: "all"、"cpu"或"memory"
+            top_n: 报告中每个列表显示的条目数
+            sample_interval: 调用栈采样间隔（秒），为0或None时不采样
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"不支持的分析模式: {mode}，可选: {', '.join(PROFILE_MODES)}")
+        self.output_dir = output_dir
+        self.cpu = mode in ("all", "cpu")
+        self.memory = mode in ("all", "memory")
+        self.top_n = top_n
+        self.sample_interval = sample_interval if self.cpu else None
+
+        self._lock = threading.Lock()
+        self._depth = 0
+        self._threads = {}
+        self._stages = defaultdict(lambda: {"calls": 0, "wall": 0.0, "cpu": 0.0, "memory": 0})
+        self._documents = {}
+        self._open_documents = 0
+        self._max_open_documents = 0
+        self._samples = Counter()
+        self._stats = None
+        self._cprofile_skipped = 0
+        self._sampler = None
+        self._stop_sampling = threading.Event()
+        self._started_tracing = False
+        self._baseline = None
+        self._started = None
+        self.report_path = None
+
+    @property
+    def running(self):
+        return self._depth > 0
+
+    def __enter__(self):
+        global _active
+        with _active_lock:
+            if self._depth == 0:
+                if _active is not None:
+                    raise RuntimeError("已有另一个性能分析正在运行")
+                self._start()
+                _active = self
+            self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _active
+        with _active_lock:
+            self._depth -= 1
+            if self._depth:
+                return
+            _active = None
+        self._stop()
+
+    def _start(self):
+        self._started = time.perf_counter()
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(MEMORY_FRAMES)
+                self._started_tracing = True
+            self._baseline = _take_snapshot()
+        if self.sample_interval:
+            self._stop_sampling.clear()
+            self._sampler = threading.Thread(target=self._sample_loop, name="profiler-sampler", daemon=True)
+            self._sampler.start()
+
+    def _stop(self):
+        if self._sampler is not None:
+            self._stop_sampling.set()
+            self._sampler.join()
+            self._sampler = None
+        final = None
+        peak = None
+        if self.memory:
+            final = _take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            if self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+        self.report_path = self._write(time.perf_counter() - self._started, final, peak)
+        print(f"性能分析结果已写入: {self.output_dir}（报告: {self.report_path}）")
+
+    # 阶段和文档
+
+    def _traced_memory(self):
+        return tracemalloc.get_traced_memory()[0] if self.memory else 0
+
+    def _thread_state(self):
+        ident = threading.get_ident()
+        with self._lock:
+            state = self._threads.get(ident)
+            if state is None:
+                state = self._threads[ident] = {"document": None, "stack": []}
+        return state
+
+    def current_document(self):
+        """
+        Returns:
+            str: 当前线程正在处理的文档标签，没有时为None
+        """
+        return self._thread_state()["document"]
+
+    def _push(self, name):
+        state = self._thread_state()
+        entry = _Entry(name, self._traced_memory())
+        with self._lock:
+            state["stack"].append(entry)
+        return state, entry
+
+    def _pop(self, state, entry):
+        """结束一个阶段，把去掉子阶段后的时间和内存增量计入统计，返回包含子阶段的 (耗时, CPU时间, 内存增量)"""
+        wall = time.perf_counter() - entry.wall
+        cpu = time.thread_time() - entry.cpu
+        memory = self._traced_memory() - entry.memory
+        with self._lock:
+            state["stack"].pop()
+            totals = [self._stages[entry.name]]
+            if state["document"] is not None:
+                totals.append(self._documents[state["document"]]["stages"][entry.name])
+            for total in totals:
+                total["calls"] += 1
+                total["wall"] += wall - entry.child_wall
+                total["cpu"] += cpu - entry.child_cpu
+                total["memory"] += memory - entry.child_memory
+            if state["stack"]:
+                parent = state["stack"][-1]
+                parent.child_wall += wall
+                parent.child_cpu += cpu
+                parent.child_memory += memory
+        return wall, cpu, memory
+
+    @contextmanager
+    def stage(self, name):
+        """
+        标记当前线程进入一个处理阶段，见profile_stage()
+
+        Args:
+            name: 阶段名称
+        """
+        state, entry = self._push(name)
+        try:
+            yield
+        finally:
+            self._pop(state, entry)
+
+    @contextmanager
+    def attach(self, label):
+        """
+        让当前线程在期间归属于一个已在处理中的文档（不单独做cProfile分析）
+
+        Args:
+            label: 文档标签，为None时不归属任何文档
+        """
+        state = self._thread_state()
+        previous = state["document"]
+        with self._lock:
+            if label is not None and label in self._documents:
+                state["document"] = label
+        try:
+            yield
+        finally:
+            with self._lock:
+                state["document"] = previous
+
+    @contextmanager
+    def document(self, path, count=1):
+        """
+        标记当前线程开始处理一个文档，见profile_document()
+
+        Args:
+            path: 文档路径
+            count: 一起处理的文档数
+        """
+        state = self._thread_state()
+        if state["document"] is not None:
+            # 已经在处理某个文档（例如process_pdf在process_folder中被调用），计入外层文档
+            yield
+            return
+
+        with self._lock:
+            label = f"{len(self._documents) + 1:04d}-{_safe_name(path)}"
+            if count > 1:
+                label += f"+{count - 1}"
+            record = {"path": path, "documents": count, "stages": defaultdict(
+                lambda: {"calls": 0, "wall": 0.0, "cpu": 0.0, "memory": 0})}
+            self._documents[label] = record
+            self._open_documents += 1
+            self._max_open_documents = max(self._max_open_documents, self._open_documents)
+            state["document"] = label
+
+        profile = None
+        if self.cpu:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Python 3.12起同一时刻只能有一个cProfile，并发处理的文档只由调用栈采样覆盖
+                profile = None
+                with self._lock:
+                    self._cprofile_skipped += 1
+        before = _take_snapshot() if self.memory else None
+        _, entry = self._push(OTHER_STAGE)
+
+        try:
+            yield
+        finally:
+            wall, cpu, memory = self._pop(state, entry)
+            if profile is not None:
+                profile.disable()
+            after = _take_snapshot() if self.memory else None
+            self._finish_document(label, record, profile, before, after, wall, cpu, memory)
+            with self._lock:
+                state["document"] = None
+                self._open_documents -= 1
+
+    def _finish_document(self, label, record, profile, before, after, wall, cpu, memory):
+        record.update(wall=round(wall, 4), cpu=round(cpu, 4), memory=memory)
+        if profile is not None:
+            cpu_dir = os.path.join(self.output_dir, "cpu")
+            os.makedirs(cpu_dir, exist_ok=True)
+            record["cpu_profile"] = os.path.join(cpu_dir, f"{label}.prof")
+            profile.dump_stats(record["cpu_profile"])
+            with self._lock:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile)
+                else:
+                    self._stats.add(profile)
+        if after is not None:
+            memory_dir = os.path.join(self.output_dir, "memory")
+            os.makedirs(memory_dir, exist_ok=True)
+            record["memory_snapshot"] = os.path.join(memory_dir, f"{label}.tracemalloc")
+            after.dump(record["memory_snapshot"])
+            record["allocations"] = [
+                {"site": str(stat.traceback), "size": stat.size_diff, "count": stat.count_diff}
+                for stat in after.compare_to(before, "lineno")[:self.top_n] if stat.size_diff > 0
+            ]
+
+    # 调用栈采样
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        while not self._stop_sampling.wait(self.sample_interval):
+            frames = sys._current_frames()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            with self._lock:
+                stages = {ident: (state["stack"][-1].name if state["stack"] else None)
+                          for ident, state in self._threads.items()}
+            samples = []
+            for ident, frame in frames.items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                # 没有标记阶段的线程（例如GUI主线程、空闲的线程池线程）按线程名归类
+                root = stages.get(ident) or f"thread:{names.get(ident, ident)}"
+                samples.append(";".join([root] + stack))
+            del frames
+            with self._lock:
+                self._samples.update(samples)
+
+    # 输出
+
+    def _write(self, duration, final, peak):
+        os.makedirs(self.output_dir, exist_ok=True)
+        summary = {
+            "duration": round(duration, 3),
+            "mode": {"cpu": self.cpu, "memory": self.memory},
+            "max_concurrent_documents": self._max_open_documents,
+            "stages": {name: self._round(total) for name, total in sorted(self._stages.items())},
+            "documents": {}
+        }
+        for label, record in self._documents.items():
+            entry = {key: value for key, value in record.items() if key != "stages"}
+            entry["stages"] = {name: self._round(total) for name, total in sorted(record["stages"].items())}
+            summary["documents"][label] = entry
+
+        if self._stats is not None:
+            self._stats.dump_stats(os.path.join(self.output_dir, "cpu.prof"))
+        if self._samples:
+            with open(os.path.join(self.output_dir, "samples.folded"), "w", encoding="utf-8") as f:
+                for stack, count in sorted(self._samples.items()):
+                    f.write(f"{stack} {count}\n")
+        if final is not None:
+            os.makedirs(os.path.join(self.output_dir, "memory"), exist_ok=True)
+            final.dump(os.path.join(self.output_dir, "memory", "run.tracemalloc"))
+            summary["peak_traced_memory"] = peak
+            summary["allocations"] = [
+                {"site": str(stat.traceback), "size": stat.size_diff, "count": stat.count_diff}
+                for stat in final.compare_to(self._baseline, "lineno")[:self.top_n] if stat.size_diff > 0
+            ]
+
+        with open(os.path.join(self.output_dir, "profile.json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+        report_path = os.path.join(self.output_dir, "report.txt")
+        with open(report_path, "w", encoding="utf-8") as f:
+            f.write(self.render_report(summary))
+        return report_path
+
+    @staticmethod
+    def _round(total):
+        return {"calls": total["calls"], "wall": round(total["wall"], 4), "cpu": round(total["cpu"], 4),
+                "memory": total["memory"]}
+
+    def render_report(self, summary):
+        """
+        生成热点报告文本
+
+        Args:
+            summary: profile.json的内容
+
+        Returns:
+            str: 报告文本
+        """
+        lines = [f"运行时间 {summary['duration']:.2f}s，文档 {len(summary['documents'])} 个，"
+                 f"最多同时处理 {summary['max_concurrent_documents']} 个"]
+        if summary["max_concurrent_documents"] > 1:
+            lines.append("注意: 文档并发处理时，tracemalloc的内存增量是全进程的，按阶段和文档的内存数字只是近似值")
+        if self._cprofile_skipped:
+            lines.append(f"注意: {self._cprofile_skipped}个文档与其他文档重叠，没有单独的cProfile分析，见调用栈采样")
+
+        lines += ["", "== 各阶段（不含子阶段；等待 = 耗时 - CPU时间，主要是网络和锁等待）=="]
+        lines.append(f"{'阶段':<12}{'次数':>8}{'耗时s':>10}{'CPU s':>10}{'等待s':>10}{'内存MB':>10}")
+        for name, total in sorted(summary["stages"].items(), key=lambda item: -item[1]["wall"]):
+            lines.append(f"{name:<12}{total['calls']:>8}{total['wall']:>10.3f}{total['cpu']:>10.3f}"
+                         f"{max(0.0, total['wall'] - total['cpu']):>10.3f}{total['memory'] / 2 ** 20:>10.2f}")
+
+        lines += ["", f"== 最慢的文档（前{self.top_n}个）=="]
+        documents = sorted(summary["documents"].items(), key=lambda item: -item[1].get("wall", 0))
+        for label, record in documents[:self.top_n]:
+            slowest = sorted(record["stages"].items(), key=lambda item: -item[1]["wall"])[:3]
+            breakdown = "，".join(f"{name} {total['wall']:.2f}s" for name, total in slowest)
+            lines.append(f"{label}: {record.get('wall', 0):.2f}s（CPU {record.get('cpu', 0):.2f}s；{breakdown}）")
+
+        if self._stats is not None:
+            for sort_key, title in (("tottime", "函数自身耗时"), ("cumulative", "函数累计耗时")):
+                stream = io.StringIO()
+                stats = pstats.Stats(stream=stream)
+                stats.add(self._stats)
+                stats.sort_stats(sort_key).print_stats(self.top_n)
+                body = stream.getvalue()
+                # 只保留统计表，去掉pstats的表头说明
+                table = body[body.find("   ncalls"):] if "   ncalls" in body else body
+                lines += ["", f"== cProfile: {title}（前{self.top_n}个）==", table.rstrip()]
+
+        if self._samples:
+            total = sum(self._samples.values())
+            lines += ["", f"== 调用栈采样: 各阶段最热的函数（共{total}个采样，每{self.sample_interval * 1000:g}ms一次）=="]
+            by_stage = defaultdict(Counter)
+            for stack, count in self._samples.items():
+                frames = stack.split(";")
+                if not frames[0].startswith("thread:") and len(frames) > 1:
+                    by_stage[frames[0]][frames[-1]] += count
+            for name, leaves in sorted(by_stage.items(), key=lambda item: -sum(item[1].values())):
+                stage_total = sum(leaves.values())
+                lines.append(f"[{name}] {stage_total}个采样")
+                for leaf, count in leaves.most_common(min(self.top_n, 5)):
+                    lines.append(f"    {count / stage_total:6.1%}  {leaf}")
+
+        if "allocations" in summary:
+            lines += ["", f"== 内存: 运行结束时仍占用的分配（前{self.top_n}个，峰值"
+                          f"{summary['peak_traced_memory'] / 2 ** 20:.1f}MB）=="]
+            for allocation in summary["allocations"]:
+                lines.append(f"{allocation['size'] / 2 ** 10:>10.1f}KB {allocation['count']:>8}  {allocation['site']}")
+
+        lines += ["", "文件: cpu.prof和cpu/*.prof（pstats格式，python -m pstats或snakeviz），"
+                      "samples.folded（折叠栈，flamegraph.pl或speedscope），"
+                      "memory/*.tracemalloc（tracemalloc.Snapshot.load），profile.json"]
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,406 @@
+import collections
+import contextlib
+import contextvars
+import math
+import os
+import threading
+import time
+
+from chunk_manifest import MAX_CHUNK_CHARS, SINGLE_REQUEST_CHARS, estimate_merges
+from model_routing import DEFAULT_FAST_MODEL, estimate_cost
+
+# 启用请求规划的环境变量：每个文档的延迟目标（秒）和成本目标（元）
+LATENCY_TARGET_ENV_VAR = "ZHIPU_LATENCY_TARGET"
+COST_TARGET_ENV_VAR = "ZHIPU_COST_TARGET"
+
+# 每次请求输出令牌数的上限和下限；下限以下的总结已经没有意义，宁可减少分块或改用快速模型
+DEFAULT_MAX_COMPLETION_TOKENS = 2000
+MIN_COMPLETION_TOKENS = 256
+
+# 一个文档的分块最多同时总结这么多个
+DEFAULT_MAX_CONCURRENCY = 8
+
+# 估算输入令牌数时每个令牌的字符数（与ZhipuAI._truncate_text相同的粗略估计）
+CHARS_PER_TOKEN = 4
+
+# 延迟模型的默认值：每次请求的固定开销（秒）和每个输出令牌的耗时（秒），积累足够的样本后按实测拟合
+DEFAULT_LATENCY_MODEL = (2.0, 0.03)
+LATENCY_MODELS = {
+    "glm-4.6": (2.0, 0.03),
+    "glm-4.5": (2.0, 0.03),
+    "glm-4.5-air": (1.0, 0.015),
+    "glm-4-flash": (0.8, 0.01),
+}
+
+# 拟合延迟模型所需的最少样本数
+MIN_FIT_SAMPLES = 10
+
+
+class RequestPlan:
+    """
+    一个文档的请求计划
+    """
+
+    def __init__(self, model, max_tokens, chunks, chunk_chars, concurrency, estimated_latency, estimated_cost,
+                 feasible):
+        """
+        Args:
+            model: 使用的模型
+            max_tokens: 每次请求的输出令牌数上限
+            chunks: 分块数，为1时整篇文档一次请求（过长的文本被截断）
+            chunk_chars: 每个分块的最大字符数
+            concurrency: 同时总结的分块数
+            estimated_latency: 估算的模型调用总耗时（秒）
+            estimated_cost: 估算的成本上限（元）
+            feasible: 估算是否能满足目标
+        """
+        self.model = model
+        self.max_tokens = max_tokens
+        self.chunks = chunks
+        self.chunk_chars = chunk_chars
+        self.concurrency = concurrency
+        self.estimated_latency = estimated_latency
+        self.estimated_cost = estimated_cost
+        self.feasible = feasible
+
+    def as_dict(self):
+        return {
+            "model": self.model,
+            "max_tokens": self.max_tokens,
+            "chunks": self.chunks,
+            "chunk_chars": self.chunk_chars,
+            "concurrency": self.concurrency,
+            "estimated_latency": round(self.estimated_latency, 3),
+            "estimated_cost": round(self.estimated_cost, 6),
+            "feasible": self.feasible
+        }
+
+
+class _DocumentScope:
+    """document_scope中正在处理的文档：计划、实际调用的成本和开始时间"""
+
+    def __init__(self, planner, label):
+        self.planner = planner
+        self.label = label
+        self.started = time.monotonic()
+        self.plan = None
+        # 由调用方在文档成功完成时设置，只有成功的文档计入目标统计
+        self.succeeded = False
+        self.cost = 0.0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def add_call(self, model, response):
+        usage = getattr(response, "usage", None)
+        cost = estimate_cost(model, getattr(usage, "prompt_tokens", 0) or 0,
+                             getattr(usage, "completion_tokens", 0) or 0)
+        with self._lock:
+            self.cost += cost
+            self.requests += 1
+
+
+# 当前上下文（线程或协程）中正在处理的文档，由document_scope设置
+_current_document = contextvars.ContextVar("current_planned_document", default=None)
+
+
+class RequestPlanner:
+    """
+    按每个文档的延迟或成本目标规划请求
+
+    为每个文档选择输出令牌数上限、分块数（map阶段的扇出）、分块并发数和模型，按以下顺序让步直到估算满足目标：
+    缩短输出（不低于MIN_COMPLETION_TOKENS），减少分块（超出的文本被截断），改用快速模型。
+    延迟按每次请求的固定开销加每个输出令牌的耗时估算，随实际请求在线拟合；成本按输入和输出令牌上限估算。
+    文档处理结束后记录实际耗时和成本是否满足目标。
+    """
+
+    def __init__(self, large_model, latency_target=None, cost_target=None, fast_model=DEFAULT_FAST_MODEL,
+                 max_completion_tokens=DEFAULT_MAX_COMPLETION_TOKENS, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 window=200):
+        """
+        初始化请求规划器
+
+        Args:
+            large_model: 优先使用的模型
+            latency_target: 每个文档（从开始提取到总结完成）的目标耗时（秒）
+            cost_target: 每个文档的目标成本（元，按model_routing.MODEL_PRICES估算）
+            fast_model: 目标无法满足时改用的快速模型
+            max_completion_tokens: 每次请求输出令牌数的上限
+            max_concurrency: 一个文档同时总结的分块数上限
+            window: 每个模型保留的最近延迟样本数
+        """
+        if latency_target is None and cost_target is None:
+            raise ValueError("至少需要指定延迟目标或成本目标")
+        self.latency_target = latency_target
+        self.cost_target = cost_target
+        self.large_model = large_model
+        self.fast_model = fast_model
+        self.max_completion_tokens = max_completion_tokens
+        self.max_concurrency = max_concurrency
+
+        self._lock = threading.Lock()
+        self._samples = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self._outcomes = []
+        self._counters = {"documents": 0, "met": 0, "missed": 0, "infeasible": 0,
+                          "missed_latency": 0, "missed_cost": 0}
+
+    @classmethod
+    def from_env(cls, large_model):
+        """
+        从环境变量创建请求规划器
+
+        Args:
+            large_model: 优先使用的模型
+
+        Returns:
+            RequestPlanner: 设置了ZHIPU_LATENCY_TARGET或ZHIPU_COST_TARGET时返回规划器，否则返回None
+        """
+        latency_target = os.getenv(LATENCY_TARGET_ENV_VAR)
+        cost_target = os.getenv(COST_TARGET_ENV_VAR)
+        if not latency_target and not cost_target:
+            return None
+        return cls(large_model, latency_target=float(latency_target) if latency_target else None,
+                   cost_target=float(cost_target) if cost_target else None)
+
+    def observe(self, model, latency, completion_tokens):
+        """
+        记录一次请求的耗时，用于拟合延迟模型
+
+        Args:
+            model: 模型名称
+            latency: 耗时（秒）
+            completion_tokens: 输出令牌数
+        """
+        with self._lock:
+            self._samples[model].append((completion_tokens, latency))
+
+    def latency_model(self, model):
+        """
+        Args:
+            model: 模型名称
+
+        Returns:
+            tuple: (每次请求的固定开销, 每个输出令牌的耗时)，样本足够时按最小二乘拟合
+        """
+        with self._lock:
+            samples = list(self._samples[model])
+        default = LATENCY_MODELS.get(model, DEFAULT_LATENCY_MODEL)
+        if len(samples) < MIN_FIT_SAMPLES:
+            return default
+        mean_tokens = sum(tokens for tokens, _ in samples) / len(samples)
+        mean_latency = sum(latency for _, latency in samples) / len(samples)
+        variance = sum((tokens - mean_tokens) ** 2 for tokens, _ in samples)
+        if variance == 0:
+            return default
+        per_token = sum((tokens - mean_tokens) * (latency - mean_latency) for tokens, latency in samples) / variance
+        per_token = max(per_token, 0.0)
+        return max(mean_latency - per_token * mean_tokens, 0.0), per_token
+
+    def _estimate(self, model, total_chars, chunks, concurrency, max_tokens):
+        """估算一个计划的模型调用耗时和成本上限"""
+        base, per_token = self.latency_model(model)
+        call_latency = base + per_token * max_tokens
+        if chunks <= 1:
+            # 总结和关键概念两次请求，输入为（截断后的）全文
+            calls_on_path = 2
+            output_tokens = 2 * max_tokens
+            input_tokens = 2 * min(total_chars, SINGLE_REQUEST_CHARS) / CHARS_PER_TOKEN
+        else:
+            # map阶段分批并发，分块总结放不进一次请求时逐层合并，reduce阶段的两次请求以合并后的要点为输入
+            merges, merge_chars, reduce_chars = estimate_merges(chunks, max(1, max_tokens * CHARS_PER_TOKEN))
+            calls_on_path = math.ceil(chunks / concurrency) + math.ceil(merges / concurrency) + 2
+            output_tokens = (chunks + merges + 2) * max_tokens
+            input_tokens = (min(total_chars, chunks * MAX_CHUNK_CHARS) + merge_chars + 2 * reduce_chars) / CHARS_PER_TOKEN
+        return calls_on_path * call_latency, estimate_cost(model, input_tokens, output_tokens)
+
+    def _max_tokens_for(self, model, total_chars, chunks, concurrency, latency_budget):
+        """在目标内每次请求最多可以输出的令牌数"""
+        limit = self.max_completion_tokens
+        if latency_budget is not None:
+            base, per_token = self.latency_model(model)
+            calls_on_path = 2 if chunks <= 1 else math.ceil(chunks / concurrency) + 2
+            per_call = latency_budget / calls_on_path - base
+            if per_token > 0:
+                limit = min(limit, int(per_call / per_token))
+            elif per_call < 0:
+                limit = 0
+        if self.cost_target is not None:
+            # 成本随输出令牌数线性增加
+            fixed_cost = self._estimate(model, total_chars, chunks, concurrency, 0)[1]
+            per_token_cost = self._estimate(model, total_chars, chunks, concurrency, 1)[1] - fixed_cost
+            if per_token_cost > 0:
+                limit = min(limit, int((self.cost_target - fixed_cost) / per_token_cost))
+            elif fixed_cost > self.cost_target:
+                limit = 0
+        # 合并请求数随输出长度阶梯变化，线性估算之后再按完整估算收紧
+        while limit >= MIN_COMPLETION_TOKENS:
+            latency, cost = self._estimate(model, total_chars, chunks, concurrency, limit)
+            if (latency_budget is None or latency <= latency_budget) and \
+                    (self.cost_target is None or cost <= self.cost_target):
+                break
+            limit -= max(1, limit // 10)
+        return limit
+
+    def plan(self, total_chars, chunked=True, elapsed=0.0):
+        """
+        为一个文档选择请求计划
+
+        Args:
+            total_chars: 文档文本的字符数
+            chunked: 长文档是否按分块map-reduce总结（否则一次请求，过长的文本被截断）
+            elapsed: 文档已经用去的时间（秒，例如文本提取），从延迟目标中扣除
+
+        Returns:
+            RequestPlan: 请求计划；无法满足目标时为最省时省钱的计划，feasible为False
+        """
+        latency_budget = None if self.latency_target is None else self.latency_target - elapsed
+        needed = math.ceil(total_chars / MAX_CHUNK_CHARS) if chunked and total_chars > SINGLE_REQUEST_CHARS else 1
+
+        # 分块数从完整覆盖全文开始逐步减半，分块数为1时退化为一次请求
+        fanouts = []
+        chunks = needed
+        while True:
+            fanouts.append(chunks)
+            if chunks <= 1:
+                break
+            chunks = 1 if chunks <= 2 else math.ceil(chunks / 2)
+
+        for model in (self.large_model, self.fast_model):
+            for chunks in fanouts:
+                concurrency = min(chunks, self.max_concurrency)
+                max_tokens = self._max_tokens_for(model, total_chars, chunks, concurrency, latency_budget)
+                if max_tokens >= MIN_COMPLETION_TOKENS:
+                    return self._make_plan(model, total_chars, chunks, concurrency, max_tokens, True)
+        return self._make_plan(self.fast_model, total_chars, 1, 1, MIN_COMPLETION_TOKENS, False)
+
+    def _make_plan(self, model, total_chars, chunks, concurrency, max_tokens, feasible):
+        latency, cost = self._estimate(model, total_chars, chunks, concurrency, max_tokens)
+        chunk_chars = MAX_CHUNK_CHARS if chunks <= 1 else max(MAX_CHUNK_CHARS, math.ceil(total_chars / chunks))
+        return RequestPlan(model, max_tokens, chunks, chunk_chars, concurrency, latency, cost, feasible)
+
+    def record(self, label, elapsed, cost, plan=None):
+        """
+        记录一个文档的实际耗时和成本
+
+        Args:
+            label: 文档名称
+            elapsed: 实际耗时（秒）
+            cost: 实际成本（元）
+            plan: 使用的请求计划
+
+        Returns:
+            bool: 是否满足目标
+        """
+        missed_latency = self.latency_target is not None and elapsed > self.latency_target
+        missed_cost = self.cost_target is not None and cost > self.cost_target
+        met = not (missed_latency or missed_cost)
+        with self._lock:
+            self._counters["documents"] += 1
+            self._counters["met" if met else "missed"] += 1
+            self._counters["missed_latency"] += missed_latency
+            self._counters["missed_cost"] += missed_cost
+            if plan is not None and not plan.feasible:
+                self._counters["infeasible"] += 1
+            self._outcomes.append({"document": label, "elapsed": round(elapsed, 3), "cost": round(cost, 6),
+                                   "met": met, "plan": plan.as_dict() if plan is not None else None})
+        return met
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: 目标、满足目标的文档数和比例、耗时中位数和P95、成本，以及未满足目标的文档
+        """
+        with self._lock:
+            metrics = dict(self._counters)
+            outcomes = list(self._outcomes)
+        elapsed = sorted(outcome["elapsed"] for outcome in outcomes)
+
+        def percentile(q):
+            if not elapsed:
+                return None
+            return elapsed[min(len(elapsed) - 1, math.ceil(q * len(elapsed)) - 1)]
+
+        metrics.update({
+            "latency_target": self.latency_target,
+            "cost_target": self.cost_target,
+            "met_rate": round(metrics["met"] / metrics["documents"], 4) if metrics["documents"] else None,
+            "p50_elapsed": percentile(0.5),
+            "p95_elapsed": percentile(0.95),
+            "total_cost": round(sum(outcome["cost"] for outcome in outcomes), 6),
+            "misses": [outcome for outcome in outcomes if not outcome["met"]]
+        })
+        return metrics
+
+
+@contextlib.contextmanager
+def document_scope(planner, label):
+    """
+    在代码块内（当前线程或协程及其子任务）按planner规划一个文档的请求，结束时记录是否满足目标
+
+    只有代码块正常结束、且调用方把规划状态的succeeded设为True的文档才被记录；失败、取消、
+    跳过或模型调用返回错误的文档的耗时和成本不反映计划的效果，不计入统计
+
+    Args:
+        planner: RequestPlanner，为None时不做任何事
+        label: 文档名称
+
+    Yields:
+        文档的规划状态，没有规划器时为None
+    """
+    if planner is None:
+        yield None
+        return
+    scope = _DocumentScope(planner, label)
+    token = _current_document.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_document.reset(token)
+    if scope.succeeded:
+        planner.record(label, time.monotonic() - scope.started, scope.cost, scope.plan)
+
+
+def plan_document(total_chars, chunked=True):
+    """
+    文本提取完成后为当前文档选择请求计划
+
+    Args:
+        total_chars: 文档文本的字符数
+        chunked: 长文档是否按分块总结
+
+    Returns:
+        RequestPlan: 请求计划，不在document_scope中时为None
+    """
+    scope = _current_document.get()
+    if scope is None:
+        return None
+    scope.plan = scope.planner.plan(total_chars, chunked, time.monotonic() - scope.started)
+    print(f"请求计划: {scope.plan.model}，每次最多输出{scope.plan.max_tokens}个令牌，"
+          f"{scope.plan.chunks}个分块，并发{scope.plan.concurrency}"
+          + ("" if scope.plan.feasible else "（无法满足目标，使用最快的计划）"))
+    return scope.plan
+
+
+def current_plan():
+    """
+    Returns:
+        RequestPlan: 当前文档的请求计划，没有时为None
+    """
+    scope = _current_document.get()
+    return None if scope is None else scope.plan
+
+
+def record_call(model, response, latency):
+    """
+    记录当前文档的一次模型调用：计入文档的成本，并用于拟合延迟模型
+
+    Args:
+        model: 模型名称
+        response: 接口的响应
+        latency: 耗时（秒）
+    """
+    scope = _current_document.get()
+    if scope is None:
+        return
+    scope.add_call(model, response)
+    usage = getattr(response, "usage", None)
+    scope.planner.observe(model, latency, getattr(usage, "completion_tokens", 0) or 0)
@@ -0,0 +1,224 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+# 累积这么多条结果后在一个事务中批量写入
+DEFAULT_BATCH_SIZE = 200
+
+# 遍历结果时每次从数据库读取的行数
+ITER_PAGE_SIZE = 1000
+
+# 计算文件哈希时每次读取的字节数
+HASH_BUFFER_SIZE = 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    path TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    content_hash TEXT,
+    file_size INTEGER,
+    source_mtime REAL,
+    summary TEXT NOT NULL,
+    key_concepts TEXT NOT NULL,
+    page_count INTEGER,
+    selection TEXT,
+    duration REAL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    total_tokens INTEGER,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_content_hash ON results (content_hash);
+"""
+
+_COLUMNS = ("path", "name", "content_hash", "file_size", "source_mtime", "summary", "key_concepts", "page_count",
+            "selection", "duration", "prompt_tokens", "completion_tokens", "total_tokens", "updated_at")
+
+
+def file_hash(path):
+    """
+    计算文件内容的哈希
+
+    Args:
+        path: 文件路径
+
+    Returns:
+        str: 十六进制哈希值
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BUFFER_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ResultStore:
+    """
+    基于SQLite的总结结果库
+
+    每个PDF一行，保存摘要、关键概念、页数、文件哈希、耗时和令牌用量，按路径和内容哈希建立索引。
+    结果先在内存中累积，每batch_size条在一个事务中批量写入；多个线程可以同时调用put。
+    """
+
+    def __init__(self, db_path, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        打开（不存在时创建）结果库
+
+        Args:
+            db_path: SQLite数据库文件路径
+            batch_size: 批量写入的条数
+        """
+        self.db_path = db_path
+        self.batch_size = max(1, batch_size)
+        self._pending = []
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(_SCHEMA)
+
+    def put(self, pdf_path, result, stats=None):
+        """
+        保存一个文件的总结结果（同一路径的旧结果被替换）
+
+        Args:
+            pdf_path: 源PDF文件路径
+            result: PDFSummarizer返回的结果字典
+            stats: 可选的统计信息，包含duration和tokens（prompt_tokens、completion_tokens、total_tokens）
+        """
+        stats = stats or {}
+        tokens = stats.get("tokens") or {}
+        try:
+            stat = os.stat(pdf_path)
+            source = (file_hash(pdf_path), stat.st_size, stat.st_mtime)
+        except OSError:
+            # 源文件已不存在（例如归档中的临时文件），只保存结果
+            source = (None, None, None)
+
+        row = (os.path.abspath(pdf_path), os.path.basename(pdf_path)) + source + (
+            result["summary"], result["key_concepts"], result.get("page_count"), result.get("selection"),
+            stats.get("duration"), tokens.get("prompt_tokens"), tokens.get("completion_tokens"),
+            tokens.get("total_tokens"), time.time()
+        )
+        with self._lock:
+            self._pending.append(row)
+            if len(self._pending) >= self.batch_size:
+                self._flush_locked()
+
+    def flush(self):
+        """把累积的结果写入数据库"""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        placeholders = ", ".join("?" for _ in _COLUMNS)
+        with self._connection:
+            self._connection.executemany(
+                f"INSERT OR REPLACE INTO results ({', '.join(_COLUMNS)}) VALUES ({placeholders})", self._pending
+            )
+        self._pending = []
+
+    def get(self, pdf_path):
+        """
+        Args:
+            pdf_path: 源PDF文件路径
+
+        Returns:
+            dict: 结果行，不存在时为None
+        """
+        self.flush()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT * FROM results WHERE path = ?", (os.path.abspath(pdf_path),)
+            ).fetchone()
+        return dict(row) if row is not None else None
+
+    def find_by_hash(self, content_hash):
+        """
+        Args:
+            content_hash: 文件内容哈希（见file_hash）
+
+        Returns:
+            list: 内容相同的文件的结果行
+        """
+        self.flush()
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT * FROM results WHERE content_hash = ? ORDER BY path", (content_hash,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def is_up_to_date(self, pdf_path):
+        """
+        判断库中是否已有该文件当前版本的结果（大小和修改时间都未变化）
+
+        Args:
+            pdf_path: 源PDF文件路径
+
+        Returns:
+            bool: 已有最新结果时为True
+        """
+        row = self.get(pdf_path)
+        if row is None:
+            return False
+        stat = os.stat(pdf_path)
+        return row["file_size"] == stat.st_size and row["source_mtime"] == stat.st_mtime
+
+    def iter_results(self, folder=None):
+        """
+        按路径顺序遍历结果
+
+        Args:
+            folder: 只返回该文件夹（含子文件夹）中的文件，为None时返回全部
+
+        Yields:
+            dict: 结果行
+        """
+        self.flush()
+        last, end = "", None
+        if folder is not None:
+            # 按路径前缀的范围查询，可以使用主键索引
+            prefix = os.path.join(os.path.abspath(folder), "")
+            last, end = prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+        # 按主键分页读取，内存中只保留一页结果
+        while True:
+            query = "SELECT * FROM results WHERE path > ?"
+            params = [last]
+            if end is not None:
+                query += " AND path < ?"
+                params.append(end)
+            with self._lock:
+                rows = self._connection.execute(query + f" ORDER BY path LIMIT {ITER_PAGE_SIZE}", params).fetchall()
+            for row in rows:
+                yield dict(row)
+            if len(rows) < ITER_PAGE_SIZE:
+                return
+            last = rows[-1]["path"]
+
+    def count(self):
+        """
+        Returns:
+            int: 库中的结果数
+        """
+        self.flush()
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self):
+        """写入剩余结果并关闭数据库"""
+        with self._lock:
+            self._flush_locked()
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,309 @@
+import PyPDF2
+
+from isolated_extraction import call_isolated
+
+try:
+    import pymupdf
+except ImportError:
+    try:
+        import fitz as pymupdf
+    except ImportError:
+        pymupdf = None
+
+try:
+    import pytesseract
+    from PIL import Image
+except ImportError:
+    pytesseract = None
+
+# 每页至少包含这么多可见字符才视为有可提取的文本
+MIN_TEXT_CHARS = 25
+
+# 没有文本的页面中图片覆盖超过该比例时视为纯图片（扫描）页
+MIN_IMAGE_COVERAGE = 0.5
+
+# 抽样页面中纯图片页达到该比例时视为扫描文档
+SCANNED_DOCUMENT_RATIO = 0.8
+
+# 预检抽样的页数，为None时检查全部页面
+DEFAULT_SAMPLE_PAGES = 8
+
+# OCR默认语言（tesseract语言包名称）
+DEFAULT_OCR_LANGUAGE = "chi_sim+eng"
+
+# OCR渲染分辨率
+OCR_DPI = 200
+
+# 扫描文档的处理方式："skip"跳过并记录，"ocr"放入单独的OCR队列，"ignore"不检测
+SCANNED_POLICIES = ("skip", "ocr", "ignore")
+
+
+class ScannedDocumentError(Exception):
+    """文档没有可提取的文本（扫描件或纯图片），不应发送给模型"""
+
+
+def _visible_chars(text):
+    """统计可见字符数，替换字符和控制字符不计入"""
+    return sum(1 for char in text or "" if not char.isspace() and char != "\ufffd" and char.isprintable())
+
+
+def classify_page(text_chars, has_fonts, image_coverage):
+    """
+    根据文本密度、字体和图片覆盖率判断页面类型
+
+    Args:
+        text_chars: 可见字符数
+        has_fonts: 页面资源中是否有字体
+        image_coverage: 图片覆盖页面面积的比例（0-1）
+
+    Returns:
+        str: "text"（有文本）、"image"（纯图片/扫描页）或"blank"（空白页）
+    """
+    if has_fonts and text_chars >= MIN_TEXT_CHARS:
+        return "text"
+    if image_coverage >= MIN_IMAGE_COVERAGE:
+        return "image"
+    return "blank"
+
+
+def _sample_indices(page_count, sample_pages):
+    if sample_pages is None or page_count <= sample_pages:
+        return list(range(page_count))
+    step = page_count / sample_pages
+    return sorted({int(i * step) for i in range(sample_pages)})
+
+
+def _multiply(m, n):
+    """2D仿射矩阵相乘（PDF的[a b c d e f]表示），只保留计算面积需要的线性部分"""
+    a, b, c, d = m
+    A, B, C, D = n
+    return (a * A + b * C, a * B + b * D, c * A + d * C, c * B + d * D)
+
+
+def _resources_have_fonts(resources, seen):
+    """资源字典或其中的表单XObject（递归）是否有字体，文本可能全部画在表单XObject中"""
+    fonts = resources.get("/Font")
+    if fonts is not None and fonts.get_object():
+        return True
+    xobjects = resources.get("/XObject")
+    if xobjects is None:
+        return False
+    for reference in xobjects.get_object().values():
+        xobject = reference.get_object()
+        if xobject.get("/Subtype") != "/Form" or id(xobject) in seen:
+            continue
+        seen.add(id(xobject))
+        form_resources = xobject.get("/Resources")
+        if form_resources is not None and _resources_have_fonts(form_resources.get_object(), seen):
+            return True
+    return False
+
+
+def _pypdf2_page_profile(page):
+    """用PyPDF2检查一页：只在有字体时提取文本，只在有图片时解析内容流计算覆盖率"""
+    resources = page.get("/Resources")
+    resources = resources.get_object() if resources is not None else {}
+    has_fonts = _resources_have_fonts(resources, set())
+
+    images = set()
+    xobjects = resources.get("/XObject")
+    if xobjects is not None:
+        for name, reference in xobjects.get_object().items():
+            if reference.get_object().get("/Subtype") == "/Image":
+                images.add(name)
+
+    coverage = 0.0
+    if images:
+        contents = page.get_contents()
+        if contents is not None:
+            ctm = (1.0, 0.0, 0.0, 1.0)
+            stack = []
+            area = 0.0
+            for operands, operator in PyPDF2.generic.ContentStream(contents, page.pdf).operations:
+                if operator == b"q":
+                    stack.append(ctm)
+                elif operator == b"Q":
+                    ctm = stack.pop() if stack else (1.0, 0.0, 0.0, 1.0)
+                elif operator == b"cm":
+                    ctm = _multiply(tuple(float(value) for value in operands[:4]), ctm)
+                elif operator == b"Do" and operands and operands[0] in images:
+                    area += abs(ctm[0] * ctm[3] - ctm[1] * ctm[2])
+            page_area = float(page.mediabox.width) * float(page.mediabox.height)
+            coverage = min(1.0, area / page_area) if page_area else 0.0
+
+    text_chars = _visible_chars(page.extract_text()) if has_fonts else 0
+    return text_chars, has_fonts, coverage
+
+
+def _pymupdf_page_profile(page):
+    """用PyMuPDF检查一页"""
+    has_fonts = bool(page.get_fonts())
+    page_area = abs(page.rect)
+    area = 0.0
+    for info in page.get_image_info():
+        bbox = pymupdf.Rect(info["bbox"]) & page.rect
+        area += abs(bbox)
+    coverage = min(1.0, area / page_area) if page_area else 0.0
+    text_chars = _visible_chars(page.get_text()) if has_fonts else 0
+    return text_chars, has_fonts, coverage
+
+
+class ScanReport:
+    """
+    扫描页预检结果
+    """
+
+    def __init__(self, page_count, pages):
+        """
+        Args:
+            page_count: 文档页数
+            pages: {页面下标: 页面信息字典}，只包含被检查的页面
+        """
+        self.page_count = page_count
+        self.pages = pages
+
+    @property
+    def image_pages(self):
+        """被检查页面中的纯图片页下标"""
+        return sorted(index for index, page in self.pages.items() if page["kind"] == "image")
+
+    @property
+    def text_pages(self):
+        """被检查页面中有文本的页面下标"""
+        return sorted(index for index, page in self.pages.items() if page["kind"] == "text")
+
+    @property
+    def classification(self):
+        """
+        Returns:
+            str: "text"（文本文档）、"mixed"（部分扫描页）、"scanned"（扫描文档）或"empty"
+                 （抽样页面都没有足够的文本也没有图片，不能据此判断为扫描文档）
+        """
+        images = len(self.image_pages)
+        texts = len(self.text_pages)
+        if images + texts == 0:
+            return "empty"
+        if images / (images + texts) >= SCANNED_DOCUMENT_RATIO:
+            return "scanned"
+        return "mixed" if images else "text"
+
+    @property
+    def has_extractable_text(self):
+        return self.classification in ("text", "mixed")
+
+    def as_dict(self):
+        return {
+            "classification": self.classification,
+            "page_count": self.page_count,
+            "checked_pages": len(self.pages),
+            "image_pages": [index + 1 for index in self.image_pages]
+        }
+
+
+def analyze_pdf(pdf_path, sample_pages=DEFAULT_SAMPLE_PAGES):
+    """
+    快速预检PDF是否有可提取的文本
+
+    在文档中均匀抽样页面，先检查字体和图片资源，只在页面有字体时提取文本，
+    有PyMuPDF时使用它以提高速度。
+
+    Args:
+        pdf_path: PDF文件路径
+        sample_pages: 抽样的页数，为None时检查全部页面
+
+    Returns:
+        ScanReport: 预检结果
+    """
+    pages = {}
+    if pymupdf is not None:
+        with pymupdf.open(pdf_path) as document:
+            page_count = document.page_count
+            for index in _sample_indices(page_count, sample_pages):
+                text_chars, has_fonts, coverage = _pymupdf_page_profile(document.load_page(index))
+                pages[index] = {"text_chars": text_chars, "fonts": has_fonts, "image_coverage": round(coverage, 3),
+                                "kind": classify_page(text_chars, has_fonts, coverage)}
+        return ScanReport(page_count, pages)
+
+    with open(pdf_path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        page_count = len(reader.pages)
+        for index in _sample_indices(page_count, sample_pages):
+            text_chars, has_fonts, coverage = _pypdf2_page_profile(reader.pages[index])
+            pages[index] = {"text_chars": text_chars, "fonts": has_fonts, "image_coverage": round(coverage, 3),
+                            "kind": classify_page(text_chars, has_fonts, coverage)}
+    return ScanReport(page_count, pages)
+
+
+def check_extractable(pdf_path, sample_pages=DEFAULT_SAMPLE_PAGES, limits=None):
+    """
+    预检PDF，没有可提取的文本时抛出异常
+
+    Args:
+        pdf_path: PDF文件路径
+        sample_pages: 抽样的页数
+        limits: 可选的ExtractionLimits，提供时在隔离的工作进程中预检
+
+    Returns:
+        ScanReport: 预检结果
+
+    Raises:
+        ScannedDocumentError: 扫描文档；抽样页面只是文本很少（"empty"）时不抛出，照常提取和总结
+    """
+    if limits is not None:
+        report = call_isolated(analyze_pdf, (pdf_path, sample_pages), limits)
+    else:
+        report = analyze_pdf(pdf_path, sample_pages)
+    if report.classification == "scanned":
+        raise ScannedDocumentError(
+            f"扫描文档，没有可提取的文本（抽样{len(report.pages)}页中{len(report.image_pages)}页为纯图片）"
+        )
+    if report.image_pages:
+        pages = ", ".join(str(index + 1) for index in report.image_pages)
+        print(f"注意: 第{pages}页为纯图片页，其中的内容不会被总结")
+    return report
+
+
+def require_text(pages):
+    """
+    提取后确认文档中有文字，预检放过的低文本文档提取结果仍为空时不再发送给模型
+
+    Args:
+        pages: 每页文本（可以是PageSpool，遇到第一个有文字的页面即停止读取）
+
+    Raises:
+        ScannedDocumentError: 所有页面都为空或只有空白字符
+    """
+    if not any(page.strip() for page in pages):
+        raise ScannedDocumentError("PDF中没有提取到任何文字（扫描件或空白文档）")
+
+
+def ocr_available():
+    """
+    Returns:
+        bool: 是否安装了OCR所需的PyMuPDF、pytesseract和Pillow
+    """
+    return pymupdf is not None and pytesseract is not None
+
+
+def ocr_pages(pdf_path, language=DEFAULT_OCR_LANGUAGE, dpi=OCR_DPI):
+    """
+    渲染每页并用tesseract识别文字
+
+    Args:
+        pdf_path: PDF文件路径
+        language: tesseract语言
+        dpi: 渲染分辨率
+
+    Returns:
+        list: 每页识别出的文本
+    """
+    if not ocr_available():
+        raise RuntimeError("OCR需要安装pymupdf、pytesseract和Pillow，以及tesseract程序")
+
+    pages = []
+    with pymupdf.open(pdf_path) as document:
+        for page in document:
+            pixmap = page.get_pixmap(dpi=dpi)
+            image = Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+            pages.append(pytesseract.image_to_string(image, lang=language))
+    return pages
@@ -0,0 +1,314 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+# 累积这么多篇文档后在一个事务中批量更新索引
+DEFAULT_BATCH_SIZE = 200
+
+# BM25参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 搜索结果中摘要片段的最大字符数
+SNIPPET_CHARS = 160
+
+# 中日韩字符（汉字、假名、谚文）按字符二元组切分，其他文字按单词切分
+_TOKEN_PATTERN = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]+|[0-9a-z]+")
+_CJK_PATTERN = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    snippet TEXT,
+    length INTEGER NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    doc_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term, doc_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings (doc_id);
+"""
+
+
+def tokenize(text):
+    """
+    把文本切分为索引词
+
+    中日韩文字没有空格分词，连续的中日韩字符切分为相邻二字组合（只有一个字时保留单字），
+    其他文字转为小写后按字母数字单词切分。
+
+    Args:
+        text: 文本
+
+    Returns:
+        list: 索引词列表（保留重复）
+    """
+    terms = []
+    for run in _TOKEN_PATTERN.findall((text or "").lower()):
+        if _CJK_PATTERN.match(run):
+            if len(run) == 1:
+                terms.append(run)
+            else:
+                terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            terms.append(run)
+    return terms
+
+
+def parse_markdown_output(content):
+    """
+    从render_markdown生成的Markdown中取出标题和正文
+
+    Args:
+        content: Markdown文本
+
+    Returns:
+        tuple: (标题, 内容摘要和关键概念文本)
+    """
+    lines = content.splitlines()
+    title = lines[0][2:].strip() if lines and lines[0].startswith("# ") else ""
+    body = "\n".join(line for line in lines[1:] if not line.startswith("## ") and not line.startswith("> "))
+    return title, body.strip()
+
+
+class SearchIndex:
+    """
+    总结结果的本地全文检索索引（SQLite倒排表，BM25排序）
+
+    索引按文档增量更新：写入新结果时只替换该文档的倒排项，不需要重建整个索引。
+    更新先在内存中累积，每batch_size篇在一个事务中批量写入；多个线程可以同时调用add。
+    """
+
+    def __init__(self, db_path, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        打开（不存在时创建）索引
+
+        Args:
+            db_path: SQLite数据库文件路径
+            batch_size: 批量更新的文档数
+        """
+        self.db_path = db_path
+        self.batch_size = max(1, batch_size)
+        self._pending = {}
+        # 文档长度缓存（文档id -> 词数），第一次检索时加载，检索时不需要连接documents表
+        self._lengths = None
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(_SCHEMA)
+
+    def add(self, path, title, text, snippet=None):
+        """
+        添加或替换一篇文档
+
+        Args:
+            path: 文档标识（源PDF路径）
+            title: 标题
+            text: 要检索的正文
+            snippet: 搜索结果中显示的片段，为None时取正文开头
+        """
+        terms = Counter(tokenize(title) + tokenize(text))
+        if snippet is None:
+            snippet = text
+        snippet = re.sub(r"\s+", " ", snippet or "").strip()[:SNIPPET_CHARS]
+        with self._lock:
+            self._pending[os.path.abspath(path)] = (title, snippet, terms)
+            if len(self._pending) >= self.batch_size:
+                self._flush_locked()
+
+    def add_result(self, pdf_path, result):
+        """
+        添加一个PDFSummarizer结果（内容摘要和关键概念）
+
+        Args:
+            pdf_path: 源PDF文件路径
+            result: 包含summary和key_concepts的字典
+        """
+        title = os.path.splitext(os.path.basename(pdf_path))[0]
+        self.add(pdf_path, title, f"{result['summary']}\n{result['key_concepts']}", result["summary"])
+
+    def remove(self, path):
+        """
+        从索引中删除一篇文档
+
+        Args:
+            path: 文档标识（源PDF路径）
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            self._pending[path] = None
+            self._flush_locked()
+
+    def flush(self):
+        """把累积的更新写入索引"""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        now = time.time()
+        with self._connection:
+            for path, entry in self._pending.items():
+                row = self._connection.execute("SELECT id FROM documents WHERE path = ?", (path,)).fetchone()
+                if row is not None:
+                    self._connection.execute("DELETE FROM postings WHERE doc_id = ?", row)
+                if entry is None:
+                    if row is not None:
+                        self._connection.execute("DELETE FROM documents WHERE id = ?", row)
+                        if self._lengths is not None:
+                            self._lengths.pop(row[0], None)
+                    continue
+
+                title, snippet, terms = entry
+                length = sum(terms.values())
+                if row is None:
+                    doc_id = self._connection.execute(
+                        "INSERT INTO documents (path, title, snippet, length, indexed_at) VALUES (?, ?, ?, ?, ?)",
+                        (path, title, snippet, length, now)
+                    ).lastrowid
+                else:
+                    doc_id = row[0]
+                    self._connection.execute(
+                        "UPDATE documents SET title = ?, snippet = ?, length = ?, indexed_at = ? WHERE id = ?",
+                        (title, snippet, length, now, doc_id)
+                    )
+                self._connection.executemany(
+                    "INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)",
+                    ((term, doc_id, tf) for term, tf in terms.items())
+                )
+                if self._lengths is not None:
+                    self._lengths[doc_id] = length
+        self._pending = {}
+
+    def sync_markdown(self, folder, recursive=False):
+        """
+        把文件夹中已生成的Markdown输出同步到索引：只重新索引新增或修改过的输出，删除已不存在的输出
+
+        Args:
+            folder: 输出所在的文件夹
+            recursive: 如果为True，同时同步子文件夹
+
+        Returns:
+            tuple: (重新索引的文档数, 删除的文档数)
+        """
+        folder = os.path.abspath(folder)
+        with self._lock:
+            self._flush_locked()
+            prefix = os.path.join(folder, "")
+            indexed = dict(self._connection.execute(
+                "SELECT path, indexed_at FROM documents WHERE path > ? AND path < ?",
+                (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+            ).fetchall())
+
+        seen = set()
+        updated = 0
+        for directory, subdirectories, file_names in os.walk(folder):
+            if not recursive:
+                subdirectories.clear()
+            for file_name in file_names:
+                if not file_name.lower().endswith(".md"):
+                    continue
+                md_path = os.path.join(directory, file_name)
+                # 索引以源PDF路径为标识，与process_folder写入的结果一致
+                pdf_path = os.path.splitext(md_path)[0] + ".pdf"
+                seen.add(pdf_path)
+                if pdf_path in indexed and os.path.getmtime(md_path) <= indexed[pdf_path]:
+                    continue
+                with open(md_path, "r", encoding="utf-8") as f:
+                    title, body = parse_markdown_output(f.read())
+                self.add(pdf_path, title or os.path.splitext(file_name)[0], body)
+                updated += 1
+
+        removed = [path for path in indexed
+                   if path not in seen and (recursive or os.path.dirname(path) == folder)]
+        with self._lock:
+            self._pending.update((path, None) for path in removed)
+            self._flush_locked()
+        return updated, len(removed)
+
+    def search(self, query, limit=10):
+        """
+        检索文档，按BM25得分从高到低排序
+
+        Args:
+            query: 查询文本，中英文均可
+            limit: 最多返回的文档数
+
+        Returns:
+            list: 字典列表，包含path、title、snippet和score
+        """
+        self.flush()
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+
+        with self._lock:
+            if self._lengths is None:
+                self._lengths = dict(self._connection.execute("SELECT id, length FROM documents"))
+            lengths = self._lengths
+            document_count = len(lengths)
+            if not document_count:
+                return []
+            average_length = sum(lengths.values()) / document_count or 1
+
+            scores = Counter()
+            for term in terms:
+                if len(term) == 1 and _CJK_PATTERN.match(term):
+                    # 单个汉字：匹配以它开头的所有二字组合
+                    rows = self._connection.execute(
+                        "SELECT doc_id, SUM(tf) FROM postings WHERE term >= ? AND term < ? GROUP BY doc_id",
+                        (term, term + "\uffff")
+                    ).fetchall()
+                else:
+                    # 只读取主键索引，不需要回表
+                    rows = self._connection.execute(
+                        "SELECT doc_id, tf FROM postings WHERE term = ?", (term,)
+                    ).fetchall()
+                if not rows:
+                    continue
+                idf = math.log(1 + (document_count - len(rows) + 0.5) / (len(rows) + 0.5))
+                for doc_id, tf in rows:
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[doc_id] / average_length)
+                    scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+            top = scores.most_common(limit)
+            results = []
+            for doc_id, score in top:
+                path, title, snippet = self._connection.execute(
+                    "SELECT path, title, snippet FROM documents WHERE id = ?", (doc_id,)
+                ).fetchone()
+                results.append({"path": path, "title": title, "snippet": snippet, "score": round(score, 4)})
+        return results
+
+    def count(self):
+        """
+        Returns:
+            int: 索引中的文档数
+        """
+        self.flush()
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def close(self):
+        """写入剩余更新并关闭索引"""
+        with self._lock:
+            self._flush_locked()
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
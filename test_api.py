@@ -11,31 +11,238 @@ API测试文件 - 测试PDF处理和智谱AI功能
     python test_api.py --test zhipu
     python test_api.py --test pdf
     python test_api.py --test all
+
+离线回放（不联网，使用fixtures中的录制和自动生成的示例PDF）:
+    python test_api.py --record          # 联网运行一次，录制缺少的请求
+    python test_api.py --replay          # 之后只回放录制
+    python test_api.py --build-fixture   # 不联网重新生成占位回复的录制（仓库中的录制由此生成）
 """
 
 import os
 import sys
 import argparse
+import re
+import tempfile
+import threading
 import time
 from datetime import datetime
+from types import SimpleNamespace
 from dotenv import load_dotenv
 
 # 导入项目模块
 try:
-    from zhipu_ai import ZhipuAI
+    from api_cassette import CASSETTE_ENV_VAR, CASSETTE_MODE_ENV_VAR
+    from batch_jobs import BatchJob, BatchPending, complete_locally
+    from chunk_manifest import load_manifest
+    from key_pool import APIKeyPool
+    from zhipu_ai import DEFAULT_MODEL, ZhipuAI
     from pdf_reader import PDFReader
     from pdf_summarizer import PDFSummarizer
+    from page_spool import PageSpool
+    from concurrency_limiter import AdaptiveConcurrencyLimiter
+    from hedging import HedgePolicy
+    from request_planner import RequestPlanner, document_scope
+    from scan_detection import ScannedDocumentError, check_extractable
 except ImportError as e:
     print(f"❌ 导入模块失败: {e}")
     print("请确保所有依赖模块都在当前目录中")
     sys.exit(1)
 
 
+# 录制文件和示例PDF所在目录
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+DEFAULT_CASSETTE = os.path.join(FIXTURES_DIR, "api_cassette.json")
+SAMPLE_PDF = os.path.join(FIXTURES_DIR, "sample.pdf")
+
+# 回放时没有配置密钥则使用占位密钥，请求不会发出
+REPLAY_API_KEY = "replay.placeholder"
+
+SAMPLE_PDF_PAGES = [
+    [
+        "Artificial Intelligence Overview",
+        "Artificial intelligence is a branch of computer science that studies",
+        "how to build machines able to perceive, reason, learn and act.",
+        "Machine learning lets systems improve from data instead of explicit rules.",
+    ],
+    [
+        "Key Techniques",
+        "Neural networks learn layered representations from large datasets.",
+        "Knowledge bases store facts and relations that systems can query.",
+        "Evaluation on held-out data measures how well a model generalizes.",
+    ],
+]
+
+
+def write_sample_pdf(path, pages=SAMPLE_PDF_PAGES):
+    """
+    生成一个只包含标准字体文本的示例PDF，内容固定，测试结果因此可以回放
+    
+    Args:
+        path: 输出路径
+        pages: 每页的文本行列表
+    """
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_refs = []
+    for lines in pages:
+        text = "BT /F1 12 Tf 72 720 Td 16 TL " + " ".join(
+            "({}) '".format(line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")) for line in lines
+        ) + " ET"
+        objects.append(f"<< /Length {len(text)} >>\nstream\n{text}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        page_refs.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(page_refs)}] /Count {len(page_refs)} >>"
+    
+    content = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(content))
+        content += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(content)
+    content += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    content += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    content += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+class ScriptedClient:
+    """离线测试用的对话补全客户端：记录收到的请求，由reply函数生成回复或抛出异常，不联网"""
+    
+    def __init__(self, reply):
+        """
+        Args:
+            reply: 接收请求参数、返回回复文本的函数
+        """
+        self.reply = reply
+        self.requests = []
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+    
+    def create(self, **params):
+        with self._lock:
+            self.requests.append(params)
+        content = self.reply(params)
+        prompt = params["messages"][-1]["content"]
+        return SimpleNamespace(
+            model=params["model"],
+            choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=content), finish_reason="stop")],
+            usage=SimpleNamespace(prompt_tokens=len(prompt) // 2, completion_tokens=len(content) // 2,
+                                  total_tokens=(len(prompt) + len(content)) // 2)
+        )
+
+
+def offline_zhipu(reply, keys=("offline.key",)):
+    """
+    创建请求由ScriptedClient处理的ZhipuAI，不使用录制、模型级联、请求规划和对冲，
+    使用单独的并发限制器，不受其他测试调整的共享限制器影响
+    
+    Args:
+        reply: 回复函数，见ScriptedClient；也可以是 {密钥: 回复函数} 字典，每个密钥的请求分别处理
+        keys: 密钥列表
+    
+    Returns:
+        tuple: (ZhipuAI, {密钥: ScriptedClient})
+    """
+    zhipu = ZhipuAI(list(keys), limiter=AdaptiveConcurrencyLimiter())
+    zhipu.cassette = zhipu.router = zhipu.planner = zhipu.hedge_policy = None
+    clients = {key: ScriptedClient(reply[key] if isinstance(reply, dict) else reply) for key in keys}
+    zhipu._clients = clients
+    zhipu.client = clients[zhipu.api_key]
+    return zhipu, clients
+
+
+class ScriptedError(Exception):
+    """离线测试中模拟的带HTTP状态码的接口错误"""
+    
+    def __init__(self, status_code):
+        super().__init__(f"模拟的接口错误（{status_code}）")
+        self.status_code = status_code
+
+
+def user_prompt(params):
+    """请求中用户消息的内容"""
+    return params["messages"][-1]["content"]
+
+
+# 离线生成录制文件时的占位回复（见build_fixture）
+FIXTURE_ANSWERS = {
+    "1+1等于几？": "1+1等于2。",
+    "请用一句话解释什么是人工智能": "人工智能是让机器模拟人类感知、推理和学习能力的技术。",
+    "今天天气怎么样？": "我无法获取实时天气信息，请查看当地的天气预报。",
+}
+FIXTURE_PLACEHOLDER = (
+    "1. 人工智能是计算机科学的一个分支，研究如何让机器感知、推理、学习和行动。\n"
+    "2. 机器学习让系统从数据中改进，而不是依赖显式规则。\n"
+    "3. 神经网络从大规模数据中学习分层表示，并在留出数据上评估泛化能力。"
+)
+
+
+def fixture_reply(params):
+    """录制文件中的占位回复：固定问题使用固定回答，短问候使用问候语，其余请求使用占位要点"""
+    question = user_prompt(params)
+    return FIXTURE_ANSWERS.get(question, "你好！我是智谱AI助手。" if len(question) < 20 else FIXTURE_PLACEHOLDER)
+
+
+def build_fixture(cassette_path):
+    """
+    不联网重新生成录制文件：请求经过与联网时相同的代码路径，只在SDK发送请求处换成占位回复，
+    生成的录制因此可以重复得到；需要真实回复时改用 --record
+    
+    Args:
+        cassette_path: 录制文件路径，原有内容被覆盖
+    
+    Returns:
+        bool: 录制用到的测试是否全部通过
+    """
+    from zhipuai.api_resource.chat.completions import Completions
+    import simple_api_test
+    
+    os.environ[CASSETTE_ENV_VAR] = cassette_path
+    os.environ[CASSETTE_MODE_ENV_VAR] = "record"
+    os.environ.setdefault("ZHIPU_API_KEY", REPLAY_API_KEY)
+    client = ScriptedClient(fixture_reply)
+    Completions.create = lambda self, **params: client.create(**params)
+    
+    tester = APITester()
+    passed = tester.test_zhipu_ai_connection()["success"] and tester.test_pdf_summarizer()["success"]
+    passed = passed and simple_api_test.test_zhipu_api() and simple_api_test.test_simple_chat()
+    tester.log(f"{'✅' if passed else '❌'} 已生成{len(client.requests)}个请求的占位录制: {cassette_path}")
+    return passed
+
+
+def marker_reply(params):
+    """
+    分块测试的回复：回复中保留提示词里的页面标记（标记123），分块总结较长（并随片段长度变化），合并和汇总的结果较短
+    """
+    prompt = user_prompt(params)
+    markers = " ".join(re.findall(r"标记\d{3}", prompt))
+    if "一个片段" in prompt:
+        return f"片段要点（{len(prompt)}字）：{markers}。" + "要点内容" * 150
+    if "合并为一份更简洁的要点列表" in prompt:
+        return f"合并要点：{markers}。"
+    return f"全文总结：{markers}。"
+
+
+def marker_pages(page_count):
+    """分块测试的页面，每页带一个页面标记"""
+    return [f"第{index}页 标记{index:03d} " + "正文内容" * 300 for index in range(page_count)]
+
+
 class APITester:
     """API测试类"""
     
-    def __init__(self):
-        """初始化测试器"""
+    def __init__(self, pdf_path=None):
+        """
+        初始化测试器
+        
+        Args:
+            pdf_path: 测试用的PDF文件，为None时使用当前目录中的PDF或生成示例PDF
+        """
+        self.pdf_path = pdf_path
         self.load_environment()
         self.test_results = {}
         self.start_time = None
@@ -44,6 +251,25 @@ class APITester:
         """加载环境变量"""
         load_dotenv()
         self.api_key = os.getenv("ZHIPU_API_KEY")
+        self.cassette = os.getenv(CASSETTE_ENV_VAR)
+        self.replaying = bool(self.cassette) and os.getenv(CASSETTE_MODE_ENV_VAR) == "replay"
+        if self.replaying and not self.api_key:
+            self.api_key = REPLAY_API_KEY
+    
+    def find_test_pdf(self):
+        """
+        选择测试用的PDF：指定的文件；使用录制时固定使用示例PDF；否则使用当前目录中的第一个PDF，没有时使用示例PDF
+        """
+        if self.pdf_path:
+            return self.pdf_path
+        if not self.cassette:
+            for file in sorted(os.listdir(".")):
+                if file.lower().endswith(".pdf"):
+                    return file
+        if not os.path.exists(SAMPLE_PDF):
+            write_sample_pdf(SAMPLE_PDF)
+            self.log(f"📝 已生成示例PDF: {SAMPLE_PDF}")
+        return SAMPLE_PDF
         
     def log(self, message, level="INFO"):
         """记录测试日志"""
@@ -70,10 +296,18 @@ class APITester:
             self.log("✅ API密钥已加载")
         else:
             self.log("❌ API密钥未找到", "ERROR")
+        
+        if self.cassette:
+            results["cassette"] = self.cassette
+            self.log(f"📼 {'回放' if self.replaying else '录制'}接口请求: {self.cassette}")
             
         self.log(f"📍 Python版本: {sys.version.split()[0]}")
         self.log(f"📁 当前目录: {os.getcwd()}")
         
+        # 回放录制时不需要.env文件和真实密钥
+        results["success"] = results["api_key_loaded"]
+        if not results["success"]:
+            results["error"] = "API密钥未设置"
         return results
         
     def test_zhipu_ai_connection(self):
@@ -135,15 +369,7 @@ class APITester:
         self.log("📚 测试PDF读取功能...")
         
         # 查找测试PDF文件
-        test_pdf = None
-        for file in os.listdir("."):
-            if file.lower().endswith(".pdf"):
-                test_pdf = file
-                break
-                
-        if not test_pdf:
-            self.log("⚠️  未找到PDF文件进行测试", "WARNING")
-            return {"success": False, "error": "未找到PDF文件"}
+        test_pdf = self.find_test_pdf()
             
         try:
             self.log(f"📖 使用文件: {test_pdf}")
@@ -193,15 +419,7 @@ class APITester:
             return {"success": False, "error": "API密钥未设置"}
             
         # 查找测试PDF文件
-        test_pdf = None
-        for file in os.listdir("."):
-            if file.lower().endswith(".pdf"):
-                test_pdf = file
-                break
-                
-        if not test_pdf:
-            self.log("⚠️  未找到PDF文件进行测试", "WARNING")
-            return {"success": False, "error": "未找到PDF文件"}
+        test_pdf = self.find_test_pdf()
             
         try:
             self.log(f"📖 使用文件: {test_pdf}")
@@ -217,6 +435,11 @@ class APITester:
             end_time = time.time()
             
             if result and "summary" in result and "key_concepts" in result:
+                # 总结器把接口错误写进结果而不是抛出
+                for field in ("summary", "key_concepts"):
+                    if result[field].startswith("错误"):
+                        self.log(f"❌ PDF摘要生成失败: {result[field]}", "ERROR")
+                        return {"success": False, "error": result[field]}
                 self.log("✅ PDF摘要生成成功")
                 self.log(f"⏱️  处理时间: {end_time - start_time:.2f}秒")
                 self.log(f"📄 页数: {result.get('page_count', 'N/A')}")
@@ -241,6 +464,338 @@ class APITester:
             self.log(f"❌ PDF摘要测试失败: {str(e)}", "ERROR")
             return {"success": False, "error": str(e)}
             
+    def test_page_spool(self, threads=4, rounds=200):
+        """测试页面缓存的并发读取（低内存模式下分块的map阶段在多个线程中同时切片）"""
+        self.log("🗂️  测试页面缓存并发读取...")
+        
+        # 页面长度和字符宽度各不相同，读错偏移时内容不符或无法解码；页面大于文件缓冲区，读取时真正访问磁盘
+        pages = [f"第{index}页 " + ("内容" if index % 2 else "text ") * (4000 + index * 37) for index in range(64)]
+        wrong = []
+        failures = []
+        
+        def reader(seed):
+            for round_number in range(rounds):
+                start = (seed * 7 + round_number * 5) % len(pages)
+                end = min(len(pages), start + round_number % 6 + 1)
+                try:
+                    if spool[start:end] != pages[start:end]:
+                        wrong.append((start, end))
+                except Exception as e:
+                    failures.append(str(e))
+        
+        try:
+            with PageSpool(pages) as spool:
+                workers = [threading.Thread(target=reader, args=(seed,)) for seed in range(threads)]
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                in_order = list(spool) == pages
+        except Exception as e:
+            self.log(f"❌ 页面缓存测试失败: {str(e)}", "ERROR")
+            return {"success": False, "error": str(e)}
+        
+        reads = threads * rounds
+        if wrong or failures or not in_order:
+            error = f"{reads}次并发读取中{len(wrong)}次内容错误，{len(failures)}次异常"
+            self.log(f"❌ 页面缓存并发读取失败: {error}", "ERROR")
+            return {"success": False, "error": error}
+        self.log(f"✅ 页面缓存并发读取正确（{threads}个线程，{reads}次切片）")
+        return {"success": True, "reads": reads}
+        
+    def test_chunk_reduce(self, page_count=300):
+        """测试长文档分块总结时每个分块的要点都进入最终的汇总请求（不联网）"""
+        self.log("🧩 测试长文档分块汇总...")
+        
+        pages = marker_pages(page_count)
+        expected = {f"标记{index:03d}" for index in range(page_count)}
+        merges = {}
+        # 全文读取和低内存模式（页面文本暂存在磁盘上）经过同一个汇总流程，分别检查
+        for mode in ("全文读取", "低内存模式"):
+            zhipu, clients = offline_zhipu(marker_reply)
+            summarizer = PDFSummarizer(zhipu.api_key)
+            summarizer.zhipu_ai = zhipu
+            try:
+                if mode == "全文读取":
+                    summarizer.summarize_pages(pages, map_reduce=True)
+                else:
+                    with PageSpool(pages) as spool:
+                        summarizer.summarize_pages(spool, map_reduce=True)
+            except Exception as e:
+                self.log(f"❌ 分块汇总测试失败（{mode}）: {str(e)}", "ERROR")
+                return {"success": False, "error": str(e)}
+            
+            requests = [user_prompt(params) for params in clients[zhipu.api_key].requests]
+            merges[mode] = sum("合并为一份更简洁的要点列表" in prompt for prompt in requests)
+            final = [prompt for prompt in requests
+                     if "一个片段" not in prompt and "合并为一份更简洁的要点列表" not in prompt]
+            missing = max((len(expected - set(re.findall(r"标记\d{3}", prompt))) for prompt in final),
+                          default=page_count)
+            if len(final) != 2 or missing:
+                error = f"{mode}的汇总请求中缺少{missing}页的要点"
+                self.log(f"❌ 分块汇总不完整: {error}", "ERROR")
+                return {"success": False, "error": error}
+            self.log(f"✅ {mode}: {page_count}页的要点全部进入汇总请求（合并{merges[mode]}次）")
+        return {"success": True, "merges": merges}
+        
+    def test_chunk_reuse(self, page_count=300, edited_page=150):
+        """测试增量总结：修改一页后只重新总结和合并受影响的分块，未修改的文档不发出请求（不联网）"""
+        self.log("♻️  测试分块复用...")
+        
+        zhipu, clients = offline_zhipu(marker_reply)
+        summarizer = PDFSummarizer(zhipu.api_key)
+        summarizer.zhipu_ai = zhipu
+        requests = clients[zhipu.api_key].requests
+        pages = marker_pages(page_count)
+        runs = []
+        with tempfile.TemporaryDirectory() as directory:
+            manifest_path = os.path.join(directory, "document.md.chunks.json")
+            for edit in (None, "修订内容", None):
+                if edit is not None:
+                    pages[edited_page] = f"第{edited_page}页 标记{edited_page:03d} " + edit * 200
+                before = len(requests)
+                try:
+                    result = summarizer.summarize_pages(list(pages), manifest_path=manifest_path)
+                except Exception as e:
+                    self.log(f"❌ 分块复用测试失败: {str(e)}", "ERROR")
+                    return {"success": False, "error": str(e)}
+                prompts = [user_prompt(params) for params in requests[before:]]
+                runs.append({
+                    "chunks": sum("一个片段" in prompt for prompt in prompts),
+                    "merges": sum("合并为一份更简洁的要点列表" in prompt for prompt in prompts),
+                    "requests": len(prompts),
+                    "stats": result["chunk_stats"]
+                })
+            cached = load_manifest(manifest_path)
+        
+        first, edited, unchanged = runs
+        # 基于内容的分块：修改一页只改变它所在的分块，合并时每一层只重新合并受影响的组
+        errors = []
+        if edited["chunks"] != 1 or edited["stats"]["reused"] != first["stats"]["chunks"] - 1:
+            errors.append(f"修改一页后重新总结了{edited['chunks']}个分块")
+        if not 0 < edited["merges"] < first["merges"]:
+            errors.append(f"修改一页后重新合并了{edited['merges']}组（首次{first['merges']}组）")
+        if unchanged["requests"] or not unchanged["stats"]["unchanged"]:
+            errors.append(f"未修改的文档发出了{unchanged['requests']}个请求")
+        if not cached or not cached.get("merged"):
+            errors.append("清单中没有保存合并结果")
+        if errors:
+            self.log(f"❌ 分块复用不正确: {'；'.join(errors)}", "ERROR")
+            return {"success": False, "error": "；".join(errors)}
+        self.log(f"✅ 首次{first['requests']}个请求；修改一页后{edited['requests']}个请求"
+                 f"（{edited['chunks']}个分块、{edited['merges']}组合并）；未修改时没有请求")
+        return {"success": True, "runs": runs}
+    
+    def test_packed_split(self):
+        """测试打包总结：回复按文档拆分，格式不完整的文档单独重新总结（不联网）"""
+        self.log("📦 测试打包回复拆分...")
+        
+        titles = ["Alpha", "Bravo", "Charlie"]
+        
+        def reply(params):
+            prompt = user_prompt(params)
+            documents = re.findall(r"<<<DOC (\d+)>>>\s*Document (\w+)", prompt)
+            if documents:
+                # 第2篇文档的回复缺少关键概念部分，无法拆分出来
+                return "\n".join(
+                    f"<<<DOC {index}>>>\n<<<SUMMARY>>>\n总结{title}\n"
+                    + ("" if index == "2" else f"<<<CONCEPTS>>>\n1. 概念{title}\n") + f"<<<END {index}>>>"
+                    for index, title in documents
+                )
+            title = re.search(r"Document (\w+)", prompt).group(1)
+            return f"单独总结{title}\n1. 概念{title}"
+        
+        zhipu, clients = offline_zhipu(reply)
+        summarizer = PDFSummarizer(zhipu.api_key)
+        summarizer.zhipu_ai = zhipu
+        with tempfile.TemporaryDirectory() as directory:
+            paths = {}
+            for title in titles:
+                paths[title] = os.path.join(directory, f"{title.lower()}.pdf")
+                write_sample_pdf(paths[title], pages=[[f"Document {title}", f"{title} is a short test document."]])
+            try:
+                results = summarizer.summarize_pdfs_packed(list(paths.values()))
+            except Exception as e:
+                self.log(f"❌ 打包测试失败: {str(e)}", "ERROR")
+                return {"success": False, "error": str(e)}
+        
+        expected = {"Alpha": "总结Alpha", "Bravo": "单独总结Bravo", "Charlie": "总结Charlie"}
+        wrong = [title for title, summary in expected.items()
+                 if isinstance(results[paths[title]], Exception)
+                 or results[paths[title]]["summary"].splitlines()[0] != summary]
+        requests = len(clients[zhipu.api_key].requests)
+        if wrong or requests != 3:
+            error = f"{'、'.join(wrong) or '无'}的结果不正确，共发出{requests}个请求（应为1个打包请求和2个单独请求）"
+            self.log(f"❌ 打包回复拆分不正确: {error}", "ERROR")
+            return {"success": False, "error": error}
+        self.log("✅ 打包回复按文档拆分，缺少部分的文档单独重新总结")
+        return {"success": True}
+    
+    def test_key_ejection(self):
+        """测试多密钥：请求本身的错误不计入密钥，认证错误连续出现时剔除密钥，剔除到期后恢复（不联网）"""
+        self.log("🔑 测试密钥剔除与恢复...")
+        
+        failures = {"status": 400}
+        
+        def failing(params):
+            if failures["status"] is not None:
+                raise ScriptedError(failures["status"])
+            return "恢复后的回复"
+        
+        pool = APIKeyPool(["key-a", "key-b"], max_consecutive_errors=3, ejection_seconds=0.5)
+        zhipu, clients = offline_zhipu({"key-a": failing, "key-b": lambda params: "正常的回复"},
+                                       keys=("key-a", "key-b"))
+        zhipu.key_pool = pool
+        state = pool.keys[0]
+        
+        def call_until(count):
+            # 两个密钥轮流使用，发出请求直到key-a收到count个请求
+            while len(clients["key-a"].requests) < count:
+                zhipu.summarize_text("测试文本")
+        
+        errors = []
+        call_until(4)
+        if state.ejected_until > time.monotonic():
+            errors.append("请求本身的错误（400）导致密钥被剔除")
+        
+        failures["status"] = 401
+        call_until(7)
+        if state.ejected_until <= time.monotonic():
+            errors.append("连续3次认证错误后密钥未被剔除")
+        ejected_requests = len(clients["key-a"].requests)
+        for _ in range(4):
+            zhipu.summarize_text("测试文本")
+        if len(clients["key-a"].requests) != ejected_requests:
+            errors.append("被剔除的密钥仍收到请求")
+        
+        failures["status"] = None
+        time.sleep(max(0.0, state.ejected_until - time.monotonic()) + 0.05)
+        call_until(ejected_requests + 1)
+        if state.consecutive_errors or pool.snapshot()[0]["ejected"]:
+            errors.append("剔除到期后密钥没有恢复")
+        
+        if errors:
+            self.log(f"❌ 密钥剔除不正确: {'；'.join(errors)}", "ERROR")
+            return {"success": False, "error": "；".join(errors)}
+        self.log("✅ 400错误不计入密钥，连续认证错误剔除密钥，到期后恢复使用")
+        return {"success": True, "ejections": state.ejections}
+    
+    def test_batch_retry(self):
+        """测试批处理：暂时失败的请求在下一轮重新提交，请求本身的错误直接导入（不联网）"""
+        self.log("📬 测试批处理重试...")
+        
+        zhipu, clients = offline_zhipu(lambda params: "批处理回复\n1. 概念一\n2. 概念二\n3. 概念三")
+        summarizer = PDFSummarizer(zhipu.api_key)
+        summarizer.zhipu_ai = zhipu
+        client = clients[zhipu.api_key]
+        text = "批处理测试文档的内容。" * 20
+        rounds = []
+        with tempfile.TemporaryDirectory() as directory:
+            zhipu.cassette = BatchJob(directory)
+            for failing_status in (429, None, None):
+                try:
+                    result = summarizer.summarize_extracted_text(text, 1)
+                except BatchPending:
+                    result = None
+                requests_path = zhipu.cassette.write_requests()
+                if requests_path is None:
+                    break
+                with open(requests_path, "r", encoding="utf-8") as f:
+                    submitted = [line for line in f if line.strip()]
+                rounds.append(len(submitted))
+                
+                failed = []
+                
+                def respond(body):
+                    # 每轮第一个请求按failing_status失败
+                    if failing_status is not None and not failed:
+                        failed.append(body)
+                        raise ScriptedError(failing_status)
+                    return client.create(**body)
+                
+                results_path = os.path.join(directory, f"results-{len(rounds)}.jsonl")
+                zhipu.cassette.ingest(complete_locally(requests_path, results_path, respond))
+            zhipu.cassette.flush()
+        
+        # 第一轮2个请求（总结和关键概念），限流的1个在第二轮重新提交，之后全部回放
+        if rounds != [2, 1] or result is None or result["summary"].startswith("错误"):
+            error = f"每轮提交的请求数为{rounds}，最终结果: {result}"
+            self.log(f"❌ 批处理重试不正确: {error}", "ERROR")
+            return {"success": False, "error": error}
+        self.log("✅ 限流的请求在下一轮重新提交，之后所有请求从导入的结果回放")
+        return {"success": True, "rounds": rounds}
+    
+    def test_blank_pdf(self):
+        """测试没有文字的PDF：预检放过（文本很少不算扫描件），提取后也不会发送给模型（不联网）"""
+        self.log("📄 测试空白PDF...")
+        
+        zhipu, clients = offline_zhipu(lambda params: "不应发出请求")
+        summarizer = PDFSummarizer(zhipu.api_key)
+        summarizer.zhipu_ai = zhipu
+        outcomes = {}
+        with tempfile.TemporaryDirectory() as directory:
+            blank_path = os.path.join(directory, "blank.pdf")
+            write_sample_pdf(blank_path, pages=[[], [" "]])
+            try:
+                check_extractable(blank_path)
+                outcomes["预检"] = "通过"
+            except ScannedDocumentError as e:
+                outcomes["预检"] = f"被当作扫描件: {e}"
+            
+            calls = {
+                "summarize_pdf": lambda: summarizer.summarize_pdf(blank_path),
+                "低内存模式": lambda: summarizer.summarize_pdf(blank_path, bounded_memory=True),
+                "summarize_pdfs_packed": lambda: summarizer.summarize_pdfs_packed([blank_path, blank_path])[blank_path],
+            }
+            for name, call in calls.items():
+                try:
+                    result = call()
+                except Exception as e:
+                    result = e
+                outcomes[name] = "跳过" if isinstance(result, ScannedDocumentError) else f"未跳过: {result}"
+        
+        requests = len(clients[zhipu.api_key].requests)
+        failed = {name: outcome for name, outcome in outcomes.items() if outcome not in ("通过", "跳过")}
+        if failed or requests:
+            error = "；".join(f"{name}{outcome}" for name, outcome in failed.items()) or f"发出了{requests}个请求"
+            self.log(f"❌ 空白PDF处理不正确: {error}", "ERROR")
+            return {"success": False, "error": error}
+        self.log("✅ 空白PDF通过预检，提取后作为扫描件跳过，没有发出请求")
+        return {"success": True}
+        
+    def test_hedge_accounting(self):
+        """测试被对冲丢弃的请求之后返回时，令牌仍计入用量统计和当前文档（不联网）"""
+        self.log("⏱️  测试对冲请求的用量统计...")
+        
+        release = threading.Event()
+        started = []
+        
+        def reply(params):
+            started.append(params)
+            # 第一个请求一直等到对冲请求返回之后才完成，成为被丢弃的请求
+            if len(started) == 1:
+                release.wait(5)
+            return "对冲测试的回复内容"
+        
+        zhipu, clients = offline_zhipu(reply)
+        zhipu.hedge_policy = HedgePolicy(percentile=0.5, max_hedge_rate=1.0, min_samples=1, min_delay=0.05)
+        zhipu.hedge_policy.observe(DEFAULT_MODEL, 0.05)
+        planner = RequestPlanner(DEFAULT_MODEL, latency_target=600)
+        with zhipu.track_usage() as usage, document_scope(planner, "hedge") as scope:
+            zhipu.summarize_text("测试文本")
+            release.set()
+            deadline = time.time() + 5
+            while usage.requests < 2 and time.time() < deadline:
+                time.sleep(0.01)
+            counted = (usage.requests, scope.requests)
+        
+        if len(started) != 2 or counted != (2, 2):
+            error = f"发出{len(started)}个请求，用量统计记录{counted[0]}个，文档记录{counted[1]}个"
+            self.log(f"❌ 对冲用量统计不完整: {error}", "ERROR")
+            return {"success": False, "error": error}
+        self.log("✅ 被丢弃的对冲请求计入用量统计和文档成本")
+        return {"success": True}
+        
     def test_error_handling(self):
         """测试错误处理"""
         self.log("🛡️  测试错误处理...")
@@ -302,6 +857,32 @@ class APITester:
         self.test_results["pdf_summarizer"] = self.test_pdf_summarizer()
         self.log("-" * 30)
         
+        # 页面缓存测试（不需要密钥）
+        self.test_results["page_spool"] = self.test_page_spool()
+        self.log("-" * 30)
+        
+        # 分块汇总测试（不联网）
+        self.test_results["chunk_reduce"] = self.test_chunk_reduce()
+        self.log("-" * 30)
+        
+        # 分块复用、打包拆分、密钥剔除和批处理重试测试（不联网）
+        self.test_results["chunk_reuse"] = self.test_chunk_reuse()
+        self.log("-" * 30)
+        self.test_results["packed_split"] = self.test_packed_split()
+        self.log("-" * 30)
+        self.test_results["key_ejection"] = self.test_key_ejection()
+        self.log("-" * 30)
+        self.test_results["batch_retry"] = self.test_batch_retry()
+        self.log("-" * 30)
+        
+        # 空白PDF测试（不联网）
+        self.test_results["blank_pdf"] = self.test_blank_pdf()
+        self.log("-" * 30)
+        
+        # 对冲用量统计测试（不联网）
+        self.test_results["hedge_accounting"] = self.test_hedge_accounting()
+        self.log("-" * 30)
+        
         # 错误处理测试
         self.test_results["error_handling"] = self.test_error_handling()
         self.log("-" * 30)
@@ -351,12 +932,33 @@ class APITester:
 def main():
     """主函数"""
     parser = argparse.ArgumentParser(description="API测试工具")
-    parser.add_argument("--test", choices=["env", "zhipu", "pdf", "summarizer", "error", "all"], 
+    parser.add_argument("--test", choices=["env", "zhipu", "pdf", "summarizer", "spool", "reduce", "reuse", "packed",
+                                           "keys", "batch", "blank", "hedge", "error", "all"],
                        default="all", help="选择要运行的测试")
+    parser.add_argument("--pdf", help="测试用的PDF文件（默认使用当前目录中的PDF，使用录制时使用生成的示例PDF）")
+    parser.add_argument("--cassette", default=DEFAULT_CASSETTE, help="接口请求录制文件")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--record", action="store_true", help="联网运行，录制录制文件中缺少的请求")
+    mode.add_argument("--replay", action="store_true",
+                      help="只回放录制，不联网（录制文件存在时的默认行为）")
+    mode.add_argument("--live", action="store_true", help="直接调用接口，不使用录制")
+    mode.add_argument("--build-fixture", action="store_true",
+                      help="不联网重新生成录制文件：请求经过正常的代码路径，回复为固定的占位文本")
     
     args = parser.parse_args()
     
-    tester = APITester()
+    if args.build_fixture:
+        sys.exit(0 if build_fixture(args.cassette) else 1)
+    
+    # 所有ZhipuAI客户端从环境变量读取录制设置
+    if args.record:
+        os.environ[CASSETTE_ENV_VAR] = args.cassette
+        os.environ[CASSETTE_MODE_ENV_VAR] = "auto"
+    elif args.replay or (not args.live and os.path.exists(args.cassette)):
+        os.environ[CASSETTE_ENV_VAR] = args.cassette
+        os.environ[CASSETTE_MODE_ENV_VAR] = "replay"
+    
+    tester = APITester(args.pdf)
     
     if args.test == "all":
         tester.run_all_tests()
@@ -368,6 +970,22 @@ def main():
         tester.test_pdf_reader()
     elif args.test == "summarizer":
         tester.test_pdf_summarizer()
+    elif args.test == "spool":
+        tester.test_page_spool()
+    elif args.test == "reduce":
+        tester.test_chunk_reduce()
+    elif args.test == "reuse":
+        tester.test_chunk_reuse()
+    elif args.test == "packed":
+        tester.test_packed_split()
+    elif args.test == "keys":
+        tester.test_key_ejection()
+    elif args.test == "batch":
+        tester.test_batch_retry()
+    elif args.test == "blank":
+        tester.test_blank_pdf()
+    elif args.test == "hedge":
+        tester.test_hedge_accounting()
     elif args.test == "error":
         tester.test_error_handling()
 
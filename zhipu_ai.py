@@ -1,138 +1,996 @@
+import asyncio
+import contextlib
+import contextvars
 import os
+import threading
+import time
 import zhipuai
 from dotenv import load_dotenv
+from concurrency_limiter import get_default_limiter, is_rate_limit_error
+from key_pool import APIKeyPool, is_key_error
+from hedging import HedgePolicy
+from api_cassette import Cassette
+from model_routing import ModelRouter, check_output
+from request_planner import RequestPlanner, current_plan, record_call
+from profiling import profile_stage
+from cancellation import ABORT_ERRORS, CANCEL_POLL_INTERVAL, carry_context, check_deadline, request_timeout
+from document_packing import CONCEPTS_MARK, DOC_END, DOC_START, SUMMARY_MARK, format_packed_documents, split_packed_response
+
+try:
+    import openai
+except ImportError:
+    openai = None
+
+# 智谱AI的OpenAI兼容接口地址，供异步客户端使用
+ZHIPU_OPENAI_BASE_URL = "https://open.bigmodel.cn/api/paas/v4/"
+
+DEFAULT_MODEL = "glm-4.6"
+
+# 单次请求的默认超时（秒），可以通过环境变量ZHIPU_REQUEST_TIMEOUT修改
+DEFAULT_REQUEST_TIMEOUT = 180.0
+REQUEST_TIMEOUT_ENV_VAR = "ZHIPU_REQUEST_TIMEOUT"
+
+# 对话补全请求的采样参数
+SAMPLING_PARAMS = {"top_p": 0.7, "temperature": 0.3}
+
+# 常见的回复前缀，会从模型输出中去除
+RESPONSE_PREFIXES = [
+    "好的，", "这是", "以下是", "下面是", "这里是",
+    "好的。", "这是对", "以下是对", "下面是对", "这里是对"
+]
+
+
+class TokenUsage:
+    """
+    令牌用量统计，可以在线程和协程之间共享
+    """
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, prompt_tokens, completion_tokens):
+        """
+        累加一次请求的用量
+
+        参数:
+            prompt_tokens: 输入令牌数
+            completion_tokens: 输出令牌数
+        """
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.requests += 1
+
+    def as_dict(self):
+        """
+        返回:
+            dict: 用量字典
+        """
+        with self._lock:
+            return {
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "total_tokens": self.prompt_tokens + self.completion_tokens,
+                "requests": self.requests
+            }
+
+
+# 当前上下文（线程或协程）中正在统计的用量，由ZhipuAI.track_usage设置
+_current_usage = contextvars.ContextVar("zhipu_current_usage", default=None)
+
 
 class ZhipuAI:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, limiter=None, hedge_policy=None, cassette=None, request_timeout=None,
+                 router=None, planner=None):
         """
         初始化智谱AI客户端
-        
+
         参数:
-            api_key: 智谱AI的API密钥，如果为None，则从环境变量获取
+            api_key: 智谱AI的API密钥，可以是单个密钥、密钥列表或APIKeyPool；
+                     如果为None，则从环境变量ZHIPU_API_KEYS（逗号分隔）或ZHIPU_API_KEY获取
+            limiter: 自适应并发限制器，如果为None，则使用进程内共享的默认限制器
+            hedge_policy: 请求对冲策略（hedging.HedgePolicy），如果为None，则根据环境变量
+                          ZHIPU_HEDGE_PERCENTILE创建，未设置时不对冲
+            cassette: 请求录制/回放（api_cassette.Cassette），如果为None，则根据环境变量
+                      ZHIPU_CASSETTE创建，未设置时直接调用接口
+            request_timeout: 单次请求的超时（秒），如果为None，则读取环境变量ZHIPU_REQUEST_TIMEOUT，
+                             未设置时为180秒；处于deadline_scope中时不超过剩余期限
+            router: 模型级联（model_routing.ModelRouter），如果为None，则根据环境变量ZHIPU_FAST_MODEL创建，
+                    未设置时所有请求使用DEFAULT_MODEL
+            planner: 请求规划器（request_planner.RequestPlanner），如果为None，则根据环境变量
+                     ZHIPU_LATENCY_TARGET或ZHIPU_COST_TARGET创建，未设置时不限制输出长度
         """
         # 加载环境变量
         load_dotenv()
-        
+
         # 获取API密钥
-        self.api_key = api_key or os.getenv("ZHIPU_API_KEY")
-        if not self.api_key:
-            raise ValueError("未提供API密钥，请设置ZHIPU_API_KEY环境变量或在初始化时提供")
-        
-        # 初始化客户端
-        self.client = zhipuai.ZhipuAI(api_key=self.api_key)
-    
+        if isinstance(api_key, APIKeyPool):
+            self.key_pool = api_key
+        elif isinstance(api_key, (list, tuple)):
+            self.key_pool = APIKeyPool(api_key)
+        elif api_key:
+            self.key_pool = APIKeyPool([api_key])
+        else:
+            self.key_pool = APIKeyPool.from_env()
+        self.api_key = self.key_pool.keys[0].api_key
+
+        # 每个密钥一个客户端，异步客户端在首次使用时创建
+        self._clients = {
+            state.api_key: zhipuai.ZhipuAI(api_key=state.api_key) for state in self.key_pool.keys
+        }
+        self._async_clients = {}
+        self.client = self._clients[self.api_key]
+
+        # 所有模型调用都经过自适应并发限制器
+        self.limiter = limiter or get_default_limiter()
+
+        # 慢请求的对冲策略
+        self.hedge_policy = hedge_policy or HedgePolicy.from_env()
+
+        # 录制或回放接口请求，测试时不需要联网
+        self.cassette = cassette or Cassette.from_env()
+
+        # 单次请求的超时，卡住的连接不会一直占用并发名额
+        self.request_timeout = request_timeout or float(os.getenv(REQUEST_TIMEOUT_ENV_VAR) or DEFAULT_REQUEST_TIMEOUT)
+
+        # 按输入选择模型，快速模型的输出未通过检查时升级到大模型
+        self.router = router or ModelRouter.from_env(DEFAULT_MODEL)
+
+        # 按每个文档的延迟或成本目标选择模型、输出长度和分块，见request_planner.document_scope
+        self.planner = planner or RequestPlanner.from_env(DEFAULT_MODEL)
+
+        # 客户端累计的令牌用量
+        self.usage = TokenUsage()
+
+    def _get_async_client(self, api_key):
+        """
+        获取指定密钥的异步客户端（基于OpenAI兼容接口），首次调用时创建
+
+        参数:
+            api_key: API密钥
+
+        返回:
+            openai.AsyncOpenAI实例
+        """
+        if api_key not in self._async_clients:
+            if openai is None:
+                raise ImportError("异步接口需要安装openai库: pip install openai")
+            self._async_clients[api_key] = openai.AsyncOpenAI(
+                api_key=api_key,
+                base_url=ZHIPU_OPENAI_BASE_URL
+            )
+        return self._async_clients[api_key]
+
+    @contextlib.contextmanager
+    def track_usage(self):
+        """
+        统计代码块内（当前线程或协程及其子任务）所有模型调用的令牌用量
+
+        用法:
+            with zhipu.track_usage() as usage:
+                zhipu.summarize_text(text)
+            print(usage.total_tokens)
+        """
+        usage = TokenUsage()
+        token = _current_usage.set(usage)
+        try:
+            yield usage
+        finally:
+            _current_usage.reset(token)
+
+    def _record_usage(self, response):
+        """
+        记录一次响应的令牌用量
+
+        参数:
+            response: 对话补全接口的响应
+        """
+        usage = getattr(response, "usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        self.usage.add(prompt_tokens, completion_tokens)
+        current = _current_usage.get()
+        if current is not None:
+            current.add(prompt_tokens, completion_tokens)
+
+    @staticmethod
+    def _truncate_text(text, max_tokens):
+        """
+        如果文本太长，进行截断
+
+        参数:
+            text: 原始文本
+            max_tokens: 允许的最大令牌数
+
+        返回:
+            截断后的文本
+        """
+        if len(text) > max_tokens * 4:  # 粗略估计每个令牌4个字符
+            text = text[:max_tokens * 4]
+            text += "\n[文本因长度过长而被截断]"
+        return text
+
+    @staticmethod
+    def _strip_prefixes(content):
+        """
+        去除常见的回复前缀
+
+        参数:
+            content: 模型返回的内容
+
+        返回:
+            去除前缀后的内容
+        """
+        for prefix in RESPONSE_PREFIXES:
+            if content.startswith(prefix):
+                content = content[len(prefix):].lstrip()
+        return content
+
+    def _build_summary_messages(self, text, max_tokens=2000, as_questions=True, custom_instruction=None):
+        """
+        构建总结文本的对话消息
+
+        参数:
+            text: 要总结的文本
+            max_tokens: 响应的最大令牌数
+            as_questions: 如果为True，尽可能将内容格式化为问题形式
+            custom_instruction: 用户自定义处理说明
+
+        返回:
+            list: 发送给模型的消息列表
+        """
+        text = self._truncate_text(text, max_tokens)
+
+        system_prompt = "你是一位专业的文档分析助手，擅长从文档中提取和总结关键知识点。请只使用中文回答。直接给出内容，不要添加任何前缀如'好的'、'这是'等。"
+
+        if as_questions:
+            user_prompt = f"请总结以下文档内容。对于可以表述为问题的概念，请以问题形式呈现。对于无法自然地表述为问题的内容，请使用正常的描述性格式。将所有内容组织成结构清晰的总结，并分为明确的部分。请确保所有输出都是中文，不要使用任何英文。直接给出内容，不要添加任何前缀如'好的'、'这是'等"
+        else:
+            user_prompt = f"请总结以下文档内容，提取关键点，并将它们组织成结构化的总结。请确保所有输出都是中文，不要使用任何英文。直接给出内容，不要添加任何前缀如'好的'、'这是'等"
+
+        # 添加用户自定义说明
+        if custom_instruction:
+            user_prompt += f"。用户补充说明：{custom_instruction}"
+
+        user_prompt += f"：\n\n{text}"
+
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    def _build_concepts_messages(self, text, max_tokens=2000, as_questions=True, custom_instruction=None):
+        """
+        构建提取关键概念的对话消息
+
+        参数:
+            text: 要提取关键概念的文本
+            max_tokens: 响应的最大令牌数
+            as_questions: 如果为True，尽可能将概念格式化为问题形式
+            custom_instruction: 用户自定义处理说明
+
+        返回:
+            list: 发送给模型的消息列表
+        """
+        text = self._truncate_text(text, max_tokens)
+
+        system_prompt = "你是一位专业的知识提取助手，擅长从文本中提取关键概念和术语。请只使用中文回答。直接给出内容，不要添加任何前缀如'好的'、'这是'等。"
+
+        if as_questions:
+            user_prompt = f"请从以下文档中提取10-15个关键概念或术语。对于可以表述为问题的概念，请以问题形式呈现。对于无法自然地表述为问题的概念，请使用正常的描述性格式。为每个概念提供简要解释。请确保所有输出都是中文，不要使用任何英文。直接给出内容，不要添加任何前缀如'好的'、'这是'等"
+        else:
+            user_prompt = f"请从以下文档中提取10-15个关键概念或术语，并为每个概念提供简要解释。请确保所有输出都是中文，不要使用任何英文。直接给出内容，不要添加任何前缀如'好的'、'这是'等"
+
+        # 添加用户自定义说明
+        if custom_instruction:
+            user_prompt += f"。用户补充说明：{custom_instruction}"
+
+        user_prompt += f"：\n\n{text}"
+
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    def _build_chunk_messages(self, text, max_tokens=2000):
+        """
+        构建总结文档片段（map阶段）的对话消息
+
+        参数:
+            text: 文档片段
+            max_tokens: 响应的最大令牌数
+
+        返回:
+            list: 发送给模型的消息列表
+        """
+        text = self._truncate_text(text, max_tokens)
+
+        system_prompt = "你是一位专业的文档分析助手，擅长从文档中提取和总结关键知识点。请只使用中文回答。直接给出内容，不要添加任何前缀如'好的'、'这是'等。"
+        user_prompt = f"以下是一份长文档中的一个片段。请以简洁的条目列出该片段中的关键信息、要点、术语和数据，供之后汇总整篇文档使用。请确保所有输出都是中文，不要使用任何英文。直接给出内容，不要添加任何前缀如'好的'、'这是'等：\n\n{text}"
+
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    def _build_merge_messages(self, text, max_tokens=2000):
+        """
+        构建合并相邻分块要点（分层reduce阶段）的对话消息
+
+        参数:
+            text: 按页码范围标注的若干分块要点
+            max_tokens: 响应的最大令牌数
+
+        返回:
+            list: 发送给模型的消息列表
+        """
+        text = self._truncate_text(text, max_tokens)
+
+        system_prompt = "你是一位专业的文档分析助手，擅长从文档中提取和总结关键知识点。请只使用中文回答。直接给出内容，不要添加任何前缀如'好的'、'这是'等。"
+        user_prompt = f"以下是一份长文档中连续几个部分的要点，每部分标注了页码范围。请把它们合并为一份更简洁的要点列表，保留各部分的关键信息、术语和数据，去除重复内容，供之后汇总整篇文档使用。请确保所有输出都是中文，不要使用任何英文。直接给出内容，不要添加任何前缀如'好的'、'这是'等：\n\n{text}"
+
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    def _build_packed_messages(self, texts, as_questions=True, custom_instruction=None):
+        """
+        构建把多个小文档合并在一次请求中处理的对话消息
+
+        参数:
+            texts: 文档文本列表
+            as_questions: 如果为True，尽可能将内容格式化为问题形式
+            custom_instruction: 用户自定义处理说明
+
+        返回:
+            list: 发送给模型的消息列表
+        """
+        system_prompt = "你是一位专业的文档分析助手，擅长从文档中提取和总结关键知识点以及关键概念和术语。请只使用中文回答。直接给出内容，不要添加任何前缀如'好的'、'这是'等。"
+
+        if as_questions:
+            style = "对于可以表述为问题的内容和概念，请以问题形式呈现，无法自然地表述为问题的，请使用正常的描述性格式"
+        else:
+            style = "请提取关键点并组织成结构化的内容"
+
+        output_format = "\n".join([DOC_START.format("编号"), SUMMARY_MARK, "总结", CONCEPTS_MARK, "关键概念", DOC_END.format("编号")])
+        user_prompt = (
+            f"下面有{len(texts)}篇相互独立的文档，每篇以{DOC_START.format('编号')}开始、以{DOC_END.format('编号')}结束。"
+            f"请分别处理每篇文档：先总结文档内容，再提取5-10个关键概念或术语并为每个概念提供简要解释。{style}。"
+            f"严格按以下格式依次输出每篇文档的结果，保留所有分隔符，不要合并文档，不要遗漏任何编号：\n{output_format}\n"
+            f"请确保所有输出都是中文，不要使用任何英文。直接给出内容，不要添加任何前缀如'好的'、'这是'等"
+        )
+
+        # 添加用户自定义说明
+        if custom_instruction:
+            user_prompt += f"。用户补充说明：{custom_instruction}"
+
+        user_prompt += f"：\n\n{format_packed_documents(texts)}"
+
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    def _build_update_messages(self, previous_summary, added_text, removed_text, max_tokens=2000,
+                               as_questions=True, custom_instruction=None):
+        """
+        构建根据文档变化更新已有总结的对话消息
+
+        参数:
+            previous_summary: 相似文档（或旧版本）的已有总结
+            added_text: 新文档中新增的文本
+            removed_text: 新文档中删除的文本
+            max_tokens: 响应的最大令牌数
+            as_questions: 如果为True，尽可能将内容格式化为问题形式
+            custom_instruction: 用户自定义处理说明
+
+        返回:
+            list: 发送给模型的消息列表
+        """
+        # 新增和删除的文本各占一半的长度
+        added_text = self._truncate_text(added_text, max_tokens // 2)
+        removed_text = self._truncate_text(removed_text, max_tokens // 2)
+
+        system_prompt = "你是一位专业的文档分析助手，擅长从文档中提取和总结关键知识点。请只使用中文回答。直接给出内容，不要添加任何前缀如'好的'、'这是'等。"
+
+        user_prompt = "下面是一份文档的已有总结，以及该文档新版本相对于原文新增和删除的内容。请在已有总结的基础上进行修改，使其准确反映新版本的内容，保持原有的结构和格式"
+        if as_questions:
+            user_prompt += "，对于可以表述为问题的概念，请以问题形式呈现"
+        user_prompt += "。只输出更新后的完整总结。请确保所有输出都是中文，不要使用任何英文。直接给出内容，不要添加任何前缀如'好的'、'这是'等"
+
+        # 添加用户自定义说明
+        if custom_instruction:
+            user_prompt += f"。用户补充说明：{custom_instruction}"
+
+        user_prompt += f"：\n\n【已有总结】\n{previous_summary}\n\n【新增内容】\n{added_text or '无'}\n\n【删除内容】\n{removed_text or '无'}"
+
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    def _build_collection_messages(self, label, sections, max_tokens=2000, as_questions=True,
+                                   custom_instruction=None):
+        """
+        构建汇总文档集合（多篇文档或子集合的已有总结）的对话消息
+
+        参数:
+            label: 集合名称（例如文件夹路径）
+            sections: (标题, 总结) 列表
+            max_tokens: 响应的最大令牌数
+            as_questions: 如果为True，尽可能将内容格式化为问题形式
+            custom_instruction: 用户自定义处理说明
+
+        返回:
+            list: 发送给模型的消息列表
+        """
+        text = self._truncate_text("\n\n".join(f"【{title}】\n{summary}" for title, summary in sections), max_tokens)
+
+        system_prompt = "你是一位专业的文档分析助手，擅长从大量文档中归纳主题和知识结构。请只使用中文回答。直接给出内容，不要添加任何前缀如'好的'、'这是'等。"
+
+        user_prompt = (
+            f"以下是文档集合“{label}”中{len(sections)}个部分（单篇文档或子集合）的已有总结，每部分以【标题】开头。"
+            f"请综合这些总结写出整个集合的概述：涵盖哪些主题、各主题的主要内容和结论、各部分之间的联系，并指出代表性的文档"
+        )
+        if as_questions:
+            user_prompt += "，对于可以表述为问题的内容，请以问题形式呈现"
+        user_prompt += "。请确保所有输出都是中文，不要使用任何英文。直接给出内容，不要添加任何前缀如'好的'、'这是'等"
+
+        # 添加用户自定义说明
+        if custom_instruction:
+            user_prompt += f"。用户补充说明：{custom_instruction}"
+
+        user_prompt += f"：\n\n{text}"
+
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    def _has_spare_concurrency(self):
+        """并发限制器还有空闲名额时才值得发送对冲请求"""
+        return self.limiter.in_flight < self.limiter.limit
+
+    def _chat(self, messages, kind=None, text="", documents=None):
+        """
+        同步调用对话补全接口，启用对冲时慢请求会被对冲，启用模型级联时按输入选择模型
+
+        参数:
+            messages: 消息列表
+            kind: 请求类型（见model_routing.check_output），为None时不经过模型级联
+            text: 请求的输入文本（截断前），用于选择模型
+            documents: 打包请求中的文档数
+
+        返回:
+            去除前缀后的模型回复
+        """
+        # 当前文档有请求计划时按计划选择模型和输出长度，不再经过模型级联
+        plan = current_plan()
+        if plan is not None:
+            return self._reply(self._complete(messages, plan.model, plan.max_tokens))
+
+        if self.router is None or kind is None:
+            return self._reply(self._complete(messages))
+
+        started = time.monotonic()
+        model = self.router.choose(text)
+        calls = []
+        reason = None
+        if model != self.router.large_model:
+            try:
+                response = self._complete(messages, model)
+            except ABORT_ERRORS:
+                raise
+            except Exception as e:
+                print(f"{model}调用出错: {e}")
+                reason = "error"
+            else:
+                calls.append((model, response))
+                content = self._reply(response)
+                reason = check_output(kind, content, self._finish_reason(response), documents)
+                if reason is None:
+                    self.router.record(kind, "fast", time.monotonic() - started, calls)
+                    return content
+            print(f"{model}的输出未通过检查（{reason}），改用{self.router.large_model}")
+
+        response = self._complete(messages, self.router.large_model)
+        calls.append((self.router.large_model, response))
+        self.router.record(kind, "large" if reason is None else "escalated", time.monotonic() - started,
+                           calls, reason)
+        return self._reply(response)
+
+    def _complete(self, messages, model=DEFAULT_MODEL, max_tokens=None):
+        """
+        同步调用对话补全接口并记录用量，启用对冲时慢请求会被对冲
+
+        参数:
+            messages: 消息列表
+            model: 模型名称
+            max_tokens: 输出令牌数上限，为None时不限制
+
+        返回:
+            接口的响应
+        """
+        started = time.monotonic()
+        with profile_stage("api"):
+            if self.hedge_policy is None:
+                response = self._create(messages, model, max_tokens)
+            else:
+                # 对冲请求在线程池中执行，需要沿用当前的期限和取消标记
+                response = self.hedge_policy.run(model, carry_context(self._create), (messages, model, max_tokens),
+                                                 has_capacity=self._has_spare_concurrency,
+                                                 on_discarded=lambda discarded: self._record_discarded(
+                                                     model, discarded, started))
+        self._record_usage(response)
+        record_call(model, response, time.monotonic() - started)
+        return response
+
+    def _record_discarded(self, model, response, started):
+        """
+        记录对冲中被丢弃的请求：它的令牌同样被消耗，计入用量统计和当前文档的成本
+
+        参数:
+            model: 模型名称
+            response: 被丢弃请求的响应
+            started: 请求开始的时间（time.monotonic()）
+        """
+        self._record_usage(response)
+        record_call(model, response, time.monotonic() - started)
+
+    def _reply(self, response):
+        """去除前缀后的模型回复"""
+        return self._strip_prefixes(response.choices[0].message.content)
+
+    @staticmethod
+    def _finish_reason(response):
+        """接口返回的结束原因，回放的录制中没有时为None"""
+        return getattr(response.choices[0], "finish_reason", None)
+
+    @staticmethod
+    def _request_params(messages, model=DEFAULT_MODEL, max_tokens=None):
+        """
+        构建对话补全请求的参数
+
+        参数:
+            messages: 消息列表
+            model: 模型名称
+            max_tokens: 输出令牌数上限，为None时不发送（由接口决定）
+
+        返回:
+            dict: 传给chat.completions.create的参数
+        """
+        params = dict(model=model, messages=messages, **SAMPLING_PARAMS)
+        if max_tokens is not None:
+            params["max_tokens"] = max_tokens
+        return params
+
+    def _create(self, messages, model=DEFAULT_MODEL, max_tokens=None):
+        """
+        发送一次对话补全请求，启用录制/回放时先查找录制的响应
+
+        参数:
+            messages: 消息列表
+            model: 模型名称
+            max_tokens: 输出令牌数上限
+
+        返回:
+            接口的响应
+        """
+        if self.cassette is None:
+            return self._create_live(messages, model, max_tokens)
+        return self.cassette.fetch(self._request_params(messages, model, max_tokens),
+                                   lambda: self._create_live(messages, model, max_tokens))
+
+    def _create_live(self, messages, model=DEFAULT_MODEL, max_tokens=None):
+        """
+        调用接口发送一次对话补全请求（经过并发限制器和密钥池）
+
+        参数:
+            messages: 消息列表
+            model: 模型名称
+            max_tokens: 输出令牌数上限
+
+        返回:
+            接口的原始响应
+        """
+        # 等待名额和密钥期间定期检查取消和期限
+        check_deadline()
+        while not self.limiter.acquire(timeout=CANCEL_POLL_INTERVAL):
+            check_deadline()
+        try:
+            key_state = self.key_pool.acquire(timeout=CANCEL_POLL_INTERVAL)
+            while key_state is None:
+                check_deadline()
+                key_state = self.key_pool.acquire(timeout=CANCEL_POLL_INTERVAL)
+        except ABORT_ERRORS:
+            self.limiter.release(outcome="cancelled")
+            raise
+        start_time = time.monotonic()
+        try:
+            response = self._clients[key_state.api_key].chat.completions.create(
+                **self._request_params(messages, model, max_tokens), timeout=request_timeout(self.request_timeout)
+            )
+        except ABORT_ERRORS:
+            self.key_pool.release(key_state, "cancelled")
+            self.limiter.release(outcome="cancelled")
+            raise
+        except Exception as e:
+            outcome = "throttled" if is_rate_limit_error(e) else "error"
+            self.key_pool.release(key_state, "failed" if outcome == "error" and not is_key_error(e) else outcome)
+            self.limiter.release(outcome=outcome)
+            # 超时是因为文档期限已到时，报告为超过期限
+            check_deadline()
+            raise
+        latency = time.monotonic() - start_time
+        self.key_pool.release(key_state)
+        self.limiter.release(latency=latency)
+        # 对冲延迟只统计接口本身的耗时，不包括排队等待名额和密钥的时间，也不包括回放的录制
+        if self.hedge_policy is not None:
+            self.hedge_policy.observe(model, latency)
+        return response
+
+    async def _chat_async(self, messages, kind=None, text="", documents=None):
+        """
+        _chat的异步版本，对冲时落后的请求被取消
+
+        参数:
+            messages: 消息列表
+            kind: 请求类型，为None时不经过模型级联
+            text: 请求的输入文本（截断前），用于选择模型
+            documents: 打包请求中的文档数
+
+        返回:
+            去除前缀后的模型回复
+        """
+        plan = current_plan()
+        if plan is not None:
+            return self._reply(await self._complete_async(messages, plan.model, plan.max_tokens))
+
+        if self.router is None or kind is None:
+            return self._reply(await self._complete_async(messages))
+
+        started = time.monotonic()
+        model = self.router.choose(text)
+        calls = []
+        reason = None
+        if model != self.router.large_model:
+            try:
+                response = await self._complete_async(messages, model)
+            except ABORT_ERRORS:
+                raise
+            except Exception as e:
+                print(f"{model}调用出错: {e}")
+                reason = "error"
+            else:
+                calls.append((model, response))
+                content = self._reply(response)
+                reason = check_output(kind, content, self._finish_reason(response), documents)
+                if reason is None:
+                    self.router.record(kind, "fast", time.monotonic() - started, calls)
+                    return content
+            print(f"{model}的输出未通过检查（{reason}），改用{self.router.large_model}")
+
+        response = await self._complete_async(messages, self.router.large_model)
+        calls.append((self.router.large_model, response))
+        self.router.record(kind, "large" if reason is None else "escalated", time.monotonic() - started,
+                           calls, reason)
+        return self._reply(response)
+
+    async def _complete_async(self, messages, model=DEFAULT_MODEL, max_tokens=None):
+        """
+        _complete的异步版本
+
+        参数:
+            messages: 消息列表
+            model: 模型名称
+            max_tokens: 输出令牌数上限，为None时不限制
+
+        返回:
+            接口的响应
+        """
+        started = time.monotonic()
+        if self.hedge_policy is None:
+            response = await self._create_async(messages, model, max_tokens)
+        else:
+            response = await self.hedge_policy.run_async(model, self._create_async, (messages, model, max_tokens),
+                                                         has_capacity=self._has_spare_concurrency,
+                                                         on_discarded=lambda discarded: self._record_discarded(
+                                                             model, discarded, started))
+        self._record_usage(response)
+        record_call(model, response, time.monotonic() - started)
+        return response
+
+    async def _create_async(self, messages, model=DEFAULT_MODEL, max_tokens=None):
+        """
+        异步发送一次对话补全请求，启用录制/回放时先查找录制的响应
+
+        参数:
+            messages: 消息列表
+            model: 模型名称
+            max_tokens: 输出令牌数上限
+
+        返回:
+            接口的响应
+        """
+        if self.cassette is None:
+            return await self._create_live_async(messages, model, max_tokens)
+        return await self.cassette.fetch_async(self._request_params(messages, model, max_tokens),
+                                               lambda: self._create_live_async(messages, model, max_tokens))
+
+    async def _create_live_async(self, messages, model=DEFAULT_MODEL, max_tokens=None):
+        """
+        调用接口异步发送一次对话补全请求（经过并发限制器和密钥池）
+
+        参数:
+            messages: 消息列表
+            model: 模型名称
+            max_tokens: 输出令牌数上限
+
+        返回:
+            接口的原始响应
+        """
+        check_deadline()
+        await self.limiter.acquire_async()
+        try:
+            key_state = await self.key_pool.acquire_async()
+        except asyncio.CancelledError:
+            self.limiter.release(outcome="cancelled")
+            raise
+        start_time = time.monotonic()
+        try:
+            client = self._get_async_client(key_state.api_key)
+            response = await client.chat.completions.create(**self._request_params(messages, model, max_tokens),
+                                                            timeout=request_timeout(self.request_timeout))
+        except (asyncio.CancelledError, *ABORT_ERRORS):
+            self.key_pool.release(key_state, "cancelled")
+            self.limiter.release(outcome="cancelled")
+            raise
+        except Exception as e:
+            outcome = "throttled" if is_rate_limit_error(e) else "error"
+            self.key_pool.release(key_state, "failed" if outcome == "error" and not is_key_error(e) else outcome)
+            self.limiter.release(outcome=outcome)
+            raise
+        latency = time.monotonic() - start_time
+        self.key_pool.release(key_state)
+        self.limiter.release(latency=latency)
+        # 对冲延迟只统计接口本身的耗时，不包括排队等待名额和密钥的时间，也不包括回放的录制
+        if self.hedge_policy is not None:
+            self.hedge_policy.observe(model, latency)
+        return response
+
+    def get_metrics(self):
+        """
+        获取客户端运行指标
+
+        返回:
+            dict: 包含当前并发上限和各密钥状态等指标的字典
+        """
+        metrics = {
+            "concurrency": self.limiter.snapshot(),
+            "api_keys": self.key_pool.snapshot(),
+            "usage": self.usage.as_dict()
+        }
+        if self.hedge_policy is not None:
+            metrics["hedging"] = self.hedge_policy.snapshot()
+        if self.router is not None:
+            metrics["routing"] = self.router.snapshot()
+        if self.planner is not None:
+            metrics["planning"] = self.planner.snapshot()
+        return metrics
+
     def summarize_text(self, text, max_tokens=2000, as_questions=True, custom_instruction=None):
         """
         使用智谱AI总结文本
-        
+
         参数:
             text: 要总结的文本
             max_tokens: 响应的最大令牌数
             as_questions: 如果为True，尽可能将内容格式化为问题形式
             custom_instruction: 用户自定义处理说明
-            
+
         返回:
             文本的总结
         """
-        # 如果文本太长，进行截断
-        if len(text) > max_tokens * 4:  # 粗略估计每个令牌4个字符
-            text = text[:max_tokens * 4]
-            text += "\n[文本因长度过长而被截断]"
-        
         try:
-            system_prompt = "你是一位专业的文档分析助手，擅长从文档中提取和总结关键知识点。请只使用中文回答。直接给出内容，不要添加任何前缀如'好的'、'这是'等。"
-            
-            if as_questions:
-                user_prompt = f"请总结以下文档内容。对于可以表述为问题的概念，请以问题形式呈现。对于无法自然地表述为问题的内容，请使用正常的描述性格式。将所有内容组织成结构清晰的总结，并分为明确的部分。请确保所有输出都是中文，不要使用任何英文。直接给出内容，不要添加任何前缀如'好的'、'这是'等"
-            else:
-                user_prompt = f"请总结以下文档内容，提取关键点，并将它们组织成结构化的总结。请确保所有输出都是中文，不要使用任何英文。直接给出内容，不要添加任何前缀如'好的'、'这是'等"
-                
-            # 添加用户自定义说明
-            if custom_instruction:
-                user_prompt += f"。用户补充说明：{custom_instruction}"
-                
-            user_prompt += f"：\n\n{text}"
-            
-            response = self.client.chat.completions.create(
-                model="glm-4.6",
-                messages=[
-                    {"role": "system", "content": system_prompt}, 
-                    {"role": "user", "content": user_prompt}
-                ],
-                top_p=0.7,
-                temperature=0.3
-            )
-            content = response.choices[0].message.content
-            
-            # 去除常见的回复前缀
-            prefixes = [
-                "好的，", "这是", "以下是", "下面是", "这里是", 
-                "好的。", "这是对", "以下是对", "下面是对", "这里是对"
-            ]
-            
-            for prefix in prefixes:
-                if content.startswith(prefix):
-                    content = content[len(prefix):].lstrip()
-            
-            return content
+            messages = self._build_summary_messages(text, max_tokens, as_questions, custom_instruction)
+            return self._chat(messages, "summary", text)
+        except ABORT_ERRORS:
+            raise
         except Exception as e:
             print(f"总结文本时出错: {e}")
             return f"错误: {str(e)}"
-    
+
     def extract_key_concepts(self, text, max_tokens=2000, as_questions=True, custom_instruction=None):
         """
         从文本中提取关键概念
-        
+
         参数:
             text: 要提取关键概念的文本
             max_tokens: 响应的最大令牌数
             as_questions: 如果为True，尽可能将概念格式化为问题形式
             custom_instruction: 用户自定义处理说明
-            
+
         返回:
             从文本中提取的关键概念
         """
-        # 如果文本太长，进行截断
-        if len(text) > max_tokens * 4:
-            text = text[:max_tokens * 4]
-            text += "\n[文本因长度过长而被截断]"
-        
         try:
-            system_prompt = "你是一位专业的知识提取助手，擅长从文本中提取关键概念和术语。请只使用中文回答。直接给出内容，不要添加任何前缀如'好的'、'这是'等。"
-            
-            if as_questions:
-                user_prompt = f"请从以下文档中提取10-15个关键概念或术语。对于可以表述为问题的概念，请以问题形式呈现。对于无法自然地表述为问题的概念，请使用正常的描述性格式。为每个概念提供简要解释。请确保所有输出都是中文，不要使用任何英文。直接给出内容，不要添加任何前缀如'好的'、'这是'等"
-            else:
-                user_prompt = f"请从以下文档中提取10-15个关键概念或术语，并为每个概念提供简要解释。请确保所有输出都是中文，不要使用任何英文。直接给出内容，不要添加任何前缀如'好的'、'这是'等"
-            
-            # 添加用户自定义说明
-            if custom_instruction:
-                user_prompt += f"。用户补充说明：{custom_instruction}"
-                
-            user_prompt += f"：\n\n{text}"
-            
-            response = self.client.chat.completions.create(
-                model="glm-4.6",
-                messages=[
-                    {"role": "system", "content": system_prompt}, 
-                    {"role": "user", "content": user_prompt}
-                ],
-                top_p=0.7,
-                temperature=0.3
-            )
-            content = response.choices[0].message.content
-            
-            # 去除常见的回复前缀
-            prefixes = [
-                "好的，", "这是", "以下是", "下面是", "这里是", 
-                "好的。", "这是对", "以下是对", "下面是对", "这里是对"
-            ]
-            
-            for prefix in prefixes:
-                if content.startswith(prefix):
-                    content = content[len(prefix):].lstrip()
-            
-            return content
+            messages = self._build_concepts_messages(text, max_tokens, as_questions, custom_instruction)
+            return self._chat(messages, "concepts", text)
+        except ABORT_ERRORS:
+            raise
         except Exception as e:
             print(f"提取关键概念时出错: {e}")
-            return f"错误: {str(e)}"
\ No newline at end of file
+            return f"错误: {str(e)}"
+
+    def summarize_chunk(self, text, max_tokens=2000):
+        """
+        总结长文档中的一个片段，结果用于之后汇总整篇文档
+
+        参数:
+            text: 文档片段
+            max_tokens: 响应的最大令牌数
+
+        返回:
+            片段的要点
+        """
+        try:
+            return self._chat(self._build_chunk_messages(text, max_tokens), "chunk", text)
+        except ABORT_ERRORS:
+            raise
+        except Exception as e:
+            print(f"总结文档片段时出错: {e}")
+            return f"错误: {str(e)}"
+
+    def merge_chunk_summaries(self, text, max_tokens=2000):
+        """
+        把相邻分块的要点合并为一份，分块总结太多、一次汇总请求放不下时逐层使用
+
+        参数:
+            text: 按页码范围标注的若干分块要点
+            max_tokens: 响应的最大令牌数
+
+        返回:
+            合并后的要点
+        """
+        try:
+            return self._chat(self._build_merge_messages(text, max_tokens), "chunk", text)
+        except ABORT_ERRORS:
+            raise
+        except Exception as e:
+            print(f"合并分块要点时出错: {e}")
+            return f"错误: {str(e)}"
+
+    def summarize_packed(self, texts, as_questions=True, custom_instruction=None):
+        """
+        在一次请求中总结多个小文档并提取各自的关键概念
+
+        参数:
+            texts: 文档文本列表
+            as_questions: 如果为True，尽可能将内容格式化为问题形式
+            custom_instruction: 用户自定义处理说明
+
+        返回:
+            dict: {文档下标(从0开始): (总结, 关键概念)}，拆分失败或请求出错的文档不包含在内
+        """
+        try:
+            messages = self._build_packed_messages(texts, as_questions, custom_instruction)
+            content = self._chat(messages, "packed", "".join(texts), documents=len(texts))
+        except ABORT_ERRORS:
+            raise
+        except Exception as e:
+            print(f"批量总结文本时出错: {e}")
+            return {}
+
+        results = {}
+        for index, (summary, concepts) in split_packed_response(content, len(texts)).items():
+            results[index - 1] = (self._strip_prefixes(summary), self._strip_prefixes(concepts))
+        return results
+
+    def update_summary(self, previous_summary, added_text, removed_text, max_tokens=2000,
+                       as_questions=True, custom_instruction=None):
+        """
+        只根据文档的变化部分更新已有总结，比重新总结全文便宜得多
+
+        参数:
+            previous_summary: 相似文档（或旧版本）的已有总结
+            added_text: 新文档中新增的文本
+            removed_text: 新文档中删除的文本
+            max_tokens: 响应的最大令牌数
+            as_questions: 如果为True，尽可能将内容格式化为问题形式
+            custom_instruction: 用户自定义处理说明
+
+        返回:
+            更新后的总结
+        """
+        try:
+            messages = self._build_update_messages(previous_summary, added_text, removed_text, max_tokens,
+                                                   as_questions, custom_instruction)
+            return self._chat(messages, "update", previous_summary + added_text + removed_text)
+        except ABORT_ERRORS:
+            raise
+        except Exception as e:
+            print(f"更新总结时出错: {e}")
+            return f"错误: {str(e)}"
+
+    def summarize_collection(self, label, sections, max_tokens=2000, as_questions=True, custom_instruction=None):
+        """
+        把多篇文档或子集合的已有总结汇总为一个集合概述
+
+        参数:
+            label: 集合名称（例如文件夹路径）
+            sections: (标题, 总结) 列表
+            max_tokens: 响应的最大令牌数
+            as_questions: 如果为True，尽可能将内容格式化为问题形式
+            custom_instruction: 用户自定义处理说明
+
+        返回:
+            集合概述
+        """
+        try:
+            messages = self._build_collection_messages(label, sections, max_tokens, as_questions, custom_instruction)
+            return self._chat(messages, "collection", "".join(summary for _, summary in sections))
+        except ABORT_ERRORS:
+            raise
+        except Exception as e:
+            print(f"汇总文档集合时出错: {e}")
+            return f"错误: {str(e)}"
+
+    async def summarize_text_async(self, text, max_tokens=2000, as_questions=True, custom_instruction=None):
+        """
+        summarize_text的异步版本，适合在单个事件循环中并发处理大量请求
+
+        参数:
+            text: 要总结的文本
+            max_tokens: 响应的最大令牌数
+            as_questions: 如果为True，尽可能将内容格式化为问题形式
+            custom_instruction: 用户自定义处理说明
+
+        返回:
+            文本的总结
+        """
+        try:
+            messages = self._build_summary_messages(text, max_tokens, as_questions, custom_instruction)
+            return await self._chat_async(messages, "summary", text)
+        except ABORT_ERRORS:
+            raise
+        except Exception as e:
+            print(f"总结文本时出错: {e}")
+            return f"错误: {str(e)}"
+
+    async def extract_key_concepts_async(self, text, max_tokens=2000, as_questions=True, custom_instruction=None):
+        """
+        extract_key_concepts的异步版本
+
+        参数:
+            text: 要提取关键概念的文本
+            max_tokens: 响应的最大令牌数
+            as_questions: 如果为True，尽可能将概念格式化为问题形式
+            custom_instruction: 用户自定义处理说明
+
+        返回:
+            从文本中提取的关键概念
+        """
+        try:
+            messages = self._build_concepts_messages(text, max_tokens, as_questions, custom_instruction)
+            return await self._chat_async(messages, "concepts", text)
+        except ABORT_ERRORS:
+            raise
+        except Exception as e:
+            print(f"提取关键概念时出错: {e}")
+            return f"错误: {str(e)}"
+
+    async def aclose(self):
+        """
+        关闭异步客户端，释放连接池
+        """
+        for client in self._async_clients.values():
+            await client.close()
+        self._async_clients = {}